@@ -0,0 +1,160 @@
+from hotstuff.hotstuff_types import *
+
+# height of the block a skip pointer jumps to, same scheme as bitcoin's
+# CBlockIndex::pskip, any ancestor is reachable in O(log height) hops
+def invert_lowest_one(n):
+	return n & (n - 1)
+
+def skip_height(height):
+	if height < 2:
+		return 0
+	if height & 1:
+		return invert_lowest_one(invert_lowest_one(height - 1)) + 1
+	return invert_lowest_one(height)
+
+# blocks by hash, with height and a skip pointer filled in on insert
+# everything at or below the committed height that isn't committed is pruned
+# a store restored from a snapshot starts at the snapshot's block and height
+# only the last keep committed blocks and their proofs are kept, that is
+# what sync serves, whoever is further behind takes a snapshot instead
+class Block_store:
+	KEEP = 4096
+
+	def __init__(self, genesis=GENESIS_BLOCK, height=0, keep=None):
+		self.keep = max(1, keep if keep is not None else Block_store.KEEP)
+		genesis.height = height
+		genesis.skip_hash = None
+		self.base_height = height
+		self.blocks = {genesis.hash: genesis}
+		self.committed = [genesis] # height - base_height -> block
+		self.uncommitted = {} # height -> set of hashes
+		# height -> (QCs that committed the block there, the blocks above it
+		# the later QCs are for), see Replica.proven_block
+		self.proofs = {}
+
+	@property
+	def committed_height(self):
+		return self.base_height + len(self.committed) - 1
+
+	def committed_at(self, height):
+		if height < self.base_height or height > self.committed_height:
+			return None
+		return self.committed[height - self.base_height]
+
+	@property
+	def tip(self):
+		return self.committed[-1]
+
+	def __contains__(self, block_hash):
+		return block_hash in self.blocks
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def get(self, block_hash):
+		return self.blocks.get(block_hash)
+
+	# returns the stored copy, None if the parent isn't known (yet)
+	# or the block would sit on an already committed height
+	def add(self, block):
+		stored = self.blocks.get(block.hash)
+		if stored is not None:
+			return stored
+		parent = self.parent(block)
+		if parent is None or parent.height + 1 <= self.committed_height:
+			return None
+		block.height = parent.height + 1
+		skip = self.ancestor(parent, skip_height(block.height))
+		block.skip_hash = skip.hash if skip is not None else None
+		self.blocks[block.hash] = block
+		self.uncommitted.setdefault(block.height, set()).add(block.hash)
+		return block
+
+	def parent(self, block):
+		if block.parent_hash is None:
+			return None
+		return self.blocks.get(block.parent_hash)
+
+	def ancestor(self, block, height):
+		if height < 0 or height > block.height:
+			return None
+		walk = block
+		while walk is not None and walk.height > height:
+			if walk.height <= self.committed_height:
+				# only the committed chain is left down here
+				if self.committed_at(walk.height).hash != walk.hash:
+					return None
+				return self.committed_at(height)
+			walk_skip = skip_height(walk.height)
+			prev_skip = skip_height(walk.height - 1)
+			if walk.skip_hash is not None and walk_skip >= self.base_height and \
+				(walk_skip == height or \
+				(walk_skip > height and not \
+				(prev_skip < walk_skip - 2 and prev_skip >= height))):
+				walk = self.blocks.get(walk.skip_hash)
+			else:
+				walk = self.parent(walk)
+		return walk
+
+	def extends(self, block, from_block):
+		block = self.blocks.get(block.hash)
+		from_block = self.blocks.get(from_block.hash)
+		if block is None or from_block is None:
+			return False
+		found = self.ancestor(block, from_block.height)
+		return found is not None and found.hash == from_block.hash
+
+	# blocks between the committed tip and block, oldest first
+	# None if block doesn't extend the committed chain
+	def uncommitted_chain(self, block):
+		block = self.blocks.get(block.hash)
+		if block is None or not self.extends(block, self.tip):
+			return None
+		chain = []
+		while block.height > self.committed_height:
+			chain.append(block)
+			block = self.parent(block)
+		chain.reverse()
+		return chain
+
+	# commits block and its uncommitted ancestors, returns them oldest first
+	# proof is the QCs that committed block, the first one is for block
+	def commit(self, block, proof=None):
+		chain = self.uncommitted_chain(block)
+		if not chain:
+			return []
+		above = [self.blocks.get(qc.block_hash) for qc in proof[1:]] if proof else []
+		for block in chain:
+			self.committed.append(block)
+		if proof is not None and None not in above:
+			self.proofs[self.committed_height] = (proof, above)
+		self.prune()
+		self.trim()
+		return chain
+
+	# once twice as many as we keep, so a commit doesn't copy the list
+	def trim(self):
+		drop = len(self.committed) - self.keep
+		if len(self.committed) <= 2 * self.keep or drop <= 0:
+			return
+		for block in self.committed[:drop]:
+			del self.blocks[block.hash]
+		self.committed = self.committed[drop:]
+		self.base_height += drop
+		for height in [h for h in self.proofs if h < self.base_height]:
+			del self.proofs[height]
+
+	# the first height from height on towards limit, which may be below
+	# it, that has a commit proof
+	def proven_height(self, height, limit):
+		step = 1 if limit >= height else -1
+		for proven in range(height, limit + step, step):
+			if proven <= self.committed_height and proven in self.proofs:
+				return proven
+		return None
+
+	def prune(self):
+		for height in [h for h in self.uncommitted if h <= self.committed_height]:
+			for block_hash in self.uncommitted.pop(height):
+				if block_hash != self.committed_at(height).hash:
+					del self.blocks[block_hash]
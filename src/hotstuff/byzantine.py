@@ -1,98 +1,70 @@
 import copy
+import logging
 import random
+from hotstuff.codec import *
 from hotstuff.network import *
 from hotstuff.replica import *
 from hotstuff.hotstuff_types import *
 
 class Crash_replica(Replica):
-	def __init__(self, replica_id, network, crash_view):
-		super(Crash_replica, self).__init__(replica_id, network)
-		self.crash_view = crash_view
+	FAULT = "CRASH"
 
-	def trace(self, string):
-		print(f"[R{self.replica_id}][CRASH] {string}")
+	def __init__(self, replica_id, network, crash_view, **kwargs):
+		super(Crash_replica, self).__init__(replica_id, network, **kwargs)
+		self.crash_view = crash_view
 
-	async def message_handler(self):
-		while self.running:
-			if self.current_view == self.crash_view:
-				self.trace(f"REPLICA CRASHED AT {self.current_view}")
-				self.pacemaker.stop_timer()
-				self.running = False
-			try:
-				payload = await asyncio.wait_for(self.network.inbox.get(), timeout=1.0)
-				if isinstance(payload, Command):
-					await self.handle_client_cmd(payload)
-					continue
-				
-				match payload.phase:
-					case Protocol_phase.NEW_VIEW:
-						await self.handle_new_view(payload)
-					case Protocol_phase.PREPARE:
-						await self.handle_prepare(payload)
-					case Protocol_phase.PREPARE_VOTE:
-						await self.handle_prepare_vote(payload)
-					case Protocol_phase.PRECOMMIT:
-						await self.handle_precommit(payload)
-					case Protocol_phase.PRECOMMIT_VOTE:
-						await self.handle_precommit_vote(payload)
-					case Protocol_phase.COMMIT:
-						await self.handle_commit(payload)
-					case Protocol_phase.COMMIT_VOTE:
-						await self.handle_commit_vote(payload)
-					case Protocol_phase.DECIDE:
-						await self.handle_decide(payload)
-					
-			except asyncio.TimeoutError:
-				continue
+	async def dispatch(self, payload):
+		if self.current_view >= self.crash_view:
+			self.trace("REPLICA CRASHED AT %d", self.current_view, level=logging.WARNING)
+			self.pacemaker.stop_timer()
+			self.running = False
+			return
+		await super().dispatch(payload)
 
 class Delayed_replica(Replica):
-	def trace(self, string):
-		print(f"[R{self.replica_id}][DELAYED] {string}")
+	FAULT = "DELAYED"
 
 class Malicious_replica(Replica):
-	def trace(self, string):
-		print(f"[R{self.replica_id}][MALICIOUS] {string}")
+	FAULT = "MALICIOUS"
 
-class Delayed_network(Network):
+# the faulty behaviours work on top of any network (TCP or simulated),
+# Delayed_network and Malicious_network are the TCP ones
+class Delayed_sends:
 	async def send(self, recipient_id, msg):
-		if recipient_id == self.replica_id:
-			await self.inbox.put(msg)
-			return
+		if recipient_id != self.replica_id:
+			await asyncio.sleep(0.01 * msg.view_number)
+		await super().send(recipient_id, msg)
 
-		if not await self.connect(recipient_id):
-			return
-
-		_, writer = self.replica_conns[recipient_id]
-		
-		packet = pickle.dumps(msg)
-		msg_byte_count = len(packet)
-
-		await asyncio.sleep(0.01 * msg.view_number)
-		writer.write(msg_byte_count.to_bytes(4, 'big'))
-		writer.write(packet)
-		await writer.drain()
-
-class Malicious_network(Network):
+class Malicious_broadcasts:
 	async def broadcast(self, msg):
 		tasks = []
-		for replica_id in self.replica_addresses:
-			cmd = msg.block.cmd
-			mal_cmd = Command(cmd.op, copy.deepcopy(cmd.args), cmd.client_id)
-			mal_cmd.args[1] = random.randint(1, 1000) 
-			mal_cmd.hash = mal_cmd.calculate_hash()
+		for replica_id in self.config.replica_ids:
+			mal_cmds = []
+			for cmd in msg.block.cmds:
+				mal_cmd = Command(cmd.op, copy.deepcopy(cmd.args), cmd.client_id,
+				                  cmd.request_id)
+				# its hash is only worked out once someone asks for it
+				mal_cmd.args[1] = random.randint(1, 1000) 
+				mal_cmds.append(mal_cmd)
 			mal_block = Block(
-					mal_cmd,
-					msg.justify.block,
+					mal_cmds,
+					msg.justify.block_hash,
 					msg.view_number
 			)
+			mal_block.justify = msg.justify
 
 			mal_msg = Message(
-					Protocol_phase.PREPARE,
+					msg.phase,
 					msg.view_number,
 					mal_block,
 					msg.justify,
-					msg.sender
+					sender=msg.sender
 			)
 			tasks.append(self.send(replica_id, mal_msg))
 		await asyncio.gather(*tasks)
 
+class Delayed_network(Delayed_sends, Network):
+	pass
+
+class Malicious_network(Malicious_broadcasts, Network):
+	pass
@@ -1,80 +1,228 @@
 import asyncio
+import logging
 from hotstuff.hotstuff_types import *
-from hotstuff.replica import *
+from hotstuff.codec import *
 
+logger = logging.getLogger(__name__)
+
+# a command waiting for F+1 replicas to say they committed it, or a query
+# waiting for F+1 matching answers
+class Pending_request:
+	def __init__(self, cmd, future):
+		self.cmd = cmd
+		self.future = future
+		self.replies = {} # cmd hash (query: height, result) -> ids of replicas
+		self.sent_at = now()
+		self.target = None # replica it was last sent to
+
+# keeps up to window commands in flight at once
+# one connection per replica, a receiver task per connection matches
+# replies to pending requests by request_id
+# commands only go to the replica we think leads, it forwards them if it
+# doesn't, on a timeout we move on to the next one
 class Client:
-	def __init__(self, client_id, replica_addresses, timeout):
+	# config is the cluster's Cluster_config, timeout is per request
+	def __init__(self, client_id, config, timeout, window=64):
 		self.client_id = client_id
 		self.timeout = timeout
-		self.replica_addresses = replica_addresses
+		self.config = config
+		self.leader_index = 0
 		self.replica_conns = {}
-		self.responses = []
+		self.receivers = {}
+		self.drivers = set()
+		# so concurrent requests don't each open their own connection
+		self.connect_lock = asyncio.Lock()
+		self.window = asyncio.Semaphore(window)
+		self.pending = {} # request_id -> Pending_request
+		self.queries = {} # request_id -> Pending_request
+		self.next_request_id = 1
+		self.completed = 0
+		self.queries_completed = 0
+		self.latencies = []
 
 	async def connect(self, replica_id):
+		if replica_id in self.replica_conns:
+			return True
+		async with self.connect_lock:
+			return await self.open_connection(replica_id)
+
+	async def open_connection(self, replica_id):
 		if replica_id in self.replica_conns:
 			return True
 
-		if replica_id not in self.replica_addresses:
+		if not self.config.is_member(replica_id):
 			return False
-		
+
 		for attempt in range(3):
 			try:
-				host, port = self.replica_addresses[replica_id]
-				self.replica_conns[replica_id] = await asyncio.open_connection(host, port)
-				self.trace(f"Connected to {self.replica_addresses[replica_id]}!")
+				host, port = self.config.replica_addresses[replica_id]
+				reader, writer = await asyncio.open_connection(host, port)
+				self.replica_conns[replica_id] = (reader, writer)
+				self.receivers[replica_id] = asyncio.create_task(
+					self.receive(replica_id, reader)
+				)
+				self.trace("Connected to %s!", self.config.replica_addresses[replica_id])
+				await self.send(replica_id, Client_hello(self.client_id))
 				return True
 			except ConnectionRefusedError:
 				await asyncio.sleep(0.2)
-		self.trace(f"Connection to {self.replica_addresses[replica_id]} failed!")
+		self.trace("Connection to %s failed!", self.config.replica_addresses[replica_id],
+		           level=logging.WARNING)
 		return False
 
-	def trace(self, string):
-		print(f"[C{self.client_id}] {string}")
+	def trace(self, message, *args, level=logging.DEBUG):
+		if logger.isEnabledFor(level):
+			logger.log(level, f"[C{self.client_id}] {message}", *args)
+
+	async def send(self, recipient_id, payload):
+		_, writer = self.replica_conns[recipient_id]
+		writer.write(frame(encode(payload)))
+		try:
+			await writer.drain()
+		except ConnectionError:
+			self.disconnect(recipient_id)
 
 	async def send_cmd(self, recipient_id, cmd):
-		# SEND
-		if not await self.connect(recipient_id):
-			return	
-		reader, writer = self.replica_conns[recipient_id]
-		
-		packet = pickle.dumps(cmd)
-		packet_byte_count = len(packet)
-
-		writer.write(packet_byte_count.to_bytes(4, 'big'))
-		writer.write(packet)
-		await writer.drain()
-		# RECV
-		# first 32 bits of message are the byte count
-		packet_byte_count = await reader.readexactly(4)
-		packet_byte_count = int.from_bytes(packet_byte_count, 'big')				
-
-		packet = await reader.read(packet_byte_count)
-		if not packet:
-			return	
-
-		response = pickle.loads(packet)
-		return response
-
-	async def broadcast_cmd(self, cmd):
-		responses = []
-		pending = []
-		self.trace(f"Broadcasting {cmd}")
-		for replica_id in self.replica_addresses:
-			pending.append(asyncio.create_task(self.send_cmd(replica_id, cmd)))
-
-		while len(responses) < Replica.F + 1:
-			done, pending = await asyncio.wait(
-				pending,
-				timeout=self.timeout,
-				return_when=asyncio.FIRST_COMPLETED
-			)
-			for task in done:
-				if task.exception() is None and task.result() is not None:
-					responses.append(task.result())
-			if not pending:
-				break
+		if await self.connect(recipient_id):
+			await self.send(recipient_id, cmd)
+
+	# every replica has to know our connection to reply on it
+	async def connect_all(self):
+		await asyncio.gather(*[
+			self.connect(replica_id) for replica_id in self.config.replica_ids
+		])
+
+	@property
+	def leader(self):
+		return self.config.replica_ids[self.leader_index]
+
+	# only the first request to time out on a leader moves us on
+	def suspect(self, replica_id):
+		if replica_id == self.leader:
+			self.leader_index = (self.leader_index + 1) % len(self.config.replica_ids)
+			self.trace("R%s isn't making progress, trying R%s", replica_id, self.leader,
+			           level=logging.INFO)
+
+	def disconnect(self, replica_id):
+		conn = self.replica_conns.pop(replica_id, None)
+		if conn is not None:
+			conn[1].close()
+		receiver = self.receivers.pop(replica_id, None)
+		if receiver is not None and receiver is not asyncio.current_task():
+			receiver.cancel()
+
+	async def receive(self, replica_id, reader):
+		frames = Frame_reader(reader)
+		try:
+			while True:
+				for reply in await frames.read():
+					self.handle_reply(replica_id, reply)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		except Codec_error as e:
+			self.trace("Bad reply from R%s: %s", replica_id, e, level=logging.WARNING)
+		finally:
+			self.disconnect(replica_id)
+
+	def handle_reply(self, replica_id, reply):
+		if isinstance(reply, Command):
+			self.on_reply(replica_id, reply)
+		elif isinstance(reply, Query_reply):
+			self.on_query_reply(replica_id, reply)
+
+	# a request is done once F+1 replicas replied with the same command,
+	# at least one of them is honest
+	def on_reply(self, replica_id, reply):
+		request = self.pending.get(reply.request_id)
+		if request is None or reply.client_id != self.client_id:
+			return
+		repliers = request.replies.setdefault(reply.hash, set())
+		repliers.add(replica_id)
+		if len(repliers) < self.config.f + 1:
+			return
+		del self.pending[reply.request_id]
+		self.completed += 1
+		self.latencies.append(now() - request.sent_at)
+		if not request.future.done():
+			request.future.set_result(reply)
+
+	# F+1 replicas at the same committed height with the same answer, at
+	# least one of them is honest so that's the committed state
+	# results are compared by repr, honest replicas build them the same way
+	# a query they all refused raises Query_error
+	def on_query_reply(self, replica_id, reply):
+		request = self.queries.get(reply.request_id)
+		if request is None or reply.client_id != self.client_id:
+			return
+		key = (reply.height, repr(reply.result), reply.error)
+		repliers = request.replies.setdefault(key, set())
+		repliers.add(replica_id)
+		if len(repliers) < self.config.f + 1:
+			return
+		del self.queries[reply.request_id]
+		self.queries_completed += 1
+		if request.future.done():
+			return
+		if reply.error is not None:
+			request.future.set_exception(Query_error(reply.error))
+		else:
+			request.future.set_result(reply.result)
+
+	# read-only fast path, asks every replica, no block is made
+	# replicas a block apart don't match, so it asks again on a timeout and
+	# keeps the earlier answers
+	async def query(self, op, args):
+		request_id = self.next_request_id
+		self.next_request_id += 1
+		query = Query(op, args, self.client_id, request_id)
+		request = Pending_request(query, asyncio.get_running_loop().create_future())
+		self.queries[request_id] = request
+		try:
+			while True:
+				await asyncio.gather(*[
+					self.send_cmd(replica_id, query) for replica_id in self.config.replica_ids
+				])
+				try:
+					return await asyncio.wait_for(
+						asyncio.shield(request.future), timeout=self.timeout
+					)
+				except asyncio.TimeoutError:
+					pass
+		finally:
+			self.queries.pop(request_id, None)
+
+	# sends cmd and returns a future for the reply, waits for a free slot
+	# in the window first
+	async def submit(self, op, args):
+		await self.window.acquire()
+		request_id = self.next_request_id
+		self.next_request_id += 1
+		cmd = Command(op, args, self.client_id, request_id)
+		future = asyncio.get_running_loop().create_future()
+		future.add_done_callback(lambda _: self.window.release())
+		self.pending[request_id] = Pending_request(cmd, future)
+		driver = asyncio.create_task(self.drive(request_id))
+		self.drivers.add(driver)
+		driver.add_done_callback(self.drivers.discard)
+		return future
+
+	# resends the command until it completes, whatever got lost on the way
+	async def drive(self, request_id):
+		while request_id in self.pending:
+			request = self.pending[request_id]
+			request.target = self.leader
+			await self.send_cmd(request.target, request.cmd)
+			try:
+				await asyncio.wait_for(
+					asyncio.shield(request.future), timeout=self.timeout
+				)
+			except asyncio.TimeoutError:
+				self.suspect(request.target)
+
+	async def request(self, op, args):
+		return await (await self.submit(op, args))
 
 	async def run(self):
+		await self.connect_all()
 		while True:
-			cmd = Command("SET", ["A", 10], self.client_id)
-			await self.broadcast_cmd(cmd)
+			await self.submit("SET", ["A", 10])
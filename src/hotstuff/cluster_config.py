@@ -0,0 +1,78 @@
+from types import MappingProxyType
+from hotstuff.hotstuff_types import *
+from hotstuff.signatures import *
+
+# everything a cluster agrees on up front: who is in it and where, the keys
+# votes are signed with, and the knobs every replica should run with
+# immutable, so any number of clusters can share a process and nobody
+# changes one under someone else's feet, replace() gives a changed copy
+class Cluster_config:
+	__slots__ = ("replica_addresses", "replica_ids", "n", "f", "quorum", "scheme",
+	             "timeout", "max_batch_size", "max_batch_bytes", "chained", "admins")
+
+	# replica_addresses is replica_id -> (host, port), the simulation
+	# only uses the ids
+	# there is no default scheme, a key everyone knows authenticates nothing
+	# admins are the client ids that may add and remove replicas, nobody
+	# unless told otherwise
+	def __init__(self, replica_addresses, scheme, timeout=2.0,
+	             max_batch_size=100, max_batch_bytes=65536, chained=False, admins=()):
+		n = len(replica_addresses)
+		f = (n - 1) // 3
+		fields = {
+			"replica_addresses": MappingProxyType(dict(replica_addresses)),
+			"replica_ids": tuple(sorted(replica_addresses)),
+			"n": n,
+			"f": f,
+			# 2f + 1 only when n = 3f + 1, membership changes make the
+			# other sizes common and n - f keeps quorums intersecting
+			"quorum": n - f,
+			"scheme": scheme,
+			"timeout": timeout,
+			"max_batch_size": max_batch_size,
+			"max_batch_bytes": max_batch_bytes,
+			"chained": chained, # one GENERIC phase per view, see Replica.handle_generic
+			"admins": frozenset(admins),
+		}
+		for name, value in fields.items():
+			object.__setattr__(self, name, value)
+
+	# a cluster that only exists in a Simulation, with its own secret
+	# unless told otherwise
+	@staticmethod
+	def simulated(replica_ids, **options):
+		options.setdefault("scheme", Hmac_scheme.generate())
+		return Cluster_config({replica_id: None for replica_id in replica_ids}, **options)
+
+	def __setattr__(self, name, value):
+		raise AttributeError("Cluster_config is immutable, use replace()")
+
+	def __delattr__(self, name):
+		raise AttributeError("Cluster_config is immutable, use replace()")
+
+	def options(self):
+		return {
+			"scheme": self.scheme,
+			"timeout": self.timeout,
+			"max_batch_size": self.max_batch_size,
+			"max_batch_bytes": self.max_batch_bytes,
+			"chained": self.chained,
+			"admins": self.admins,
+		}
+
+	def replace(self, replica_addresses=None, **changes):
+		options = self.options()
+		options.update(changes)
+		if replica_addresses is None:
+			replica_addresses = self.replica_addresses
+		return Cluster_config(replica_addresses, **options)
+
+	def is_member(self, replica_id):
+		return replica_id in self.replica_addresses
+
+	# an empty QC signature, complete at this cluster's quorum
+	def signature(self):
+		return Signature(self.n, self.f)
+
+	def __repr__(self):
+		return f"Cluster_config(n={self.n}, f={self.f}, replicas={list(self.replica_ids)})"
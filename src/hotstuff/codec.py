@@ -0,0 +1,296 @@
+import asyncio
+from hotstuff.wire import *
+from hotstuff.hotstuff_types import *
+
+# wire format for everything that goes over a socket
+# replaces pickle, which would run arbitrary code sent by a byzantine peer
+#
+# packet  := VERSION kind body
+# blocks carry their parent's hash, never the parent itself, so the size
+# of a message doesn't depend on how long the chain is
+CODEC_VERSION = 10
+
+KIND_MESSAGE = 1
+KIND_COMMAND = 2
+KIND_HELLO = 3
+KIND_QUERY = 4
+KIND_QUERY_REPLY = 5
+
+# which optional Message fields are present
+HAS_BLOCK = 1
+HAS_JUSTIFY = 2
+HAS_SIG = 4
+HAS_SENDER = 8
+HAS_RANGE = 16
+HAS_BLOCKS = 32
+HAS_PROOF = 64
+HAS_CMDS = 128
+HAS_SNAPSHOT = 256
+HAS_BLOCK_HASH = 512
+
+# bigger length prefixes come from a broken or abusive peer
+MAX_FRAME = 16 << 20
+
+def read_phase(r):
+	try:
+		return Protocol_phase(r.u32())
+	except ValueError as e:
+		raise Codec_error(str(e))
+
+def write_command(w, cmd):
+	w.raw(cmd.encoding())
+
+# keeps the bytes it came in, they are the canonical encoding
+def read_command(r):
+	start = r.pos
+	op = r.text()
+	args = read_value(r)
+	client_id = read_value(r)
+	request_id = r.u64()
+	return Command(op, args, client_id, request_id, bytes(r.data[start:r.pos]))
+
+def write_query(w, query):
+	w.text(query.op)
+	write_value(w, query.args)
+	write_value(w, query.client_id)
+	w.u64(query.request_id)
+
+def read_query(r):
+	op = r.text()
+	args = read_value(r)
+	client_id = read_value(r)
+	return Query(op, args, client_id, r.u64())
+
+def write_query_reply(w, reply):
+	write_value(w, reply.client_id)
+	w.u64(reply.request_id)
+	w.u64(reply.height)
+	write_value(w, reply.result)
+	write_value(w, reply.error)
+
+def read_query_reply(r):
+	client_id = read_value(r)
+	request_id = r.u64()
+	height = r.u64()
+	result = read_value(r)
+	error = read_value(r)
+	if error is not None and not isinstance(error, str):
+		raise Codec_error("bad query error")
+	return Query_reply(client_id, request_id, height, result, error)
+
+def write_block(w, block):
+	w.u64(block.view)
+	if block.parent_hash is None:
+		w.u8(0)
+	else:
+		w.u8(1)
+		w.digest(block.parent_hash)
+	w.u32(len(block.cmds))
+	for cmd in block.cmds:
+		write_command(w, cmd)
+
+# the hash is always recomputed, never taken from the wire, but only once
+# something asks for it
+def read_block(r):
+	view = r.u64()
+	parent_hash = r.digest() if r.u8() else None
+	cmds = [read_command(r) for _ in range(r.u32())]
+	return Block(cmds, parent_hash, view)
+
+def write_signature(w, sig):
+	w.u32(sig.threshold)
+	w.u32(sig.total)
+	write_value(w, sig.combined)
+
+def read_signature(r):
+	sig = Signature.__new__(Signature)
+	sig.threshold = r.u32()
+	sig.total = r.u32()
+	sig.combined = read_value(r)
+	if not isinstance(sig.combined, dict):
+		raise Codec_error("signature shares must be a dict")
+	return sig
+
+# the block goes by hash, the receiver has it or has to fetch it
+def write_qc(w, qc):
+	w.u32(qc.phase.value)
+	w.u64(qc.view_number)
+	w.digest(qc.block_hash)
+	write_signature(w, qc.signature)
+
+def read_qc(r):
+	phase = read_phase(r)
+	view_number = r.u64()
+	block_hash = r.digest()
+	sig = read_signature(r)
+	return QC(phase, view_number, block_hash, sig)
+
+def write_message(w, msg):
+	flags = 0
+	if msg.block is not None:
+		flags |= HAS_BLOCK
+	if msg.justify is not None:
+		flags |= HAS_JUSTIFY
+	if msg.partial_sig is not None:
+		flags |= HAS_SIG
+	if msg.sender is not None:
+		flags |= HAS_SENDER
+	if msg.block_hash is not None:
+		flags |= HAS_BLOCK_HASH
+	if msg.height_range is not None:
+		flags |= HAS_RANGE
+	if msg.blocks is not None:
+		flags |= HAS_BLOCKS
+	if msg.proof is not None:
+		flags |= HAS_PROOF
+	if msg.cmds is not None:
+		flags |= HAS_CMDS
+	if msg.snapshot is not None:
+		flags |= HAS_SNAPSHOT
+	w.u32(msg.phase.value)
+	w.u64(msg.view_number)
+	w.u32(flags)
+	if flags & HAS_BLOCK:
+		write_block(w, msg.block)
+	if flags & HAS_JUSTIFY:
+		write_qc(w, msg.justify)
+	if flags & HAS_SIG:
+		write_value(w, msg.partial_sig)
+	if flags & HAS_SENDER:
+		write_value(w, msg.sender)
+	if flags & HAS_BLOCK_HASH:
+		w.digest(msg.block_hash)
+	if flags & HAS_RANGE:
+		first, last = msg.height_range
+		w.u64(first)
+		w.u64(last)
+	if flags & HAS_BLOCKS:
+		w.u32(len(msg.blocks))
+		for block in msg.blocks:
+			write_block(w, block)
+	if flags & HAS_PROOF:
+		w.u32(len(msg.proof))
+		for qc in msg.proof:
+			write_qc(w, qc)
+	if flags & HAS_CMDS:
+		w.u32(len(msg.cmds))
+		for cmd in msg.cmds:
+			write_command(w, cmd)
+	if flags & HAS_SNAPSHOT:
+		write_value(w, msg.snapshot)
+
+def read_message(r):
+	phase = read_phase(r)
+	view_number = r.u64()
+	flags = r.u32()
+	block = read_block(r) if flags & HAS_BLOCK else None
+	justify = read_qc(r) if flags & HAS_JUSTIFY else None
+	partial_sig = read_value(r) if flags & HAS_SIG else None
+	sender = read_value(r) if flags & HAS_SENDER else None
+	msg = Message(phase, view_number, block, justify, partial_sig, sender)
+	if flags & HAS_BLOCK_HASH:
+		msg.block_hash = r.digest()
+	if flags & HAS_RANGE:
+		msg.height_range = (r.u64(), r.u64())
+	if flags & HAS_BLOCKS:
+		msg.blocks = [read_block(r) for _ in range(r.u32())]
+	if flags & HAS_PROOF:
+		msg.proof = [read_qc(r) for _ in range(r.u32())]
+	if flags & HAS_CMDS:
+		msg.cmds = [read_command(r) for _ in range(r.u32())]
+	if flags & HAS_SNAPSHOT:
+		msg.snapshot = read_value(r)
+	return msg
+
+def encode(payload):
+	w = Writer()
+	w.u8(CODEC_VERSION)
+	if isinstance(payload, Message):
+		w.u8(KIND_MESSAGE)
+		write_message(w, payload)
+	elif isinstance(payload, Command):
+		w.u8(KIND_COMMAND)
+		write_command(w, payload)
+	elif isinstance(payload, Client_hello):
+		w.u8(KIND_HELLO)
+		write_value(w, payload.client_id)
+	elif isinstance(payload, Query):
+		w.u8(KIND_QUERY)
+		write_query(w, payload)
+	elif isinstance(payload, Query_reply):
+		w.u8(KIND_QUERY_REPLY)
+		write_query_reply(w, payload)
+	else:
+		raise Codec_error(f"can't encode {type(payload).__name__}")
+	return w.getvalue()
+
+def decode(packet):
+	r = Reader(packet)
+	version = r.u8()
+	if version != CODEC_VERSION:
+		raise Codec_error(f"unsupported codec version {version}")
+	kind = r.u8()
+	if kind == KIND_MESSAGE:
+		payload = read_message(r)
+	elif kind == KIND_COMMAND:
+		payload = read_command(r)
+	elif kind == KIND_HELLO:
+		payload = Client_hello(read_value(r))
+	elif kind == KIND_QUERY:
+		payload = read_query(r)
+	elif kind == KIND_QUERY_REPLY:
+		payload = read_query_reply(r)
+	else:
+		raise Codec_error(f"unknown packet kind {kind}")
+	r.done()
+	return payload
+
+# packets on a stream are framed by a u32 length
+def frame(packet):
+	return U32.pack(len(packet)) + packet
+
+# reads frames off an asyncio.StreamReader into one reused buffer
+# every wakeup takes whatever the socket has and decodes all complete frames
+# straight out of the buffer, so a burst costs one read and no per-message
+# copies
+class Frame_reader:
+	CHUNK = 1 << 16
+
+	def __init__(self, reader, max_frame=MAX_FRAME):
+		self.reader = reader
+		self.max_frame = max_frame
+		self.buffer = bytearray()
+		self.needed = 0 # bytes missing from the frame at the front
+
+	# decoded payloads of at least one frame
+	# raises asyncio.IncompleteReadError at EOF, Codec_error on a bad frame
+	async def read(self):
+		while True:
+			payloads = self.parse()
+			if payloads:
+				return payloads
+			chunk = await self.reader.read(max(Frame_reader.CHUNK, self.needed))
+			if not chunk:
+				raise asyncio.IncompleteReadError(bytes(self.buffer), None)
+			self.buffer += chunk
+
+	def parse(self):
+		payloads = []
+		pos = 0
+		available = len(self.buffer)
+		self.needed = 0
+		with memoryview(self.buffer) as view:
+			while available - pos >= U32.size:
+				size = U32.unpack_from(view, pos)[0]
+				if size > self.max_frame:
+					raise Codec_error(f"frame of {size} bytes")
+				end = pos + U32.size + size
+				if end > available:
+					self.needed = end - available
+					break
+				# decode copies out everything it keeps
+				with view[pos + U32.size:end] as packet:
+					payloads.append(decode(packet))
+				pos = end
+		del self.buffer[:pos]
+		return payloads
@@ -0,0 +1,163 @@
+from hotstuff.hotstuff_types import *
+
+# who leads a view
+# every honest replica has to pick the same leader, so a strategy may only
+# look at committed history: which views got a block committed and which
+# didn't
+# a view's outcome is known once the committed tip has reached it, the
+# committed chain only grows so nothing older can be committed later
+# strategies look at most window views back and never at the last lag views,
+# so replicas a few commits behind still agree
+#
+# leaders are worked out oldest view first and memoized, a replica whose tip
+# hasn't reached a view's history yet guesses with what it has and drops the
+# guesses on its next commit
+class Leader_election:
+	def __init__(self, replica_ids, lag=4, window=64):
+		# (first view, sorted ids), see reconfigure()
+		self.members = [(0, sorted(replica_ids))]
+		self.lag = lag
+		self.window = window
+		self.committed_views = set()
+		self.base_view = 0 # outcomes before this are unknown, e.g. a snapshot
+		self.tip_view = 0
+		self.settled = {} # view -> leader, final
+		self.settled_upto = 0 # every view up to here is in settled
+		self.guesses = {} # view -> leader, until the next commit
+
+	def replica_ids(self, view):
+		for first_view, replica_ids in reversed(self.members):
+			if first_view <= view:
+				return replica_ids
+		return self.members[0][1]
+
+	def round_robin(self, view):
+		replica_ids = self.replica_ids(view)
+		return replica_ids[view % len(replica_ids)]
+
+	# the replica after replica_id in view's membership
+	def next_after(self, replica_id, view):
+		replica_ids = self.replica_ids(view)
+		if replica_id not in replica_ids:
+			return self.round_robin(view)
+		return replica_ids[(replica_ids.index(replica_id) + 1) % len(replica_ids)]
+
+	# the membership from first_view on, leaders already worked out for
+	# those views are dropped
+	def reconfigure(self, first_view, replica_ids):
+		while self.members and self.members[-1][0] >= first_view:
+			self.members.pop()
+		self.members.append((first_view, sorted(replica_ids)))
+		for view in [view for view in self.settled if view >= first_view]:
+			del self.settled[view]
+		self.settled_upto = min(self.settled_upto, first_view - 1)
+		self.guesses = {}
+
+	# True if the view's block was committed, False if it never will be,
+	# None if we can't tell (yet)
+	def outcome(self, view):
+		if view <= self.base_view or view > self.tip_view:
+			return None
+		return view in self.committed_views
+
+	# fed every committed block in order
+	def committed(self, block):
+		self.committed_views.add(block.view)
+		self.tip_view = max(self.tip_view, block.view)
+		self.guesses = {}
+		self.prune()
+
+	# the history behind a recovered snapshot is gone, leaders may differ
+	# from everyone else's until a window past it has been committed
+	def recovered(self, base_view):
+		self.base_view = base_view
+		self.tip_view = max(self.tip_view, base_view)
+		self.settled = {}
+		self.settled_upto = base_view
+		self.guesses = {}
+
+	def leader(self, view):
+		if view <= self.settled_upto:
+			return self.settled.get(view, self.round_robin(view))
+		if view in self.guesses:
+			return self.guesses[view]
+		# nothing in its window is known, not worth remembering (and the
+		# view may come from a faulty replica)
+		if view - self.lag - self.window > self.tip_view:
+			return self.compute(view)
+		start = max([self.settled_upto] + list(self.guesses)) + 1
+		for later in range(start, view + 1):
+			leader = self.compute(later)
+			# every outcome compute() looked at is final
+			if later == self.settled_upto + 1 and later - self.lag - 1 <= self.tip_view:
+				self.settled[later] = leader
+				self.settled_upto = later
+			else:
+				self.guesses[later] = leader
+		return self.leader(view)
+
+	# may call leader() for earlier views only
+	def compute(self, view):
+		raise NotImplementedError
+
+	# keeps what the next leaders can still look at, a syncing replica that
+	# hasn't asked for leaders in a while keeps everything it will need
+	def prune(self):
+		span = self.lag + self.window
+		floor = min(self.tip_view - 2 * span, self.settled_upto - span)
+		if floor - self.base_view > 4 * span:
+			self.settled = {view: leader for view, leader in self.settled.items() if view >= floor}
+			self.committed_views = {view for view in self.committed_views if view >= floor}
+			self.base_view = max(self.base_view, floor - 1)
+
+# view % N, what replicas always did
+class Round_robin(Leader_election):
+	def leader(self, view):
+		return self.round_robin(view)
+
+# a leader keeps the job as long as the views it leads commit, then the
+# next replica takes over
+# a view counts as failed until something after it commits, a crashed leader
+# is never followed by a commit
+# the job is handed round robin every window views, so a replica that lost
+# track of history picks the same leaders again after one window
+class Sticky_leader(Leader_election):
+	def compute(self, view):
+		epoch_start = view - view % self.window
+		if view == epoch_start or view <= 1:
+			# the epoch picks, the membership is that of view itself
+			replica_ids = self.replica_ids(view)
+			return replica_ids[(view // self.window) % len(replica_ids)]
+		previous = self.leader(view - 1)
+		judged = view - 1 - self.lag
+		if previous not in self.replica_ids(view) or \
+			(judged >= max(1, epoch_start) and self.outcome(judged) is not True and \
+			self.leader(judged) == previous):
+			return self.next_after(previous, view)
+		return previous
+
+# round robin over all but the F replicas that failed the most views they
+# led in the last window views
+class Reputation_election(Leader_election):
+	def compute(self, view):
+		failures = {}
+		for judged in range(max(1, view - self.lag - self.window), view - self.lag):
+			if self.outcome(judged) is False:
+				leader = self.leader(judged)
+				failures[leader] = failures.get(leader, 0) + 1
+		replica_ids = self.replica_ids(view)
+		worst = sorted(failures, key=lambda replica_id: (-failures[replica_id], replica_id))
+		worst = set(worst[:(len(replica_ids) - 1) // 3])
+		candidates = [replica_id for replica_id in replica_ids if replica_id not in worst]
+		return candidates[view % len(candidates)]
+
+ELECTIONS = {
+	"round_robin": Round_robin,
+	"sticky": Sticky_leader,
+	"reputation": Reputation_election,
+}
+
+# basic HotStuff commits a view's block before the next view starts, chained
+# three views later and votes for the next view's leader before that
+def make_election(name, replica_ids, chained=False):
+	return ELECTIONS[name](replica_ids, lag=4 if chained else 1)
@@ -1,10 +1,17 @@
 import asyncio
 import hashlib
-import pickle
 import random
+import time
 from enum import Enum
 from typing import Optional, Dict, List
-from collections import Counter
+from hotstuff.wire import *
+
+# the running loop's clock, virtual under a Simulated_loop
+def now():
+	try:
+		return asyncio.get_running_loop().time()
+	except RuntimeError:
+		return time.monotonic()
 
 # some numbers that aren't 0, 1 and so forth
 class Protocol_phase(Enum):
@@ -16,6 +23,17 @@ class Protocol_phase(Enum):
 	COMMIT = 5421315
 	COMMIT_VOTE = 5421316
 	DECIDE = 5421317
+	# chained mode, one generic phase per view
+	GENERIC = 5421318
+	GENERIC_VOTE = 5421319
+	# state sync, committed blocks by height
+	BLOCK_REQUEST = 5421320
+	BLOCK_RESPONSE = 5421321
+	# client commands a replica passes on to the leader
+	FORWARD = 5421322
+	# a joining replica asks for the committed state to start from
+	STATE_REQUEST = 5421323
+	STATE_RESPONSE = 5421324
 
 	def __str__(self):
 		return self.name
@@ -29,96 +47,231 @@ class Fault_types(Enum):
 	def __str__(self):
 		return self.name
 
+# encoding and hash are memoized, worked out on first use and never again
+# a command read off the wire keeps the bytes it came in, they are already
+# the canonical encoding
 class Command:
-	def __init__(self, op, args, client_id):
+	__slots__ = ("op", "args", "client_id", "request_id", "cached_encoding",
+	             "cached_hash")
+
+	# request_id is unique per client, replies are matched to requests by it
+	def __init__(self, op, args, client_id, request_id=0, encoding=None):
 		self.op = op
 		self.args = args
 		self.client_id = client_id 
-		self.hash = self.calculate_hash()
+		self.request_id = request_id
+		self.cached_encoding = encoding
+		self.cached_hash = None
+
+	@property
+	def hash(self):
+		if self.cached_hash is None:
+			self.cached_hash = self.calculate_hash()
+		return self.cached_hash
+
+	# canonical bytes, the codec sends exactly these
+	def encoding(self):
+		if self.cached_encoding is None:
+			w = Writer()
+			w.text(self.op)
+			write_value(w, self.args)
+			write_value(w, self.client_id)
+			w.u64(self.request_id)
+			self.cached_encoding = w.getvalue()
+		return self.cached_encoding
 
 	def calculate_hash(self):
-		h = hashlib.sha256()
-		h.update(str(self.op).encode())
-		h.update(str(self.args).encode())
-		h.update(str(self.client_id).encode())
-		return h.hexdigest()
+		return hashlib.sha256(self.encoding()).hexdigest()
+
+	# bytes on the wire, used to cap the size of a batch
+	def size(self):
+		return len(self.encoding())
 
 	def __repr__(self):
-		return f"CMD([C{self.client_id}]: {self.op} {self.args})"
+		return f"CMD([C{self.client_id}#{self.request_id}]: {self.op} {self.args})"
+
+# first thing a client sends on a connection, so the replica knows where to
+# reply even if the client never sends it a command
+class Client_hello:
+	def __init__(self, client_id):
+		self.client_id = client_id
+
+# read-only request, answered from committed state without a block
+class Query:
+	def __init__(self, op, args, client_id, request_id):
+		self.op = op
+		self.args = args
+		self.client_id = client_id
+		self.request_id = request_id
+
+	def __repr__(self):
+		return f"QUERY([C{self.client_id}#{self.request_id}]: {self.op} {self.args})"
+
+# a query the state machine can't answer, e.g. malformed args
+class Query_error(ValueError):
+	pass
+
+# a replica's answer to a Query, from its state at committed height
+# error is set instead of result if the query was refused
+class Query_reply:
+	def __init__(self, client_id, request_id, height, result, error=None):
+		self.client_id = client_id
+		self.request_id = request_id
+		self.height = height
+		self.result = result
+		self.error = error
+
+# root of a binary hash tree over a batch's command digests, an odd node
+# out moves up a level as it is
+# inner nodes hash 0x01 + left + right, a command's encoding starts with the
+# zero high byte of its op length, so neither passes for the other
+def merkle_root(digests):
+	if not digests:
+		return hashlib.sha256(b"").digest()
+	level = digests
+	while len(level) > 1:
+		paired = [
+			hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest()
+			for i in range(0, len(level) - 1, 2)
+		]
+		if len(level) % 2:
+			paired.append(level[-1])
+		level = paired
+	return level[0]
 
 class Block:
-	def __init__(self, cmd, parent, view):
-		self.cmd = cmd
-		self.parent = parent
+	__slots__ = ("cmds", "parent_hash", "view", "justify", "height", "skip_hash",
+	             "cached_hash")
+
+	# cmds is an ordered batch, executed front to back on decide
+	# the parent is referenced by hash only, replicas look it up themselves
+	def __init__(self, cmds, parent_hash, view):
+		self.cmds = cmds
+		self.parent_hash = parent_hash
 		self.view = view
-		self.hash = self.compute_hash()
+		# QC carried by the proposal, only used in chained mode
+		self.justify = None
+		# filled in by the Block_store the block is added to
+		self.height = None
+		self.skip_hash = None
+		self.cached_hash = None
+
+	@property
+	def hash(self):
+		if self.cached_hash is None:
+			self.cached_hash = self.compute_hash()
+		return self.cached_hash
 
+	# view, parent and the Merkle root of the commands
 	def compute_hash(self):
 		h = hashlib.sha256()
-		h.update(str(self.cmd).encode())
-		h.update(str(self.view).encode())
-		parent_hash = self.parent.hash if self.parent else "genesis"
-		h.update(parent_hash.encode())
+		h.update(U64.pack(self.view))
+		h.update(bytes.fromhex(self.parent_hash) if self.parent_hash else bytes(HASH_SIZE))
+		h.update(merkle_root([bytes.fromhex(cmd.hash) for cmd in self.cmds]))
 		return h.hexdigest()
 	
 	def __str__(self):
-		return f"Block(v:{self.view}, cmd:{self.cmd})"
+		return f"Block(v:{self.view}, cmds:{self.cmds})"
 	
 	def __eq__(self, other):
 		return isinstance(other, Block) and self.hash == other.hash
 
 GENESIS_BLOCK = Block([], None, 0)
 
+# the vote every phase's QC is made of
+VOTE_PHASE = {
+	Protocol_phase.PREPARE: Protocol_phase.PREPARE_VOTE,
+	Protocol_phase.PRECOMMIT: Protocol_phase.PRECOMMIT_VOTE,
+	Protocol_phase.COMMIT: Protocol_phase.COMMIT_VOTE,
+	Protocol_phase.GENERIC: Protocol_phase.GENERIC_VOTE,
+}
+
+# what a replica signs when it votes
+def vote_digest(view, phase, block_hash):
+	h = hashlib.sha256()
+	h.update(str(view).encode())
+	h.update(str(phase).encode())
+	h.update(str(block_hash).encode())
+	return h.digest()
+
+# what a replica signs when it hands its state to a joining one, encoded is
+# the snapshot as the codec writes it
+def snapshot_digest(block_hash, encoded):
+	h = hashlib.sha256()
+	h.update(b"snapshot")
+	h.update(str(block_hash).encode())
+	h.update(encoded)
+	return h.digest()
+
 class Signature:
 	def __init__(self, n, f):
-		self.threshold = 2*f + 1
+		# n - f, any two quorums share an honest replica whatever n is
+		self.threshold = n - f
 		self.total = n
-		self.combined = []
+		self.combined = {} # signer_id -> share
 
-	@staticmethod	
-	def partial_sign(view, phase, block_hash):
-		h = hashlib.sha256()
-		h.update(str(view).encode())
-		h.update(str(phase).encode())
-		h.update(str(block_hash).encode())
-		return h.hexdigest()
-
-	# placeholder for potential implementation
+	# partial_sig is a (signer_id, share) pair, see Replica.sign
 	def combine(self, partial_sig):
-		self.combined.append(partial_sig)
+		signer_id, share = partial_sig
+		self.combined[signer_id] = share
 
-	def verify(self):
-		# if there are enough values that match
-		if max(Counter(self.combined).values()) >= self.threshold:
-			return True
-		return False
+	# threshold comes from the verifier, not from whoever built the QC
+	def verify(self, scheme, digest, threshold):
+		if len(self.combined) < threshold:
+			return False
+		return scheme.verify_each(digest, self.combined)
 
 # hack that totally won't bite me later
 GENESIS_SIG = Signature(0, 0)
 
+# refers to its block by hash, replicas look it up in their Block_store
 class QC:
-	def __init__(self, phase, view_number, block, sig):
+	__slots__ = ("phase", "view_number", "block_hash", "signature")
+
+	def __init__(self, phase, view_number, block_hash, sig):
 		self.phase = phase
 		self.view_number = view_number
-		self.block = block
+		self.block_hash = block_hash
 		self.signature = sig
 
+	def digest(self):
+		return vote_digest(self.view_number, VOTE_PHASE[self.phase], self.block_hash)
+
 	def __str__(self):
 		return f"QC(type:{self.phase}, view:{self.view_number})"
 
 def matching_qc(qc, t, v):
 	return qc.phase == t and qc.view_number == v
 
-GENESIS_QC = QC(Protocol_phase.PREPARE, 0, GENESIS_BLOCK, GENESIS_SIG)
+GENESIS_QC = QC(Protocol_phase.PREPARE, 0, GENESIS_BLOCK.hash, GENESIS_SIG)
+GENESIS_BLOCK.justify = GENESIS_QC
 
 class Message:
+	__slots__ = ("phase", "view_number", "block", "justify", "partial_sig", "sender",
+	             "block_hash", "height_range", "blocks", "proof", "cmds", "snapshot")
+
 	def __init__(self, phase, view_number, block, qc, sig=None, sender=None):
 		self.phase = phase
 		self.view_number = view_number
 		self.block = block
 		self.justify = qc 
+		# (signer id, share), on votes and on STATE_RESPONSE for its snapshot
 		self.partial_sig = sig
 		self.sender = sender
+		# votes, and block requests by hash, the block they are for
+		self.block_hash = None
+		# only used by BLOCK_REQUEST / BLOCK_RESPONSE
+		self.height_range = None # (first, last)
+		# BLOCK_RESPONSE and STATE_RESPONSE, a hash chain that ends in the
+		# blocks the proof QCs certify, the first of those was committed,
+		# see Replica.proven_block
+		self.blocks = None
+		self.proof = None
+		# only used by FORWARD
+		self.cmds = None
+		# only used by STATE_RESPONSE, {"height", "state", "membership"}
+		# as of the committed block
+		self.snapshot = None
 	
 	def __repr__(self):
 		return f"Msg(type:{self.phase}, view:{self.view_number}, from:{self.sender})"
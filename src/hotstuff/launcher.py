@@ -0,0 +1,341 @@
+import asyncio
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+from hotstuff.hotstuff_types import *
+from hotstuff.network import *
+from hotstuff.replica import *
+from hotstuff.byzantine import *
+from hotstuff.client import *
+from hotstuff.storage import *
+from hotstuff.election import *
+from hotstuff.cluster_config import *
+
+# runs a cluster across processes so replicas get a core each
+#
+#   python -m hotstuff.launcher cluster.json
+#
+# the config is JSON:
+#   replicas   list of {"id", "host", "port", "fault" (optional, a
+#              Fault_types name), "crash_view" (CRASH only)}
+#   processes  how many replica processes, replicas are split evenly
+#   duration   seconds to run, 0 runs until SIGINT/SIGTERM
+#   output     directory for logs and results
+#   timeout, max_batch_size, chained, storage (directory for the WALs)
+#   keyring    directory with public_keys.json ({"<id>": hex public key})
+#              and replica-<id>.key (hex private key) per replica, votes
+#              are signed with Ed25519 from it and a process only reads
+#              the private keys of its own replicas
+#              a fresh one is made in output/keyring for every launch if
+#              there is neither a keyring nor a secret
+#   secret     HMAC key votes are signed with instead, only if it is set,
+#              everyone who has it can sign for everyone
+#   election   round_robin, sticky or reputation
+#   clients    list of {"id", "window", "timeout"}, all in one process
+#   admins     client ids allowed to add and remove replicas, none if
+#              there are none
+#
+# every process logs to output/process-<k>.log and writes a result file,
+# the launcher merges the logs into output/cluster.log and the results into
+# output/summary.json
+LOG_FORMAT = "%(created).6f %(message)s"
+
+def load_config(path):
+	with open(path) as f:
+		config = json.load(f)
+	config.setdefault("processes", os.cpu_count() or 1)
+	config.setdefault("duration", 10.0)
+	config.setdefault("output", "cluster-output")
+	config.setdefault("timeout", 2.0)
+	config.setdefault("max_batch_size", 100)
+	config.setdefault("chained", False)
+	config.setdefault("storage", None)
+	config.setdefault("election", "round_robin")
+	config.setdefault("clients", [{"id": 0}])
+	config.setdefault("admins", [])
+	return config
+
+# replica_id -> public key, and a key file per replica that only its
+# owner can read
+def write_keyring(directory, replica_ids):
+	os.makedirs(directory, exist_ok=True)
+	public_keys, private_keys = Ed25519_scheme.generate_keys(replica_ids)
+	with open(os.path.join(directory, "public_keys.json"), "w") as f:
+		json.dump({str(replica_id): key.hex() for replica_id, key in public_keys.items()}, f)
+	for replica_id, key in private_keys.items():
+		path = os.path.join(directory, f"replica-{replica_id}.key")
+		with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+			f.write(key.hex())
+
+# what a process signs and verifies with, it can only sign for replica_ids
+def load_scheme(config, replica_ids=()):
+	if config.get("secret") is not None:
+		return Hmac_scheme(config["secret"].encode())
+	keyring = config["keyring"]
+	with open(os.path.join(keyring, "public_keys.json")) as f:
+		public_keys = {int(replica_id): bytes.fromhex(key) for replica_id, key in json.load(f).items()}
+	private_keys = {}
+	for replica_id in replica_ids:
+		with open(os.path.join(keyring, f"replica-{replica_id}.key")) as f:
+			private_keys[replica_id] = bytes.fromhex(f.read().strip())
+	return Ed25519_scheme(public_keys, private_keys)
+
+# replica_ids are the replicas this process runs, none for the clients
+def cluster_config(config, replica_ids=()):
+	options = {
+		"timeout": config["timeout"],
+		"max_batch_size": config["max_batch_size"],
+		"chained": config["chained"],
+		"admins": config.get("admins", []),
+	}
+	return Cluster_config(
+		{replica["id"]: (replica["host"], replica["port"]) for replica in config["replicas"]},
+		load_scheme(config, replica_ids),
+		**options
+	)
+
+def make_replica(spec, config, cluster):
+	replica_id = spec["id"]
+	fault = Fault_types[spec.get("fault", "HONEST")]
+	kwargs = {
+		"election": make_election(config["election"], cluster.replica_ids, cluster.chained),
+	}
+	if config["storage"] is not None:
+		kwargs["storage"] = Write_ahead_log(
+			os.path.join(config["storage"], f"replica-{replica_id}")
+		)
+	if fault == Fault_types.CRASH:
+		network = Network(replica_id, cluster)
+		return Crash_replica(replica_id, network, spec.get("crash_view", 10), **kwargs)
+	if fault == Fault_types.DELAYED:
+		network = Delayed_network(replica_id, cluster)
+		return Delayed_replica(replica_id, network, **kwargs)
+	if fault == Fault_types.MALICIOUS:
+		network = Malicious_network(replica_id, cluster)
+		return Malicious_replica(replica_id, network, **kwargs)
+	network = Network(replica_id, cluster)
+	return Replica(replica_id, network, **kwargs)
+
+def replica_result(replica):
+	return {
+		"id": replica.replica_id,
+		"fault": replica.FAULT,
+		"height": replica.blocks.committed_height,
+		"view": replica.current_view,
+		"locked_view": replica.locked_qc.view_number,
+		"committed": [block.hash for block in replica.log],
+		"base_height": replica.blocks.base_height,
+		"state": replica.state,
+		"state_digest": replica.state_machine.digest(),
+		"stats": replica.stats(),
+		"peers": replica.network.health(),
+	}
+
+def client_result(client):
+	latencies = sorted(client.latencies)
+	def percentile(q):
+		if not latencies:
+			return None
+		return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+	return {
+		"id": client.client_id,
+		"completed": client.completed,
+		"latency_p50": percentile(0.50),
+		"latency_p99": percentile(0.99),
+	}
+
+# runs until duration is up or we get SIGTERM/SIGINT
+async def serve(runners, duration):
+	stop = asyncio.Event()
+	loop = asyncio.get_running_loop()
+	for signum in (signal.SIGTERM, signal.SIGINT):
+		loop.add_signal_handler(signum, stop.set)
+	tasks = [asyncio.create_task(runner) for runner in runners]
+	try:
+		if duration:
+			await asyncio.wait_for(stop.wait(), timeout=duration)
+		else:
+			await stop.wait()
+	except asyncio.TimeoutError:
+		pass
+	return tasks
+
+async def run_replicas(config, replica_ids):
+	cluster = cluster_config(config, replica_ids)
+	specs = {spec["id"]: spec for spec in config["replicas"]}
+	replicas = [make_replica(specs[replica_id], config, cluster) for replica_id in replica_ids]
+
+	tasks = await serve([replica.run() for replica in replicas], config["duration"])
+	for replica in replicas:
+		replica.stop()
+	for task in tasks:
+		task.cancel()
+	await asyncio.gather(*tasks, return_exceptions=True)
+	results = [replica_result(replica) for replica in replicas]
+	for replica in replicas:
+		if replica.network.server is not None:
+			await replica.network.stop_server()
+		if replica.storage is not None:
+			await replica.storage.close()
+	return {"replicas": results}
+
+async def run_clients(config):
+	cluster = cluster_config(config)
+	clients = [
+		Client(spec["id"], cluster, spec.get("timeout", 3.0), spec.get("window", 64))
+		for spec in config["clients"]
+	]
+	tasks = await serve([client.run() for client in clients], config["duration"])
+	for task in tasks:
+		task.cancel()
+	await asyncio.gather(*tasks, return_exceptions=True)
+	return {"clients": [client_result(client) for client in clients]}
+
+# entry point of every child process
+def run_process(config, index, replica_ids):
+	output = config["output"]
+	logging.basicConfig(
+		filename=os.path.join(output, f"process-{index}.log"),
+		level=config.get("log_level", "INFO"),
+		format=LOG_FORMAT,
+	)
+	if replica_ids is None:
+		result = asyncio.run(run_clients(config))
+	else:
+		result = asyncio.run(run_replicas(config, replica_ids))
+	with open(os.path.join(output, f"process-{index}.json"), "w") as f:
+		json.dump(result, f)
+
+def split(items, parts):
+	parts = max(1, min(parts, len(items)))
+	return [items[i::parts] for i in range(parts)]
+
+# logs are in time order per process, so a merge keeps them in order
+# lines without a timestamp (tracebacks) stick to the line before them
+def timestamped(f):
+	stamp = 0.0
+	for line in f:
+		try:
+			stamp = float(line.split(" ", 1)[0])
+		except ValueError:
+			pass
+		yield stamp, line
+
+def merge_logs(paths, target):
+	files = [open(path) for path in paths if os.path.exists(path)]
+	try:
+		with open(target, "w") as out:
+			for _, line in heapq.merge(
+				*[timestamped(f) for f in files], key=lambda entry: entry[0]
+			):
+				out.write(line)
+	finally:
+		for f in files:
+			f.close()
+
+# honest replicas must agree on every height they all committed, and on
+# the state wherever they stopped at the same height
+# a log starts at its base height, the blocks below it were trimmed
+def consistent(replicas):
+	honest = [replica for replica in replicas if replica["fault"] == "HONEST"]
+	if not honest:
+		return True
+	bases = [replica.get("base_height", 0) for replica in honest]
+	low = max(bases)
+	high = min(base + len(replica["committed"]) for base, replica in zip(bases, honest))
+	chains = [
+		replica["committed"][low - base:high - base]
+		for base, replica in zip(bases, honest)
+	]
+	if not all(chain == chains[0] for chain in chains):
+		return False
+	digests = {}
+	for replica in honest:
+		if digests.setdefault(replica["height"], replica["state_digest"]) != replica["state_digest"]:
+			return False
+	return True
+
+def summarize(config, results):
+	replicas = sorted(
+		[replica for result in results for replica in result.get("replicas", [])],
+		key=lambda replica: replica["id"]
+	)
+	clients = [client for result in results for client in result.get("clients", [])]
+	heights = [replica["height"] for replica in replicas if replica["fault"] == "HONEST"]
+	return {
+		"consistent": consistent(replicas),
+		"min_height": min(heights, default=0),
+		"max_height": max(heights, default=0),
+		"replicas": [
+			{key: value for key, value in replica.items() if key != "committed"}
+			for replica in replicas
+		],
+		"clients": clients,
+	}
+
+def launch(config):
+	os.makedirs(config["output"], exist_ok=True)
+	replica_ids = [replica["id"] for replica in config["replicas"]]
+	# made here, every process has to use the same one
+	if config.get("secret") is None and config.get("keyring") is None:
+		keyring = os.path.join(config["output"], "keyring")
+		write_keyring(keyring, replica_ids)
+		config = dict(config, keyring=keyring)
+	context = multiprocessing.get_context("spawn")
+	groups = split(replica_ids, config["processes"])
+	if config["clients"]:
+		groups.append(None)
+	processes = [
+		context.Process(target=run_process, args=(config, index, group))
+		for index, group in enumerate(groups)
+	]
+	for process in processes:
+		process.start()
+
+	# forward a Ctrl-C/SIGTERM to the children and let them finish up
+	def shutdown(signum, frame):
+		for process in processes:
+			if process.is_alive():
+				process.terminate()
+	previous = {
+		signum: signal.signal(signum, shutdown)
+		for signum in (signal.SIGINT, signal.SIGTERM)
+	}
+	try:
+		for process in processes:
+			process.join()
+	finally:
+		for signum, handler in previous.items():
+			signal.signal(signum, handler)
+
+	output = config["output"]
+	merge_logs(
+		[os.path.join(output, f"process-{index}.log") for index in range(len(groups))],
+		os.path.join(output, "cluster.log")
+	)
+	results = []
+	for index in range(len(groups)):
+		path = os.path.join(output, f"process-{index}.json")
+		if os.path.exists(path):
+			with open(path) as f:
+				results.append(json.load(f))
+	summary = summarize(config, results)
+	with open(os.path.join(output, "summary.json"), "w") as f:
+		json.dump(summary, f, indent=1)
+	return summary
+
+if __name__ == "__main__":
+	if len(sys.argv) != 2:
+		print("usage: python -m hotstuff.launcher cluster.json")
+		sys.exit(2)
+	summary = launch(load_config(sys.argv[1]))
+	for replica in summary["replicas"]:
+		print(f"Replica {replica['id']} [{replica['fault']}]: height={replica['height']}, "
+		      f"locked view={replica['locked_view']}, state={replica['state']}")
+	for client in summary["clients"]:
+		print(f"Client {client['id']}: {client['completed']} commands completed")
+	print(f"consistent={summary['consistent']}")
@@ -0,0 +1,96 @@
+from hotstuff.hotstuff_types import *
+from hotstuff.cluster_config import *
+
+# membership changes are ordinary commands, committed like any other and
+# applied by the replicas rather than the state machine
+#   ADD_REPLICA [replica_id, host, port]   (host and port None when simulated)
+#   REMOVE_REPLICA [replica_id]
+# only the config's admins may send them, replicas refuse anyone else's
+# one that doesn't make sense against the membership it applies to, or that
+# isn't from an admin, is ignored, the same way by everyone
+ADD_REPLICA = "ADD_REPLICA"
+REMOVE_REPLICA = "REMOVE_REPLICA"
+RECONFIGURATIONS = {ADD_REPLICA, REMOVE_REPLICA}
+
+def authorized(config, cmd):
+	return cmd.op not in RECONFIGURATIONS or cmd.client_id in config.admins
+
+# config after cmd, None if cmd changes nothing
+def reconfigured(config, cmd):
+	if not authorized(config, cmd):
+		return None
+	args = cmd.args
+	if not isinstance(args, list) or not args:
+		return None
+	replica_id = args[0]
+	if isinstance(replica_id, bool) or not isinstance(replica_id, int):
+		return None
+	addresses = dict(config.replica_addresses)
+	if cmd.op == ADD_REPLICA:
+		if len(args) != 3 or config.is_member(replica_id):
+			return None
+		host, port = args[1], args[2]
+		if host is None and port is None:
+			addresses[replica_id] = None
+		elif isinstance(host, str) and isinstance(port, int) and not isinstance(port, bool):
+			addresses[replica_id] = (host, port)
+		else:
+			return None
+	elif cmd.op == REMOVE_REPLICA:
+		if len(args) != 1 or not config.is_member(replica_id) or config.n == 1:
+			return None
+		del addresses[replica_id]
+	else:
+		return None
+	return config.replace(addresses)
+
+# every config the cluster went through, by the first view it applies to
+# QCs and votes are checked against the config of their own view, so those
+# from just before a change still count after it
+class Membership:
+	def __init__(self, config):
+		self.configs = [(0, config)] # (first view, Cluster_config), oldest first
+
+	@property
+	def latest(self):
+		return self.configs[-1][1]
+
+	def config_for(self, view):
+		for first_view, config in reversed(self.configs):
+			if first_view <= view:
+				return config
+		return self.configs[0][1]
+
+	# changes committed in one view are merged into one config
+	def schedule(self, first_view, config):
+		while self.configs and self.configs[-1][0] >= first_view:
+			self.configs.pop()
+		self.configs.append((first_view, config))
+
+	# [[first view, [[replica_id, host, port], ...]], ...], the codec can
+	# write it
+	def snapshot(self):
+		snapshot = []
+		for first_view, config in self.configs:
+			members = []
+			for replica_id in config.replica_ids:
+				address = config.replica_addresses[replica_id]
+				host, port = address if address is not None else (None, None)
+				members.append([replica_id, host, port])
+			snapshot.append([first_view, members])
+		return snapshot
+
+	# options other than membership come from template
+	@staticmethod
+	def restore(snapshot, template):
+		membership = Membership(template)
+		membership.configs = []
+		for first_view, members in snapshot:
+			addresses = {
+				replica_id: (host, port) if host is not None else None
+				for replica_id, host, port in members
+			}
+			membership.configs.append((first_view, template.replace(addresses)))
+		if not membership.configs:
+			raise ValueError("empty membership")
+		return membership
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from hotstuff.hotstuff_types import *
+
+# client commands waiting to be proposed, by hash, oldest first per client
+# batches take one command per client in turn, so a busy client can't fill
+# every block on its own
+# commands stay until they are committed, hashes of recently committed ones
+# are remembered so a resubmitted or re-forwarded copy is turned away
+class Mempool:
+	def __init__(self, max_size=10000, recent_size=100000):
+		self.max_size = max_size
+		self.recent_size = recent_size
+		self.cmds = {} # hash -> cmd
+		self.queues = OrderedDict() # client_id -> OrderedDict(hash -> cmd)
+		self.recent = OrderedDict() # committed hashes, oldest first
+
+	def __len__(self):
+		return len(self.cmds)
+
+	def __contains__(self, cmd_hash):
+		return cmd_hash in self.cmds
+
+	def full(self):
+		return len(self.cmds) >= self.max_size
+
+	def committed(self, cmd_hash):
+		return cmd_hash in self.recent
+
+	# False if cmd is already here, was committed lately or we're full
+	def add(self, cmd):
+		if cmd.hash in self.cmds or cmd.hash in self.recent or self.full():
+			return False
+		self.cmds[cmd.hash] = cmd
+		if cmd.client_id not in self.queues:
+			self.queues[cmd.client_id] = OrderedDict()
+		self.queues[cmd.client_id][cmd.hash] = cmd
+		return True
+
+	def remove(self, cmd):
+		if self.cmds.pop(cmd.hash, None) is None:
+			return
+		queue = self.queues[cmd.client_id]
+		del queue[cmd.hash]
+		if not queue:
+			del self.queues[cmd.client_id]
+
+	def mark_committed(self, cmds):
+		for cmd in cmds:
+			self.remove(cmd)
+			self.recent[cmd.hash] = None
+			self.recent.move_to_end(cmd.hash)
+		while len(self.recent) > self.recent_size:
+			self.recent.popitem(last=False)
+
+	# up to max_count commands and max_bytes (at least one command), round
+	# robin over clients, skipping the hashes in exclude
+	# the client served first goes to the back for the next batch
+	def batch(self, max_count, max_bytes, exclude=()):
+		batch = []
+		batch_bytes = 0
+		queues = [iter(queue.values()) for queue in self.queues.values()]
+		while queues and len(batch) < max_count:
+			remaining = []
+			for queue in queues:
+				cmd = next(queue, None)
+				while cmd is not None and cmd.hash in exclude:
+					cmd = next(queue, None)
+				if cmd is None:
+					continue
+				cmd_bytes = cmd.size()
+				if batch and batch_bytes + cmd_bytes > max_bytes:
+					return self.rotate(batch)
+				batch.append(cmd)
+				batch_bytes += cmd_bytes
+				if len(batch) >= max_count:
+					return self.rotate(batch)
+				remaining.append(queue)
+			queues = remaining
+		return self.rotate(batch)
+
+	def rotate(self, batch):
+		if batch:
+			self.queues.move_to_end(batch[0].client_id)
+		return batch
+
+	# everything, oldest first, and empties the pool
+	def take_all(self):
+		cmds = list(self.cmds.values())
+		self.cmds = {}
+		self.queues = OrderedDict()
+		return cmds
@@ -0,0 +1,116 @@
+import logging
+import os
+from collections import deque
+from hotstuff.hotstuff_types import *
+
+# counters, gauges and histograms of one replica, plus optional per-view
+# trace spans
+# names are plain strings, a label splits a counter or histogram by e.g.
+# phase, snapshot() flattens them to "name.label"
+class Histogram:
+	SAMPLES = 1024
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+		self.samples = deque(maxlen=Histogram.SAMPLES) # the latest ones
+
+	def observe(self, value):
+		self.count += 1
+		self.total += value
+		self.max = max(self.max, value)
+		self.samples.append(value)
+
+	def percentile(self, q):
+		if not self.samples:
+			return None
+		ordered = sorted(self.samples)
+		return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+	def summary(self):
+		return {
+			"count": self.count,
+			"mean": self.total / self.count if self.count else None,
+			"p50": self.percentile(0.50),
+			"p99": self.percentile(0.99),
+			"max": self.max,
+		}
+
+# everything that happened in one view, times relative to its start
+class Span:
+	def __init__(self, view, start):
+		self.view = view
+		self.start = start
+		self.end = None
+		self.events = [] # (name, seconds since start)
+
+	def to_dict(self):
+		return {
+			"view": self.view,
+			"start": self.start,
+			"end": self.end,
+			"events": [(str(name), offset) for name, offset in self.events],
+		}
+
+class Metrics:
+	MAX_SPANS = 4096
+
+	def __init__(self, spans=False):
+		self.counters = {}
+		self.gauges = {}
+		self.histograms = {}
+		# None while span tracing is off, so it costs one check
+		self.spans = deque(maxlen=Metrics.MAX_SPANS) if spans else None
+		self.span = None
+
+	def inc(self, name, label=None, value=1):
+		key = name if label is None else (name, label)
+		self.counters[key] = self.counters.get(key, 0) + value
+
+	def set(self, name, value):
+		self.gauges[name] = value
+
+	def observe(self, name, value, label=None):
+		key = name if label is None else (name, label)
+		histogram = self.histograms.get(key)
+		if histogram is None:
+			histogram = self.histograms[key] = Histogram()
+		histogram.observe(value)
+
+	def start_view(self, view):
+		if self.spans is None:
+			return
+		started = now()
+		if self.span is not None:
+			self.span.end = started
+		self.span = Span(view, started)
+		self.spans.append(self.span)
+
+	def event(self, name):
+		if self.span is not None:
+			self.span.events.append((name, now() - self.span.start))
+
+	def export_spans(self):
+		return [span.to_dict() for span in self.spans or []]
+
+	def snapshot(self):
+		return {
+			"counters": {flat(key): value for key, value in self.counters.items()},
+			"gauges": dict(self.gauges),
+			"histograms": {
+				flat(key): histogram.summary()
+				for key, histogram in self.histograms.items()
+			},
+		}
+
+def flat(key):
+	return key if isinstance(key, str) else f"{key[0]}.{key[1]}"
+
+# log level from HOTSTUFF_LOG (DEBUG, INFO, WARNING, ...) for the scripts
+# in tests/, at WARNING and above nothing on the hot path gets formatted
+def setup_logging(default="INFO"):
+	logging.basicConfig(
+		level=os.environ.get("HOTSTUFF_LOG", default).upper(),
+		format="%(message)s",
+	)
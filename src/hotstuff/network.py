@@ -1,19 +1,194 @@
-import pickle
 import asyncio
+import logging
+from collections import deque
 from hotstuff.hotstuff_types import *
+from hotstuff.codec import *
+from hotstuff.metrics import *
+
+logger = logging.getLogger(__name__)
+
+# phases that can wait behind protocol progress
+BULK_PHASES = {
+	Protocol_phase.NEW_VIEW,
+	Protocol_phase.FORWARD,
+	Protocol_phase.BLOCK_REQUEST,
+	Protocol_phase.STATE_REQUEST,
+}
+
+# two lanes: proposals, votes and QCs first, client commands and queries,
+# NEW-VIEW floods and sync and state requests after them
+# every BULK_EVERY urgent messages one bulk message goes through so client
+# commands can't starve
+class Inbox:
+	BULK_EVERY = 8
+
+	def __init__(self):
+		self.urgent = deque()
+		self.bulk = deque()
+		self.ready = asyncio.Event()
+		self.urgent_in_a_row = 0
+
+	def qsize(self):
+		return len(self.urgent) + len(self.bulk)
+
+	def empty(self):
+		return not self.urgent and not self.bulk
+
+	def lane(self, payload):
+		if isinstance(payload, (Command, Query)) or payload.phase in BULK_PHASES:
+			return self.bulk
+		return self.urgent
+
+	def put_nowait(self, payload):
+		self.lane(payload).append(payload)
+		self.ready.set()
+
+	async def put(self, payload):
+		self.put_nowait(payload)
+
+	# everything one socket read produced, wakes the reader once
+	def put_many(self, payloads):
+		for payload in payloads:
+			self.lane(payload).append(payload)
+		if payloads:
+			self.ready.set()
+
+	async def get(self):
+		while self.empty():
+			self.ready.clear()
+			await self.ready.wait()
+		if self.urgent and \
+			(not self.bulk or self.urgent_in_a_row < Inbox.BULK_EVERY):
+			self.urgent_in_a_row += 1
+			return self.urgent.popleft()
+		self.urgent_in_a_row = 0
+		return self.bulk.popleft()
+
+class Peer_health(Enum):
+	UNKNOWN = 0 # never tried
+	UP = 1
+	DOWN = 2 # last connect or write failed, reconnecting
+
+# outbound side of the connection to one replica
+# send() only queues, the writer task connects, writes whatever piled up with
+# one drain and reconnects with exponential backoff, so a slow or dead peer
+# never holds up the replica
+# the queue is bounded, when it is full (or the peer is down) messages from
+# views older than the newest queued one are dropped first
+class Peer:
+	MAX_QUEUE = 1024
+	MIN_BACKOFF = 0.05
+	MAX_BACKOFF = 2.0
+
+	def __init__(self, network, replica_id):
+		self.network = network
+		self.replica_id = replica_id
+		self.queue = deque() # (view, packet)
+		self.ready = asyncio.Event()
+		self.health = Peer_health.UNKNOWN
+		self.writer = None
+		self.task = None
+		self.backoff = Peer.MIN_BACKOFF
+
+	def put(self, view, packet):
+		if self.queue and self.health == Peer_health.DOWN:
+			self.drop_stale(view)
+		if len(self.queue) >= Peer.MAX_QUEUE:
+			self.drop_stale(max(queued for queued, _ in self.queue))
+			if len(self.queue) >= Peer.MAX_QUEUE:
+				self.queue.popleft()
+				self.network.metrics.inc("send_dropped")
+		self.queue.append((view, packet))
+		self.ready.set()
+		if self.task is None:
+			self.task = asyncio.get_running_loop().create_task(self.run())
+
+	def drop_stale(self, view):
+		kept = deque(entry for entry in self.queue if entry[0] >= view)
+		if len(kept) < len(self.queue):
+			self.network.metrics.inc("send_dropped", value=len(self.queue) - len(kept))
+			self.queue = kept
+
+	async def connect(self):
+		try:
+			_, self.writer = await asyncio.open_connection(
+				*self.network.config.replica_addresses[self.replica_id]
+			)
+		except OSError:
+			self.mark_down()
+			return False
+		if self.health == Peer_health.DOWN:
+			logger.info("[R%s] Peer %s is back", self.network.replica_id, self.replica_id)
+			self.network.metrics.inc("reconnects")
+		self.health = Peer_health.UP
+		self.backoff = Peer.MIN_BACKOFF
+		return True
+
+	def mark_down(self):
+		if self.health != Peer_health.DOWN:
+			logger.warning("[R%s] Peer %s is down", self.network.replica_id, self.replica_id)
+			self.network.metrics.inc("peer_down")
+		self.health = Peer_health.DOWN
+		if self.writer is not None:
+			self.writer.close()
+			self.writer = None
+
+	async def run(self):
+		while True:
+			# a down peer is probed even with nothing to send, broadcast skips
+			# it until it is back
+			while not self.queue and self.health != Peer_health.DOWN:
+				self.ready.clear()
+				await self.ready.wait()
+			if self.writer is None and not await self.connect():
+				await asyncio.sleep(self.backoff)
+				self.backoff = min(self.backoff * 2, Peer.MAX_BACKOFF)
+				continue
+			batch, self.queue = self.queue, deque()
+			try:
+				for _, packet in batch:
+					self.writer.write(len(packet).to_bytes(4, 'big'))
+					self.writer.write(packet)
+				await self.writer.drain()
+			except (ConnectionError, OSError):
+				# no telling what got through, the protocol copes with losses
+				self.network.metrics.inc("send_dropped", value=len(batch))
+				self.mark_down()
+
+	async def close(self):
+		if self.task is not None:
+			self.task.cancel()
+			self.task = None
+		if self.writer is not None:
+			self.writer.close()
+			try:
+				await self.writer.wait_closed()
+			except ConnectionError:
+				# the peer went away first, nothing left to flush
+				pass
+			self.writer = None
 
 # replica's way of talking with the world
 class Network:
-	def __init__(self, replica_id, replica_addresses, host='127.0.0.1', port=50000):
+	# listens on the replica's address in config unless host and port say
+	# otherwise
+	def __init__(self, replica_id, config, host=None, port=None):
 		# the id of the replica who uses the object
 		self.replica_id = replica_id
-		self.inbox = asyncio.Queue()
-		self.replica_addresses = replica_addresses # replica_id -> (host: string, port: int)
-		self.replica_conns = {} # replica_id -> (reader, writer)
+		self.config = config # a Cluster_config
+		self.inbox = Inbox()
+		# a replica puts its own registry in here
+		self.metrics = Metrics()
+		# cleared by the replica while it can't take more client commands
+		self.accepting_cmds = asyncio.Event()
+		self.accepting_cmds.set()
+		self.peers = {} # replica_id -> Peer, made on first send
+		self.closing = set() # Peer.close() of replicas that left
 		self.client_conns = {} # client_id -> (reader, writer)
 		self.server = None
-		self.host = host
-		self.port = port
+		own_host, own_port = config.replica_addresses[replica_id]
+		self.host = host if host is not None else own_host
+		self.port = port if port is not None else own_port
 	
 	async def start_server(self):
 		self.server = await asyncio.start_server(
@@ -21,82 +196,97 @@ class Network:
 			self.host,
 			self.port
 		)
-	
-	async def connect(self, replica_id):
-		if replica_id in self.replica_conns:
-			return True
 
-		if replica_id not in self.replica_addresses:
-			return False
-		
-		for attempt in range(3):
-			try:
-				host, port = self.replica_addresses[replica_id]
-				self.replica_conns[replica_id] = await asyncio.open_connection(host, port)
-				return True
-			except ConnectionRefusedError:
-				await asyncio.sleep(0.2)
-		return False
+	def peer(self, replica_id):
+		peer = self.peers.get(replica_id)
+		if peer is None and self.config.is_member(replica_id):
+			peer = self.peers[replica_id] = Peer(self, replica_id)
+		return peer
+
+	def health(self):
+		return {replica_id: peer.health.name for replica_id, peer in self.peers.items()}
 
 	async def recv(self, reader, writer):
+		frames = Frame_reader(reader)
 		try:
 			while True:
-				# first 32 bits of message are the byte count
-				packet_byte_count = await reader.readexactly(4)
-				packet_byte_count = int.from_bytes(packet_byte_count, 'big')				
-
-				packet = await reader.read(packet_byte_count)
-				if not packet:
-					continue
-				payload = pickle.loads(packet)
-				if isinstance(payload, Command):
-					self.client_conns[payload.client_id] = (reader, writer)
-				await self.inbox.put(payload)
+				payloads = []
+				for payload in await frames.read():
+					if isinstance(payload, Client_hello):
+						self.client_conns[payload.client_id] = (reader, writer)
+						continue
+					if isinstance(payload, Query):
+						self.client_conns[payload.client_id] = (reader, writer)
+					if isinstance(payload, Command):
+						self.client_conns[payload.client_id] = (reader, writer)
+						if not self.accepting_cmds.is_set():
+							self.inbox.put_many(payloads)
+							payloads = []
+							await self.accepting_cmds.wait()
+					payloads.append(payload)
+				self.inbox.put_many(payloads)
 		except asyncio.IncompleteReadError:
 			pass
 		except Exception as e:
-			print(f"Network error! {e}")
+			logger.warning("[R%s] Network error! %s", self.replica_id, e)
 		finally:
 			writer.close()
-			await writer.wait_closed()
+			try:
+				await writer.wait_closed()
+			except ConnectionError:
+				# the peer went away first, nothing left to flush
+				pass
 
 	async def send(self, recipient_id, msg):
 		if recipient_id == self.replica_id:
 			await self.inbox.put(msg)
 			return
+		self.enqueue(recipient_id, msg.view_number, encode(msg))
 
-		if not await self.connect(recipient_id):
+	def enqueue(self, recipient_id, view, packet):
+		peer = self.peer(recipient_id)
+		if peer is None:
 			return
+		self.metrics.inc("messages_sent")
+		self.metrics.inc("bytes_sent", value=len(packet))
+		peer.put(view, packet)
 
-		_, writer = self.replica_conns[recipient_id]
-		
-		packet = pickle.dumps(msg)
-		msg_byte_count = len(packet)
-
-		writer.write(msg_byte_count.to_bytes(4, 'big'))
-		writer.write(packet)
-		await writer.drain()
-
-	async def client_respond(self, cmd):
-		if cmd.client_id not in self.client_conns:
+	# reply is the committed Command or a Query_reply
+	async def client_respond(self, reply):
+		if reply.client_id not in self.client_conns:
 			return
-		reader, writer = self.client_conns[cmd.client_id]
-		packet = pickle.dumps(cmd)
-		cmd_byte_count = len(packet)
-		writer.write(cmd_byte_count.to_bytes(4, 'big'))
-		writer.write(packet)
+		reader, writer = self.client_conns[reply.client_id]
+		writer.write(frame(encode(reply)))
 		await writer.drain()
 
+	# encodes once, peers known to be down are skipped
 	async def broadcast(self, msg):
-		tasks = []
-		for replica_id in self.replica_addresses:
-			tasks.append(self.send(replica_id, msg))
-		await asyncio.gather(*tasks)
+		packet = encode(msg)
+		for replica_id in self.config.replica_ids:
+			if replica_id == self.replica_id:
+				self.inbox.put_nowait(msg)
+				continue
+			peer = self.peer(replica_id)
+			if peer.health == Peer_health.DOWN:
+				self.metrics.inc("send_skipped")
+				continue
+			self.enqueue(replica_id, msg.view_number, packet)
+
+	# the membership changed, connections to replicas that left are closed
+	def reconfigure(self, config):
+		self.config = config
+		for replica_id in [r for r in self.peers if not config.is_member(r)]:
+			task = asyncio.get_running_loop().create_task(self.peers.pop(replica_id).close())
+			self.closing.add(task)
+			task.add_done_callback(self.closed)
+
+	def closed(self, task):
+		self.closing.discard(task)
+		if not task.cancelled() and task.exception() is not None:
+			logger.warning("[R%s] Closing a peer failed: %r", self.replica_id, task.exception())
 
 	async def stop_server(self):
 		self.server.close()
-		for replica_id in self.replica_conns:
-			_, writer = self.replica_conns[replica_id]
-			writer.close()
-			await writer.wait_closed()
-
+		for peer in self.peers.values():
+			await peer.close()
+		await asyncio.gather(*self.closing, return_exceptions=True)
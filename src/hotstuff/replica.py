@@ -1,33 +1,112 @@
 import asyncio
+import logging
+from collections import deque
 from hotstuff.hotstuff_types import *
 from hotstuff.network import *
-from math import floor
+from hotstuff.block_store import *
+from hotstuff.signatures import *
+from hotstuff.cluster_config import *
+from hotstuff.storage import *
+from hotstuff.mempool import *
+from hotstuff.votes import *
+from hotstuff.state_machine import *
+from hotstuff.election import *
+from hotstuff.membership import *
+from hotstuff.metrics import *
 
+logger = logging.getLogger(__name__)
+
+# view timeouts follow how long views actually take
+# the base timeout is LATENCY_FACTOR times an EWMA of the time from entering a
+# view to making progress in it, doubled for every view in a row that timed
+# out and reset by the next one that makes progress
 class Pacemaker:
-	def __init__(self, timeout, replica_callback):
+	LATENCY_FACTOR = 4
+	EWMA_WEIGHT = 0.2
+	HISTORY = 1024
+
+	def __init__(self, timeout, replica_callback, election, min_timeout=None,
+	             max_timeout=None, min_view_interval=0.0):
+		# used until we have measured anything
 		self.timeout = timeout
+		self.min_timeout = min_timeout if min_timeout is not None else timeout / 20
+		self.max_timeout = max_timeout if max_timeout is not None else timeout * 8
+		self.min_view_interval = min_view_interval
 		self.current_view = 0
 		self.task = None
 		self.timer_running = False
 		self.replica_callback = replica_callback
+		self.election = election
+
+		self.view_latency = None # EWMA, seconds
+		self.failures = 0 # views in a row that timed out
+		self.view_started = now()
+		self.timed_out_at = None
+		self.timeouts = 0
+		# seconds from a timeout to the next view that made progress
+		self.view_change_latencies = deque(maxlen=Pacemaker.HISTORY)
 
 	def get_leader(self, view):
-		return view % Replica.N
+		return self.election.leader(view)
+
+	def current_timeout(self):
+		if self.view_latency is None:
+			timeout = self.timeout
+		else:
+			timeout = self.view_latency * Pacemaker.LATENCY_FACTOR
+		timeout = max(self.min_timeout, timeout) * 2 ** self.failures
+		return min(self.max_timeout, timeout)
+
+	# the current view got somewhere, e.g. a block was committed
+	def progress(self):
+		finished = now()
+		latency = finished - self.view_started
+		if self.view_latency is None:
+			self.view_latency = latency
+		else:
+			self.view_latency += Pacemaker.EWMA_WEIGHT * (latency - self.view_latency)
+		self.failures = 0
+		if self.timed_out_at is not None:
+			self.view_change_latencies.append(finished - self.timed_out_at)
+			self.timed_out_at = None
+
+	# keeps views from starting faster than min_view_interval apart
+	async def pace(self):
+		wait = self.view_started + self.min_view_interval - now()
+		if wait > 0:
+			await asyncio.sleep(wait)
+
+	def stats(self):
+		latencies = sorted(self.view_change_latencies)
+		return {
+			"timeouts": self.timeouts,
+			"timeout": self.current_timeout(),
+			"view_latency": self.view_latency,
+			"view_changes": len(latencies),
+			"view_change_latency_p50": latencies[len(latencies) // 2] if latencies else None,
+			"view_change_latency_max": latencies[-1] if latencies else None,
+		}
 
 	# when no progress is made
 	async def on_timeout(self):
 		self.timer_running = True
 		try:
-			await asyncio.sleep(self.timeout)
+			await asyncio.sleep(self.current_timeout())
 			# force replica to move to next view
-			print("TIMEOUT")
 			self.timer_running = False
-			self.current_view += 1
-			await self.replica_callback(self.current_view)
+			self.timeouts += 1
+			self.failures += 1
+			if self.timed_out_at is None:
+				self.timed_out_at = now()
+			# the replica enters the view, start_timer takes it from there
+			await self.replica_callback(self.current_view + 1)
 		except asyncio.CancelledError:
 			self.timer_running = False
 
+	# view is set when a new view starts, its latency is measured from here
 	def start_timer(self, view=None):	
+		if view is not None and view != self.current_view:
+			self.view_started = now()
 		self.current_view = view if view is not None else self.current_view
 		if self.task is not None and self.timer_running:
 			self.task.cancel()
@@ -37,72 +116,518 @@ class Pacemaker:
 		if self.task is not None and self.timer_running:
 			self.task.cancel()
 
+# phases whose handlers drop anything not from the current view
+# GENERIC_VOTE isn't here, the next leader takes votes a view early anyway
+BUFFERED_PHASES = {
+	Protocol_phase.NEW_VIEW,
+	Protocol_phase.PREPARE,
+	Protocol_phase.PREPARE_VOTE,
+	Protocol_phase.PRECOMMIT,
+	Protocol_phase.PRECOMMIT_VOTE,
+	Protocol_phase.COMMIT,
+	Protocol_phase.COMMIT_VOTE,
+	Protocol_phase.DECIDE,
+	Protocol_phase.GENERIC,
+}
+
+# fields a message must carry for its phase's handler, anything without
+# them is dropped before it gets there
+REQUIRED_FIELDS = {
+	Protocol_phase.NEW_VIEW: ("justify",),
+	Protocol_phase.PREPARE: ("block", "justify"),
+	Protocol_phase.PREPARE_VOTE: ("block_hash", "partial_sig"),
+	Protocol_phase.PRECOMMIT: ("justify",),
+	Protocol_phase.PRECOMMIT_VOTE: ("block_hash", "partial_sig"),
+	Protocol_phase.COMMIT: ("justify",),
+	Protocol_phase.COMMIT_VOTE: ("block_hash", "partial_sig"),
+	Protocol_phase.DECIDE: ("justify",),
+	Protocol_phase.GENERIC: ("block", "justify"),
+	Protocol_phase.GENERIC_VOTE: ("block_hash", "partial_sig"),
+	Protocol_phase.BLOCK_REQUEST: ("sender",),
+	Protocol_phase.BLOCK_RESPONSE: ("blocks",),
+	Protocol_phase.FORWARD: ("cmds",),
+	Protocol_phase.STATE_REQUEST: ("sender",),
+	Protocol_phase.STATE_RESPONSE: ("blocks", "proof", "snapshot", "partial_sig"),
+}
+
+def well_formed(msg):
+	return all(getattr(msg, field) is not None for field in REQUIRED_FIELDS.get(msg.phase, ()))
+
+# messages that arrived before we entered their view
+# only the next max_views views are kept, at most max_per_view messages each
+class View_buffer:
+	def __init__(self, max_views=4, max_per_view=1024):
+		self.max_views = max_views
+		self.max_per_view = max_per_view
+		self.views = {} # view -> list of messages
+
+	def __len__(self):
+		return sum(len(msgs) for msgs in self.views.values())
+
+	def add(self, msg, current_view):
+		if msg.view_number > current_view + self.max_views:
+			return False
+		msgs = self.views.setdefault(msg.view_number, [])
+		if len(msgs) >= self.max_per_view:
+			return False
+		msgs.append(msg)
+		return True
+
+	# messages for view, in phase order, and forget everything older
+	def drain(self, view):
+		for stale in [v for v in self.views if v < view]:
+			del self.views[stale]
+		msgs = self.views.pop(view, [])
+		msgs.sort(key=lambda msg: msg.phase.value)
+		return msgs
+
 class Replica:
-	N = 0
-	F = 0
-	QUORUM = 0
-	def __init__(self, replica_id, network, timeout=2.0):
+	# tag in the log lines, the faulty subclasses set their own
+	FAULT = "HONEST"
+	MAX_VERIFIED_QCS = 1024
+	SYNC_CHUNK = 64
+	SYNC_TIMEOUT = 1.0
+	# views between committing a membership change and it taking effect, so
+	# everyone has committed it by then
+	RECONFIG_DELAY = 10
+	# membership, keys, timeout and batch sizes come from network.config
+	# a joining replica starts from its peers' state instead of genesis, its
+	# config is the one it is being added to
+	# history is how many committed blocks we keep, see Block_store
+	def __init__(self, replica_id, network, storage=None, mempool_size=10000,
+	             metrics=None, state_machine=None, election=None, joining=False,
+	             history=None):
 		self.replica_id = replica_id
 		self.network = network
+		self.membership = Membership(network.config)
+		self.joining = joining
 		self.current_view = 0
 		self.current_proposal = None
-		self.log = [GENESIS_BLOCK]
-		self.pending_cmds = []
+		self.history = history
+		self.blocks = Block_store(keep=history)
+		self.mempool = Mempool(mempool_size)
+		# commands we passed on to a leader, kept until they are executed
+		self.forwarded = {} # hash -> cmd
 		
-		self.new_view_msgs = {}
-		self.prepare_votes = {}
-		self.precommit_votes = {}
-		self.commit_votes = {}
+		self.new_view_msgs = {} # view -> {sender: msg}
+		self.votes = Vote_collector(lambda view: self.membership.config_for(view).signature())
+
+		self.proposed_view = 0
+		# view in which we got a NEW-VIEW quorum, and its highest QC
+		self.new_view_ready = 0
+		self.new_view_qc = None
 		
 		self.high_prepare_qc = GENESIS_QC
 		self.locked_qc = GENESIS_QC
 		
 		self.is_leader = False
 		self.running = True
+		self.tasks = set()
+		self.future_msgs = View_buffer()
+
+		# phase -> handler, subclasses can add or replace entries
+		self.handlers = {
+			Protocol_phase.NEW_VIEW: self.handle_new_view,
+			Protocol_phase.PREPARE: self.handle_prepare,
+			Protocol_phase.PREPARE_VOTE: self.handle_prepare_vote,
+			Protocol_phase.PRECOMMIT: self.handle_precommit,
+			Protocol_phase.PRECOMMIT_VOTE: self.handle_precommit_vote,
+			Protocol_phase.COMMIT: self.handle_commit,
+			Protocol_phase.COMMIT_VOTE: self.handle_commit_vote,
+			Protocol_phase.DECIDE: self.handle_decide,
+			Protocol_phase.GENERIC: self.handle_generic,
+			Protocol_phase.GENERIC_VOTE: self.handle_generic_vote,
+			Protocol_phase.BLOCK_REQUEST: self.handle_block_request,
+			Protocol_phase.BLOCK_RESPONSE: self.handle_block_response,
+			Protocol_phase.FORWARD: self.handle_forward,
+			Protocol_phase.STATE_REQUEST: self.handle_state_request,
+			Protocol_phase.STATE_RESPONSE: self.handle_state_response,
+		}
+
+		# state sync, (peer, first height or block hash) -> future of the response
+		self.sync_requests = {}
+		self.sync_round = 0
+		self.syncing = False
+		# (view, phase, block hash) of QCs that already checked out
+		self.verified_qcs = {}
+		# while joining, (block hash, encoded snapshot) -> signers
+		self.state_responses = {}
+
+		# round robin unless told otherwise, see election.py
+		if election is None:
+			election = Round_robin(self.config.replica_ids)
+		self.election = election
+		self.pacemaker = Pacemaker(self.config.timeout, self.view_timed_out, election)
+		self.state_machine = state_machine if state_machine is not None else Key_value_store()
+		# optional Write_ahead_log, without it everything is lost on restart
+		self.storage = storage
+		# the network counts what it sends into the same registry
+		self.metrics = metrics if metrics is not None else Metrics()
+		network.metrics = self.metrics
+
+	@property
+	def config(self):
+		return self.network.config
+
+	# committed blocks, oldest first
+	@property
+	def log(self):
+		return self.blocks.committed
+
+	@property
+	def state(self):
+		return self.state_machine.snapshot()
+
+	# message is a %-format string, args are only formatted if the level
+	# is enabled
+	def trace(self, message, *args, level=logging.DEBUG):
+		if logger.isEnabledFor(level):
+			logger.log(level, f"[R{self.replica_id}][{self.FAULT}] {message}", *args)
+
+	# metrics, plus the pacemaker's view timing
+	def stats(self):
+		snapshot = self.metrics.snapshot()
+		snapshot["pacemaker"] = self.pacemaker.stats()
+		return snapshot
+
+	def formed_qc(self, qc):
+		self.trace("Leader formed %s", qc)
+		self.metrics.inc("qcs_formed", qc.phase)
+		self.metrics.observe("phase_latency", now() - self.pacemaker.view_started, qc.phase)
+		self.metrics.event(qc.phase)
+
+	# False if we don't have the block behind block_hash
+	def extends(self, new_block, block_hash):
+		from_block = self.blocks.get(block_hash)
+		return from_block is not None and self.blocks.extends(new_block, from_block)
+
+	def sign(self, phase, block_hash):
+		digest = vote_digest(self.current_view, phase, block_hash)
+		return (self.replica_id, self.config.scheme.sign(self.replica_id, digest))
+
+	# votes name the block by hash, everyone has it from the proposal
+	def vote(self, phase, block_hash):
+		msg = Message(phase, self.current_view, None, None, self.sign(phase, block_hash))
+		msg.block_hash = block_hash
+		return msg
 
-		self.pacemaker = Pacemaker(timeout, self.start_new_view)
-		self.state = {}
-		Replica.N += 1
-		Replica.F = floor((Replica.N - 1) / 3)
-		Replica.QUORUM = 2 * Replica.F + 1
-
-	def trace(self, string):
-		print(f"[R{self.replica_id}][HONEST] {string}")
-
-	def extends(self, new_block, from_block):
-		current_block = new_block
-		while current_block.hash != from_block.hash:
-			if current_block.parent is None:
-				return False
-			current_block = current_block.parent
+	# the QC if msg is the vote that completes its quorum
+	def collect_vote(self, msg, phase):
+		sig = self.votes.add(msg.view_number, msg.phase, msg.block_hash, msg.partial_sig)
+		if sig is None:
+			return None
+		return QC(phase, msg.view_number, msg.block_hash, sig)
+
+	def valid_vote(self, msg):
+		try:
+			signer_id, share = msg.partial_sig
+		except (TypeError, ValueError):
+			return False
+		config = self.membership.config_for(msg.view_number)
+		if not config.is_member(signer_id):
+			return False
+		digest = vote_digest(msg.view_number, msg.phase, msg.block_hash)
+		return config.scheme.verify(signer_id, digest, share)
+
+	def verify_qc(self, qc):
+		if qc is None:
+			return False
+		if qc.view_number == 0:
+			return qc.block_hash == GENESIS_BLOCK.hash
+		if qc.phase not in VOTE_PHASE:
+			return False
+		key = (qc.view_number, qc.phase, qc.block_hash)
+		if key in self.verified_qcs:
+			return True
+		config = self.membership.config_for(qc.view_number)
+		if not all(config.is_member(signer_id) for signer_id in qc.signature.combined):
+			return False
+		if not qc.signature.verify(config.scheme, qc.digest(), config.quorum):
+			return False
+		self.verified_qcs[key] = True
+		if len(self.verified_qcs) > Replica.MAX_VERIFIED_QCS:
+			del self.verified_qcs[next(iter(self.verified_qcs))]
 		return True
 
 	def safe_block(self, block, qc):
-		return (self.extends(block, self.locked_qc.block) or 
+		return (self.extends(block, self.locked_qc.block_hash) or 
 		        (qc.view_number > self.locked_qc.view_number))
 
+	# sends and state sync run as their own tasks, a slow peer never holds
+	# up the handler, stop() cancels whatever is left
+	def spawn(self, coro):
+		task = asyncio.create_task(coro)
+		self.tasks.add(task)
+		task.add_done_callback(self.task_done)
+
+	def task_done(self, task):
+		self.tasks.discard(task)
+		if not task.cancelled() and task.exception() is not None:
+			self.trace("Task failed: %r", task.exception(), level=logging.WARNING)
+
+	def stop(self):
+		self.running = False
+		self.pacemaker.stop_timer()
+		for task in list(self.tasks):
+			task.cancel()
+
 	async def send(self, recipient_id, msg):
 		msg.sender = self.replica_id
-		await self.network.send(recipient_id, msg)
+		self.spawn(self.network.send(recipient_id, msg))
 
 	async def broadcast(self, msg):
 		msg.sender = self.replica_id
-		await self.network.broadcast(msg)
+		self.spawn(self.network.broadcast(msg))
 
+	# only the leader keeps commands, everyone else passes them on, so a
+	# command is stored and sent once instead of once per replica
+	# a resubmitted command that is already committed is answered right
+	# away, the client missed our reply and waits for F+1 of them
+	# membership changes from anyone but an admin go no further
 	async def handle_client_cmd(self, cmd):
-		self.pending_cmds.append(cmd)
+		if not authorized(self.config, cmd):
+			self.metrics.inc("unauthorized")
+			self.trace("Refusing %s from client %s", cmd.op, cmd.client_id, level=logging.WARNING)
+			return
+		if self.mempool.committed(cmd.hash):
+			self.metrics.inc("resubmitted")
+			self.spawn(self.network.client_respond(cmd))
+			return
+		if not self.is_leader:
+			self.forward([cmd], self.pacemaker.get_leader(self.current_view))
+			self.admit()
+			return
+		await self.accept_cmds([cmd])
 
-	# NEW-VIEW - replica
-	async def start_new_view(self, new_view):
-		if new_view <= self.current_view:
+	# FORWARD - whoever gets it keeps the commands, if it isn't the leader
+	# (anymore) they go on with the next view change
+	# what doesn't fit in the mempool is dropped, the forwarder retries
+	async def handle_forward(self, msg):
+		cmds = [cmd for cmd in msg.cmds if authorized(self.config, cmd)]
+		if cmds:
+			await self.accept_cmds(cmds)
+
+	def forward(self, cmds, leader_id):
+		for cmd in cmds:
+			self.forwarded[cmd.hash] = cmd
+		msg = Message(Protocol_phase.FORWARD, self.current_view, None, None)
+		msg.cmds = cmds
+		msg.sender = self.replica_id
+		self.spawn(self.network.send(leader_id, msg))
+
+	async def accept_cmds(self, cmds):
+		for cmd in cmds:
+			self.mempool.add(cmd)
+		self.admit()
+		# the view may be waiting on nothing but a command
+		if self.is_leader:
+			if self.config.chained:
+				await self.propose_generic()
+			else:
+				await self.propose()
+
+	# a full mempool stops us reading client connections until it drains,
+	# so clients feel it as TCP backpressure
+	def admit(self):
+		if len(self.mempool) + len(self.forwarded) < self.mempool.max_size:
+			self.network.accepting_cmds.set()
+		else:
+			self.network.accepting_cmds.clear()
+
+	# take as many pending commands as fit, skipping those already proposed
+	# in the uncommitted blocks between parent and the tip
+	# they stay pending until decided, so a failed view doesn't lose them
+	def next_batch(self, parent):
+		proposed = set()
+		for block in self.blocks.uncommitted_chain(parent) or []:
+			proposed.update(cmd.hash for cmd in block.cmds)
+		return self.mempool.batch(self.config.max_batch_size, self.config.max_batch_bytes, proposed)
+
+	def execute(self, block):
+		self.state_machine.apply(block.cmds)
+		self.election.committed(block)
+		for cmd in block.cmds:
+			if cmd.op in RECONFIGURATIONS:
+				self.reconfigure(cmd, block.view)
+		self.trace("Executed %s", block.cmds)
+		self.mempool.mark_committed(block.cmds)
+		for cmd in block.cmds:
+			self.forwarded.pop(cmd.hash, None)
+		self.admit()
+
+	# a committed ADD_REPLICA / REMOVE_REPLICA, see membership.py
+	# everyone executes it at the same height, so they all schedule the
+	# same config from the same view
+	def reconfigure(self, cmd, view):
+		config = reconfigured(self.membership.latest, cmd)
+		if config is None:
+			self.trace("Ignoring %s %s", cmd.op, cmd.args, level=logging.WARNING)
 			return
-		
+		first_view = view + Replica.RECONFIG_DELAY
+		self.membership.schedule(first_view, config)
+		self.election.reconfigure(first_view, config.replica_ids)
+		self.trace("%s %s from view %d", cmd.op, cmd.args, first_view, level=logging.INFO)
+		if self.current_view >= first_view:
+			self.activate(self.current_view)
+
+	# switch to the config of view, a replica that isn't in it retires
+	def activate(self, view):
+		config = self.membership.config_for(view)
+		if config is not self.config:
+			self.network.reconfigure(config)
+			self.metrics.inc("reconfigurations")
+			self.trace("Now %r", config, level=logging.INFO)
+		if self.running and not config.is_member(self.replica_id):
+			self.trace("Removed from the cluster at view %d", view, level=logging.WARNING)
+			self.stop()
+
+	# a Membership.snapshot() from disk or a peer, options stay our own
+	def restore_membership(self, snapshot):
+		self.membership = Membership.restore(snapshot, self.config)
+		for first_view, config in self.membership.configs:
+			self.election.reconfigure(first_view, config.replica_ids)
+
+	# read-only fast path, answered from the committed state right away
+	# the client waits for F+1 answers at the same height
+	def answer_query(self, query):
+		self.metrics.inc("queries")
+		reply = Query_reply(query.client_id, query.request_id, self.blocks.committed_height, None)
+		try:
+			reply.result = self.state_machine.query(query.op, query.args)
+		except Query_error as e:
+			self.metrics.inc("queries_refused")
+			reply.error = str(e)
+		self.spawn(self.network.client_respond(reply))
+
+	# committing a block commits its uncommitted ancestors too
+	# proof is the list of QCs that committed it, see proven_block, served
+	# to lagging replicas
+	async def commit(self, block, proof=None):
+		committed_blocks = self.blocks.commit(block, proof)
+		if committed_blocks:
+			self.pacemaker.progress()
+			self.metrics.inc("blocks_committed", value=len(committed_blocks))
+			self.metrics.inc(
+				"cmds_committed",
+				value=sum(len(committed.cmds) for committed in committed_blocks)
+			)
+			self.metrics.event("commit")
+		for committed in committed_blocks:
+			self.execute(committed)
+			if self.storage is not None:
+				self.storage.append_block(committed)
+			for cmd in committed.cmds:
+				self.spawn(self.network.client_respond(cmd))
+		if self.storage is not None and self.storage.snapshot_due():
+			await self.storage.snapshot(
+				self.blocks.tip,
+				self.blocks.committed_height,
+				self.state_machine.snapshot(),
+				self.locked_qc,
+				self.high_prepare_qc,
+				self.current_view,
+				membership=self.membership.snapshot(),
+				locked_block=self.blocks.get(self.locked_qc.block_hash),
+				high_prepare_block=self.blocks.get(self.high_prepare_qc.block_hash)
+			)
+
+	def update_high_qc(self, qc):
+		if qc.view_number <= self.high_prepare_qc.view_number:
+			return
+		self.high_prepare_qc = qc
+		if self.storage is not None:
+			self.storage.append_qc(RECORD_PREPARE_QC, qc, self.blocks.get(qc.block_hash))
+
+	def update_locked_qc(self, qc):
+		if qc.view_number <= self.locked_qc.view_number:
+			return
+		self.locked_qc = qc
+		if self.storage is not None:
+			self.storage.append_qc(RECORD_LOCKED_QC, qc, self.blocks.get(qc.block_hash))
+
+	# a vote must not leave before the view and QCs it depends on are on disk
+	async def persist(self):
+		if self.storage is not None:
+			await self.storage.sync()
+
+	# rebuild from what the storage found on disk
+	def recover(self, recovered):
+		self.blocks = Block_store(recovered.base_block, recovered.base_height, self.history)
+		self.state_machine.restore(recovered.state)
+		self.election.recovered(recovered.base_block.view)
+		if recovered.membership is not None:
+			self.restore_membership(recovered.membership)
+		for block in recovered.blocks:
+			block = self.blocks.add(block)
+			if block is None:
+				break
+			for committed in self.blocks.commit(block):
+				self.execute(committed)
+		# a leader builds on the block of its high QC
+		for block in (recovered.locked_block, recovered.high_prepare_block):
+			if block is not None:
+				self.blocks.add(block)
+		self.high_prepare_qc = recovered.high_prepare_qc
+		self.locked_qc = recovered.locked_qc
+		self.current_view = recovered.view
+		self.activate(self.current_view)
+		self.trace("Recovered at height %d, view %d", self.blocks.committed_height,
+		           self.current_view, level=logging.INFO)
+
+	def enter_view(self, new_view):
+		self.activate(new_view)
 		self.current_view = new_view
+		if self.storage is not None:
+			self.storage.append_view(new_view)
+		for msg in self.future_msgs.drain(new_view):
+			self.network.inbox.put_nowait(msg)
+		# GENERIC votes for the previous view still count
+		self.votes.prune(new_view - 1)
+		for old in [old for old in self.new_view_msgs if old < new_view]:
+			del self.new_view_msgs[old]
 		self.pacemaker.start_timer(new_view)
 		leader_id = self.pacemaker.get_leader(new_view)
 		self.is_leader = (leader_id == self.replica_id)
+		# pending commands follow the leadership
+		if not self.is_leader and len(self.mempool):
+			self.forward(self.mempool.take_all(), leader_id)
+		
+		self.metrics.inc("views_entered")
+		self.metrics.start_view(new_view)
+		self.metrics.set("inbox_depth", self.network.inbox.qsize())
+		self.metrics.set("mempool_size", len(self.mempool))
+		self.metrics.set("forwarded", len(self.forwarded))
+		self.trace("Entering view %d%s", new_view, " (LEADER)" if self.is_leader else "",
+		           level=logging.INFO)
+		return leader_id
+
+	# the leader we forwarded commands to may have dropped them, the next
+	# one gets them again
+	# the others may also have gone on without us, with QCs from a
+	# membership we haven't committed yet and so can't check, so we ask
+	async def view_timed_out(self, new_view):
+		# removed from the cluster in the meantime
+		if not self.running:
+			return
+		self.metrics.inc("timeouts")
+		self.trace("View %d timed out", new_view - 1, level=logging.WARNING)
+		self.start_sync()
+		retry = list(self.forwarded.values())
+		self.forwarded = {}
+		await self.start_new_view(new_view)
+		if not retry:
+			return
+		if self.is_leader:
+			await self.accept_cmds(retry)
+		else:
+			self.forward(retry, self.pacemaker.get_leader(self.current_view))
+
+	# NEW-VIEW - replica
+	async def start_new_view(self, new_view):
+		if new_view <= self.current_view:
+			return
 		
-		self.trace(f"Entering view {new_view} {'(LEADER)' if self.is_leader else ''}")
+		leader_id = self.enter_view(new_view)
 		
 		msg = Message(
 			Protocol_phase.NEW_VIEW,
@@ -116,288 +641,715 @@ class Replica:
 	# PREPARE - leader
 	async def handle_new_view(self, msg):
 		if not self.is_leader or \
-			not matching_msg(msg, Protocol_phase.NEW_VIEW, self.current_view):
+			not matching_msg(msg, Protocol_phase.NEW_VIEW, self.current_view) or \
+			not self.verify_qc(msg.justify):
 			return
 		
-		if msg.view_number not in self.new_view_msgs:
-			self.new_view_msgs[msg.view_number] = []
-		
-		self.new_view_msgs[msg.view_number].append(msg)
+		senders = self.new_view_msgs.setdefault(msg.view_number, {})
+		if msg.sender in senders or not self.config.is_member(msg.sender):
+			return
+		senders[msg.sender] = msg
 		
-		if len(self.new_view_msgs[msg.view_number]) == Replica.QUORUM:
+		if len(senders) == self.config.quorum:
 			highest_qc = max(
-				self.new_view_msgs[msg.view_number],
+				senders.values(),
 				key=lambda m: m.justify.view_number
 			).justify
-			
-			if len(self.pending_cmds) <= 0:
-				return
-			cmd = self.pending_cmds[0]
-			proposal_block = Block(
-				cmd,
-				highest_qc.block,
-				self.current_view
-			)
-			
-			proposal_msg = Message(
-				Protocol_phase.PREPARE,
-				self.current_view,
-				proposal_block,
-				highest_qc
-			)
-			
-			self.trace(f"Leader proposing {proposal_block}")
-			await self.broadcast(proposal_msg)
+			self.new_view_ready = self.current_view
+			self.new_view_qc = highest_qc
+
+			if self.config.chained:
+				self.update_high_qc(highest_qc)
+				await self.propose_generic()
+			else:
+				await self.propose()
+
+	# PREPARE - leader, once it has a NEW-VIEW quorum and commands
+	async def propose(self):
+		if not self.is_leader or self.proposed_view >= self.current_view or \
+			self.new_view_ready != self.current_view:
+			return
+		highest_qc = self.new_view_qc
+		parent = self.blocks.get(highest_qc.block_hash)
+		if parent is None:
+			self.spawn(self.fetch_justified(highest_qc))
+			return
+		batch = self.next_batch(parent)
+		if not batch:
+			return
+		self.proposed_view = self.current_view
+		proposal_block = Block(
+			batch,
+			parent.hash,
+			self.current_view
+		)
+		
+		proposal_msg = Message(
+			Protocol_phase.PREPARE,
+			self.current_view,
+			proposal_block,
+			highest_qc
+		)
+		
+		self.trace("Leader proposing %s", proposal_block)
+		self.metrics.event("propose")
+		await self.broadcast(proposal_msg)
 
 	# PREPARE - replica
 	async def handle_prepare(self, msg):
-		if not matching_msg(msg, Protocol_phase.PREPARE, self.current_view):
+		if not matching_msg(msg, Protocol_phase.PREPARE, self.current_view) or \
+			not self.verify_qc(msg.justify):
 			return
 		
-		if self.extends(msg.block, msg.justify.block) \
-			and self.safe_block(msg.block, msg.justify):
+		block = self.blocks.add(msg.block)
+		if block is None:
+			self.missing_parent(msg)
+			return
+		if self.extends(block, msg.justify.block_hash) \
+			and self.safe_block(block, msg.justify):
 			self.pacemaker.stop_timer()
-			self.trace(f"Voting for {msg.block}")
-			self.current_proposal = msg.block
+			self.trace("Voting for %s", block)
+			self.metrics.event("vote")
+			self.current_proposal = block
 
-			partial_sig = Signature.partial_sign(
-				self.current_view,
-				Protocol_phase.PREPARE_VOTE,
-				msg.block.hash
-			)
-
-			vote_msg = Message(
-				Protocol_phase.PREPARE_VOTE,
-				self.current_view,
-				msg.block,
-				None,
-				partial_sig
-			)
+			vote_msg = self.vote(Protocol_phase.PREPARE_VOTE, block.hash)
 
 			leader_id = self.pacemaker.get_leader(self.current_view)
 			self.pacemaker.start_timer()
+			await self.persist()
 			await self.send(leader_id, vote_msg)
 
 	# PRECOMMIT - leader
 	async def handle_prepare_vote(self, msg):
 		if not self.is_leader or \
-			not matching_msg(msg, Protocol_phase.PREPARE_VOTE, self.current_view):
+			not matching_msg(msg, Protocol_phase.PREPARE_VOTE, self.current_view) or \
+			not self.valid_vote(msg):
 			return
 		
-		if msg.view_number not in self.prepare_votes:
-			self.prepare_votes[msg.view_number] = []
-		
-		if msg.block.hash == self.current_proposal.hash:	
-			self.prepare_votes[msg.view_number].append(msg)
+		# dont count bogus votes
+		if self.current_proposal is None or msg.block_hash != self.current_proposal.hash:
+			return
 		
-		if len(self.prepare_votes[msg.view_number]) == Replica.QUORUM:
-			sig = Signature(Replica.N, Replica.F)
+		qc = self.collect_vote(msg, Protocol_phase.PREPARE)
+		if qc is None:
+			return
 
-			for vote in self.prepare_votes[msg.view_number]:
-				sig.combine(vote.partial_sig)
+		self.update_high_qc(qc)
 
-			qc = QC(
-				Protocol_phase.PREPARE,
-				self.current_view,
-				msg.block,
-				sig
-			)
-			
-			self.high_prepare_qc = qc
-			
-			self.trace(f"Leader formed {qc}")
-			
-			precommit_msg = Message(
-				Protocol_phase.PRECOMMIT,
-				self.current_view,
-				None,
-				qc
-			)
-			await self.broadcast(precommit_msg)
+		self.formed_qc(qc)
+
+		precommit_msg = Message(
+			Protocol_phase.PRECOMMIT,
+			self.current_view,
+			None,
+			qc
+		)
+		await self.broadcast(precommit_msg)
 
 	# PRECOMMIT - replica
 	async def handle_precommit(self, msg):
 		if not matching_qc(msg.justify, Protocol_phase.PREPARE, self.current_view):
 			return
-		if not msg.justify.signature.verify():
+		if not self.verify_qc(msg.justify):
 			return
 		
-		if msg.justify.view_number > self.high_prepare_qc.view_number:
-			self.high_prepare_qc = msg.justify
+		self.update_high_qc(msg.justify)
 		self.pacemaker.stop_timer()
-		partial_sig = Signature.partial_sign(
-			self.current_view,
-			Protocol_phase.PRECOMMIT_VOTE,
-			msg.justify.block.hash
-		)
-	
-		vote_msg = Message(
-			Protocol_phase.PRECOMMIT_VOTE,
-			self.current_view,
-			msg.justify.block,
-			None,
-			partial_sig
-		)
+		vote_msg = self.vote(Protocol_phase.PRECOMMIT_VOTE, msg.justify.block_hash)
 		
 		leader_id = self.pacemaker.get_leader(self.current_view)
 		self.pacemaker.start_timer()
+		await self.persist()
 		await self.send(leader_id, vote_msg)
 
 	# COMMIT - leader
 	async def handle_precommit_vote(self, msg):
 		if not self.is_leader or \
-			not matching_msg(msg, Protocol_phase.PRECOMMIT_VOTE, self.current_view):
+			not matching_msg(msg, Protocol_phase.PRECOMMIT_VOTE, self.current_view) or \
+			not self.valid_vote(msg):
 			return
 		
-		if msg.view_number not in self.precommit_votes:
-			self.precommit_votes[msg.view_number] = []
-		
-		# dont count bogus votes	
-		if msg.block.hash == self.current_proposal.hash:
-			self.precommit_votes[msg.view_number].append(msg)
+		# dont count bogus votes
+		if self.current_proposal is None or msg.block_hash != self.current_proposal.hash:
+			return
 		
-		if len(self.precommit_votes[msg.view_number]) == Replica.QUORUM:
-			sig = Signature(Replica.N, Replica.F)
+		qc = self.collect_vote(msg, Protocol_phase.PRECOMMIT)
+		if qc is None:
+			return
 
-			for vote in self.precommit_votes[msg.view_number]:
-				sig.combine(vote.partial_sig)
+		self.formed_qc(qc)
 
-			qc = QC(
-				Protocol_phase.PRECOMMIT,
-				self.current_view,
-				msg.block,
-				sig
-			)
-			
-			self.trace(f"Leader formed {qc}")
-			
-			commit_msg = Message(
-				Protocol_phase.COMMIT,
-				self.current_view,
-				None,
-				qc
-			)
-			await self.broadcast(commit_msg)
+		commit_msg = Message(
+			Protocol_phase.COMMIT,
+			self.current_view,
+			None,
+			qc
+		)
+		await self.broadcast(commit_msg)
 
 	# COMMIT - replica
 	async def handle_commit(self, msg):
-		if not msg.justify.signature.verify() or \
+		if not self.verify_qc(msg.justify) or \
 			not matching_qc(msg.justify, Protocol_phase.PRECOMMIT, self.current_view):
 			return
 		
-		if msg.justify.view_number > self.locked_qc.view_number:
-			self.locked_qc = msg.justify
+		self.update_locked_qc(msg.justify)
 
 		self.pacemaker.stop_timer()	
-		partial_sig = Signature.partial_sign(
-			self.current_view,
-			Protocol_phase.COMMIT_VOTE,
-			msg.justify.block.hash
-		)	
-		vote_msg = Message(
-			Protocol_phase.COMMIT_VOTE,
-			self.current_view,
-			msg.justify.block,
-			None,
-			partial_sig
-		)
+		vote_msg = self.vote(Protocol_phase.COMMIT_VOTE, msg.justify.block_hash)
 		
 		leader_id = self.pacemaker.get_leader(self.current_view)
 		self.pacemaker.start_timer()
+		await self.persist()
 		await self.send(leader_id, vote_msg)
 
 	# DECIDE - leader
 	async def handle_commit_vote(self, msg):
 		if not self.is_leader or \
-			not matching_msg(msg, Protocol_phase.COMMIT_VOTE, self.current_view):
+			not matching_msg(msg, Protocol_phase.COMMIT_VOTE, self.current_view) or \
+			not self.valid_vote(msg):
 			return
 		
-		if msg.view_number not in self.commit_votes:
-			self.commit_votes[msg.view_number] = []
-		
-		if msg.block.hash == self.current_proposal.hash:
-			self.commit_votes[msg.view_number].append(msg)
+		# dont count bogus votes
+		if self.current_proposal is None or msg.block_hash != self.current_proposal.hash:
+			return
 		
-		if len(self.commit_votes[msg.view_number]) == Replica.QUORUM:
-			sig = Signature(Replica.N, Replica.F)
+		qc = self.collect_vote(msg, Protocol_phase.COMMIT)
+		if qc is None:
+			return
 
-			for vote in self.commit_votes[msg.view_number]:
-				sig.combine(vote.partial_sig)
+		self.formed_qc(qc)
 
-			qc = QC(
-				Protocol_phase.COMMIT,
-				self.current_view,
-				msg.block,
-				sig
-			)
-			
-			self.trace(f"Leader formed {qc}")
-			
-			decide_msg = Message(
-				Protocol_phase.DECIDE,
-				self.current_view,
-				None,
-				qc
-			)
-			await self.broadcast(decide_msg)
+		decide_msg = Message(
+			Protocol_phase.DECIDE,
+			self.current_view,
+			None,
+			qc
+		)
+		await self.broadcast(decide_msg)
 
 	# DECIDE - replica
 	async def handle_decide(self, msg):
-		if not msg.justify.signature.verify() or \
+		if not self.verify_qc(msg.justify) or \
 			not matching_qc(msg.justify, Protocol_phase.COMMIT, self.current_view):
 			return
 		
-		cmd = msg.justify.block.cmd
-		match cmd.op:
-			case "SET":
-				self.state[cmd.args[0]] = cmd.args[1]
-			
-		self.trace(f"Executed {msg.justify.block.cmd}")
-		for pending_cmds in self.pending_cmds:
-			if pending_cmds.hash == cmd.hash:
-				self.pending_cmds.remove(pending_cmds)
-				break
+		block = self.blocks.get(msg.justify.block_hash)
+		if block is not None:
+			await self.commit(block, [msg.justify])
+		else:
+			# we missed some ancestors
+			self.start_sync()
+		
+		await self.pacemaker.pace()
+		await self.start_new_view(self.current_view + 1)
 
-		self.log.append(msg.justify.block)
+	# the block certified by the QC this block carries, if we know it
+	def justified_block(self, block):
+		if block is None or block.justify is None:
+			return None
+		return self.blocks.get(block.justify.block_hash)
 
-		await self.network.client_respond(cmd)
+	# GENERIC - leader, once it holds the generic QC of the previous view
+	# or, after a view change, a quorum of NEW-VIEW messages
+	async def propose_generic(self):
+		if not self.is_leader or self.proposed_view >= self.current_view:
+			return
+		qc = self.high_prepare_qc
+		if self.new_view_ready != self.current_view and \
+			qc.view_number != self.current_view - 1:
+			return
+		parent = self.blocks.get(qc.block_hash)
+		if parent is None:
+			self.spawn(self.fetch_justified(qc))
+			return
+		batch = self.next_batch(parent)
+		if not batch:
+			# empty blocks are only worth proposing to flush the pipeline
+			chain = self.blocks.uncommitted_chain(parent)
+			if not chain or not any(block.cmds for block in chain):
+				return
+		self.proposed_view = self.current_view
+
+		proposal_block = Block(batch, parent.hash, self.current_view)
+		proposal_block.justify = qc
+		proposal_msg = Message(
+			Protocol_phase.GENERIC,
+			self.current_view,
+			proposal_block,
+			qc
+		)
 		
-		# let others catch-up
-		await asyncio.sleep(0.1)
-		await self.start_new_view(self.current_view + 1)
+		self.trace("Leader proposing %s", proposal_block)
+		self.metrics.event("propose")
+		await self.broadcast(proposal_msg)
+
+	# GENERIC - replica
+	# the QC of view v is the prepare QC for v + 1, the precommit QC for v
+	# and the commit QC for v - 1
+	# only a proposal from the view's leader that we vote for moves us on,
+	# anything else waits for the timeout
+	async def handle_generic(self, msg):
+		if not matching_msg(msg, Protocol_phase.GENERIC, self.current_view) or \
+			msg.sender != self.pacemaker.get_leader(self.current_view) or \
+			msg.justify.view_number < self.high_prepare_qc.view_number or \
+			not self.verify_qc(msg.justify):
+			return
+
+		b2 = self.blocks.get(msg.justify.block_hash)
+		b1 = self.justified_block(b2)
+		b0 = self.justified_block(b1)
+		b_star = self.blocks.add(msg.block)
+		if b_star is None:
+			self.missing_parent(msg)
+			return
+		if not self.extends(b_star, msg.justify.block_hash) or \
+			not self.safe_block(b_star, msg.justify):
+			return
+		b_star.justify = msg.justify
+
+		self.trace("Voting for %s", b_star)
+		self.metrics.event("vote")
+		vote_msg = self.vote(Protocol_phase.GENERIC_VOTE, b_star.hash)
+
+		next_leader_id = self.pacemaker.get_leader(self.current_view + 1)
+		await self.persist()
+		await self.send(next_leader_id, vote_msg)
+
+		if b2 is not None and b_star.parent_hash == b2.hash:
+			self.update_high_qc(msg.justify)
+			if b1 is not None and b2.parent_hash == b1.hash:
+				self.update_locked_qc(b2.justify)
+				if b0 is not None and b1.parent_hash == b0.hash:
+					await self.commit(b0, [b1.justify, b2.justify, msg.justify])
+
+		self.enter_view(self.current_view + 1)
+		# votes for the last view may have already formed our QC
+		await self.propose_generic()
+
+	# GENERIC - next leader
+	async def handle_generic_vote(self, msg):
+		view = msg.view_number
+		if self.pacemaker.get_leader(view + 1) != self.replica_id or \
+			not matching_msg(msg, Protocol_phase.GENERIC_VOTE, view) or \
+			view < self.current_view - 1 or \
+			not self.valid_vote(msg):
+			return
+		
+		qc = self.collect_vote(msg, Protocol_phase.GENERIC)
+		if qc is None:
+			return
+
+		self.update_high_qc(qc)
+
+		self.formed_qc(qc)
+		# a quorum got past the view, so can we, even if the proposal
+		# itself hasn't reached us
+		if qc.view_number >= self.current_view:
+			self.enter_view(qc.view_number + 1)
+		await self.propose_generic()
+
+	# the block a commit proof commits, None if the proof doesn't hold
+	# blocks is a hash chain, oldest first, that ends in the blocks the
+	# proof QCs are for
+	# basic mode: one COMMIT QC
+	# chained mode: three GENERIC QCs over a direct parent chain
+	def proven_block(self, blocks, proof):
+		if not blocks or not proof or len(proof) > len(blocks):
+			return None
+		if any(blocks[i].parent_hash != blocks[i - 1].hash for i in range(1, len(blocks))):
+			return None
+		certified = blocks[-len(proof):]
+		if any(qc.block_hash != block.hash for qc, block in zip(proof, certified)) or \
+			not all(self.verify_qc(qc) for qc in proof):
+			return None
+		if len(proof) == 1 and proof[0].phase == Protocol_phase.COMMIT:
+			return certified[0]
+		if len(proof) == 3 and all(qc.phase == Protocol_phase.GENERIC for qc in proof):
+			return certified[0]
+		return None
+
+	# a QC from a view we never got to means we fell behind
+	def lagging(self, msg):
+		return msg.justify is not None and \
+			msg.justify.view_number > self.current_view and \
+			self.verify_qc(msg.justify)
+
+	# QCs only name their block, one we never got is fetched by hash from
+	# whoever has it, the proposer and the leader that certified it have
+	def missing_parent(self, msg):
+		if msg.block.parent_hash in self.blocks:
+			# under our committed tip, nothing to vote for
+			return
+		self.spawn(self.fetch_parent(msg))
 
+	# and the proposal is looked at again, if we are still in its view
+	async def fetch_parent(self, msg):
+		if await self.fetch_block(msg.sender, msg.block.parent_hash) and \
+			msg.view_number == self.current_view:
+			self.network.inbox.put_nowait(msg)
+
+	# and the leader tries to propose again
+	async def fetch_justified(self, qc):
+		peer = self.pacemaker.get_leader(qc.view_number)
+		if peer == self.replica_id:
+			self.start_sync()
+			return
+		if await self.fetch_block(peer, qc.block_hash):
+			if self.config.chained:
+				await self.propose_generic()
+			else:
+				await self.propose()
+
+	# returns whether we have the block now
+	async def fetch_block(self, peer, block_hash):
+		if (peer, block_hash) in self.sync_requests:
+			return False
+		msg = Message(Protocol_phase.BLOCK_REQUEST, self.current_view, None, None)
+		msg.block_hash = block_hash
+		response = await self.fetch(peer, block_hash, msg)
+		if response is None:
+			return False
+		for block in response.blocks:
+			self.blocks.add(block)
+		if block_hash not in self.blocks and response.blocks and \
+			response.blocks[0].parent_hash not in self.blocks:
+			# the committed blocks under it are missing too
+			self.start_sync()
+		return block_hash in self.blocks
+
+	def start_sync(self):
+		if not self.syncing and not self.joining:
+			self.syncing = True
+			self.spawn(self.sync())
+
+	# pull committed blocks in chunks from all peers at once, apply what
+	# links to our tip, repeat until nobody has anything newer
+	# the chunks move round the peers from one round (and one sync) to the
+	# next, so a dead peer never gets the same chunk twice in a row
+	async def sync(self):
+		try:
+			peers = [r for r in self.config.replica_ids if r != self.replica_id]
+			idle = 0
+			while self.running and peers:
+				first = self.blocks.committed_height + 1
+				fetches = [
+					self.fetch_chunk(peers, i + self.sync_round, first + i * Replica.SYNC_CHUNK)
+					for i in range(len(peers))
+				]
+				self.sync_round += 1
+				responses = await asyncio.gather(*fetches)
+				applied, view = await self.apply_blocks(responses)
+				if applied == 0:
+					if any(self.trimmed(msg) for msg in responses):
+						self.spawn(self.catch_up())
+						break
+					# someone had blocks we couldn't use yet, the next
+					# round asks the others for the chunk that was missing
+					idle += 1
+					if idle >= len(peers) or all(r is None for r in responses):
+						break
+					continue
+				idle = 0
+				self.trace("Synced %d blocks, height %d", applied,
+				           self.blocks.committed_height, level=logging.INFO)
+				if view >= self.current_view:
+					await self.start_new_view(view + 1)
+		finally:
+			self.syncing = False
+
+	# an answer for the chunk right above our tip that starts further up,
+	# the peer no longer keeps the blocks we need, see Block_store.trim
+	def trimmed(self, msg):
+		return msg is not None and msg.height_range is not None and \
+			msg.height_range[0] == self.blocks.committed_height + 1 and \
+			msg.blocks[0].parent_hash not in self.blocks and \
+			self.proven_block(msg.blocks, msg.proof) is not None
+
+	# too far behind for block sync, we take the others' state like a
+	# replica that joins
+	async def catch_up(self):
+		if self.joining:
+			return
+		self.trace("Peers no longer keep height %d, taking their state",
+		           self.blocks.committed_height + 1, level=logging.WARNING)
+		self.metrics.inc("catch_ups")
+		self.joining = True
+		await self.bootstrap()
+
+	# asks the peers in turn, from the start'th on, until one has the chunk
+	async def fetch_chunk(self, peers, start, first):
+		for i in range(len(peers)):
+			peer = peers[(start + i) % len(peers)]
+			response = await self.fetch_blocks(peer, first, first + Replica.SYNC_CHUNK - 1)
+			if response is not None and response.blocks:
+				return response
+		return None
+
+	async def fetch_blocks(self, peer, first, last):
+		msg = Message(Protocol_phase.BLOCK_REQUEST, self.current_view, None, None)
+		msg.height_range = (first, last)
+		return await self.fetch(peer, first, msg)
+
+	# a BLOCK_REQUEST is answered by the BLOCK_RESPONSE with the same first
+	# height or block hash
+	async def fetch(self, peer, key, msg):
+		future = asyncio.get_running_loop().create_future()
+		self.sync_requests[(peer, key)] = future
+		try:
+			await self.send(peer, msg)
+			return await asyncio.wait_for(future, Replica.SYNC_TIMEOUT)
+		except asyncio.TimeoutError:
+			return None
+		finally:
+			self.sync_requests.pop((peer, key), None)
+
+	# responses in height order, see proven_block
+	# returns how many blocks got committed and the highest view they proved
+	async def apply_blocks(self, responses):
+		applied = 0
+		view = 0
+		for msg in responses:
+			if msg is None:
+				continue
+			proven = self.proven_block(msg.blocks, msg.proof)
+			if proven is None:
+				continue
+			# chunks may overlap, start from whatever extends our tip
+			tip = self.blocks.tip.hash
+			start = next(
+				(i for i, block in enumerate(msg.blocks) if block.parent_hash == tip),
+				None
+			)
+			if start is None:
+				continue
+			for block in msg.blocks[start:]:
+				self.blocks.add(block)
+			committed_before = self.blocks.committed_height
+			await self.commit(self.blocks.get(proven.hash), msg.proof)
+			applied += self.blocks.committed_height - committed_before
+			view = max(view, msg.proof[-1].view_number)
+		return applied, view
+
+	# the first committed height from first to last whose block changes the
+	# membership, if any
+	def reconfiguration_height(self, first, last):
+		for height in range(first, min(last, self.blocks.committed_height) + 1):
+			if any(cmd.op in RECONFIGURATIONS for cmd in self.blocks.committed_at(height).cmds):
+				return height
+		return None
+
+	# BLOCK_REQUEST - any replica
+	async def handle_block_request(self, msg):
+		if msg.block_hash is not None:
+			await self.send_block(msg)
+			return
+		if msg.height_range is None:
+			return
+		first, last = msg.height_range
+		# from what we still keep, if it starts further up
+		first = max(first, self.blocks.base_height + 1)
+		last = min(max(last, first), first + Replica.SYNC_CHUNK - 1)
+		changed = self.reconfiguration_height(first, last)
+		if changed is None:
+			# stretch to a block we can prove, but not too far, or else
+			# send as much of the chunk as we can prove
+			proven = self.blocks.proven_height(last, last + Replica.SYNC_CHUNK)
+			if proven is None:
+				proven = self.blocks.proven_height(last, first)
+		else:
+			# a membership change ends the chunk at the proof that committed
+			# it, we checked that proof against the membership before the
+			# change, and so will the syncing replica
+			proven = self.blocks.proven_height(changed, changed + Replica.SYNC_CHUNK)
+			if proven is None and changed > first:
+				proven = self.blocks.proven_height(changed - 1, first)
+		response = Message(Protocol_phase.BLOCK_RESPONSE, self.current_view, None, None)
+		response.height_range = msg.height_range
+		response.blocks = []
+		if proven is not None:
+			proof, above = self.blocks.proofs[proven]
+			response.blocks = [
+				self.blocks.committed_at(height)
+				for height in range(first, proven + 1)
+			] + above
+			response.proof = proof
+		await self.send(msg.sender, response)
+
+	# the block and the uncommitted blocks under it, oldest first, nothing
+	# if we don't have it
+	async def send_block(self, msg):
+		response = Message(Protocol_phase.BLOCK_RESPONSE, self.current_view, None, None)
+		response.block_hash = msg.block_hash
+		response.blocks = []
+		block = self.blocks.get(msg.block_hash)
+		if block is not None:
+			chain = self.blocks.uncommitted_chain(block) or [block]
+			response.blocks = chain[-Replica.SYNC_CHUNK:]
+		await self.send(msg.sender, response)
+
+	# BLOCK_RESPONSE - syncing replica, or one missing a block
+	async def handle_block_response(self, msg):
+		if msg.block_hash is not None:
+			key = msg.block_hash
+		elif msg.height_range is not None:
+			key = msg.height_range[0]
+		else:
+			return
+		future = self.sync_requests.get((msg.sender, key))
+		if future is not None and not future.done():
+			future.set_result(msg)
+
+	# STATE_REQUEST - any replica, for one that is joining
+	# the committed tip, the proof that committed it and the state and
+	# membership as of it, signed so nobody can pass it off as ours
+	async def handle_state_request(self, msg):
+		entry = self.blocks.proofs.get(self.blocks.committed_height)
+		if entry is None or msg.sender is None:
+			return
+		proof, above = entry
+		response = Message(Protocol_phase.STATE_RESPONSE, self.current_view, None, None)
+		response.blocks = [self.blocks.tip] + above
+		response.proof = proof
+		response.snapshot = {
+			"height": self.blocks.committed_height,
+			"state": self.state_machine.snapshot(),
+			"membership": self.membership.snapshot(),
+		}
+		w = Writer()
+		write_value(w, response.snapshot)
+		digest = snapshot_digest(self.blocks.tip.hash, w.getvalue())
+		response.partial_sig = (self.replica_id, self.config.scheme.sign(self.replica_id, digest))
+		await self.send(msg.sender, response)
+
+	# STATE_RESPONSE - joining replica
+	# the proof shows the block was committed, but not the state next to
+	# it, so we wait for F+1 members to sign the same snapshot
+	async def handle_state_response(self, msg):
+		if not self.joining or not isinstance(msg.snapshot, dict):
+			return
+		try:
+			signer_id, share = msg.partial_sig
+		except (TypeError, ValueError):
+			return
+		if not self.config.is_member(signer_id):
+			return
+		proven = self.proven_block(msg.blocks, msg.proof)
+		if proven is None or proven is not msg.blocks[0]:
+			return
+		w = Writer()
+		try:
+			write_value(w, msg.snapshot)
+		except (TypeError, ValueError):
+			return
+		encoded = w.getvalue()
+		if not self.config.scheme.verify(signer_id, snapshot_digest(proven.hash, encoded), share):
+			return
+		senders = self.state_responses.setdefault((proven.hash, encoded), set())
+		senders.add(signer_id)
+		if len(senders) < self.config.f + 1:
+			return
+		try:
+			await self.install_state(msg.blocks, msg.proof, msg.snapshot)
+		except (TypeError, ValueError, KeyError) as e:
+			# also before our ADD_REPLICA is committed, we ask again
+			self.trace("Can't use state snapshot: %r", e, level=logging.INFO)
+			return
+		self.joining = False
+		self.state_responses = {}
+		self.trace("Joined at height %d", self.blocks.committed_height, level=logging.INFO)
+		await self.start_new_view(msg.proof[-1].view_number + 1)
+
+	# blocks[0] is the committed block the snapshot is as of, the rest are
+	# the blocks above it that proof certifies
+	async def install_state(self, blocks, proof, snapshot):
+		height = snapshot["height"]
+		if isinstance(height, bool) or not isinstance(height, int) or height < 0:
+			raise ValueError("bad height")
+		membership = Membership.restore(snapshot["membership"], self.config)
+		if not membership.latest.is_member(self.replica_id):
+			raise ValueError("not a member yet")
+		self.state_machine.restore(snapshot["state"])
+		block = blocks[0]
+		self.blocks = Block_store(block, height, self.history)
+		for above in blocks[1:]:
+			self.blocks.add(above)
+		self.blocks.proofs[height] = (proof, blocks[1:])
+		self.election.recovered(block.view)
+		self.membership = membership
+		for first_view, config in membership.configs:
+			self.election.reconfigure(first_view, config.replica_ids)
+		if self.storage is not None:
+			await self.storage.snapshot(
+				block,
+				height,
+				snapshot["state"],
+				self.locked_qc,
+				self.high_prepare_qc,
+				self.current_view,
+				membership=snapshot["membership"]
+			)
+
+	# ask the other members for their state until F+1 of them answer the
+	# same, answers from earlier rounds are dropped
+	async def bootstrap(self):
+		while self.joining and self.running:
+			self.state_responses = {}
+			for replica_id in self.config.replica_ids:
+				if replica_id != self.replica_id:
+					await self.send(replica_id, Message(
+						Protocol_phase.STATE_REQUEST, self.current_view, None, None
+					))
+			await asyncio.sleep(Replica.SYNC_TIMEOUT)
+
+	# override to hook every message, e.g. to drop or delay some
+	async def dispatch(self, payload):
+		if self.joining:
+			# nothing makes sense before we have the state
+			if isinstance(payload, Message) and payload.phase == Protocol_phase.STATE_RESPONSE:
+				await self.handle_state_response(payload)
+			return
+		if isinstance(payload, Command):
+			self.metrics.inc("client_cmds")
+			await self.handle_client_cmd(payload)
+			return
+		if isinstance(payload, Query):
+			self.answer_query(payload)
+			return
+		if not well_formed(payload):
+			self.metrics.inc("malformed", payload.phase)
+			return
+		if self.lagging(payload):
+			self.start_sync()
+		if payload.view_number > self.current_view and \
+			payload.phase in BUFFERED_PHASES:
+			self.future_msgs.add(payload, self.current_view)
+			return
+		self.metrics.inc("received", payload.phase)
+		handler = self.handlers.get(payload.phase)
+		if handler is not None:
+			await handler(payload)
+
+	# a message that makes a handler fail is dropped, not the replica
 	async def message_handler(self):
 		while self.running:
+			payload = await self.network.inbox.get()
 			try:
-				payload = await asyncio.wait_for(self.network.inbox.get(), timeout=1.0)
-				if isinstance(payload, Command):
-					await self.handle_client_cmd(payload)
-					continue
-				
-				match payload.phase:
-					case Protocol_phase.NEW_VIEW:
-						await self.handle_new_view(payload)
-					case Protocol_phase.PREPARE:
-						await self.handle_prepare(payload)
-					case Protocol_phase.PREPARE_VOTE:
-						await self.handle_prepare_vote(payload)
-					case Protocol_phase.PRECOMMIT:
-						await self.handle_precommit(payload)
-					case Protocol_phase.PRECOMMIT_VOTE:
-						await self.handle_precommit_vote(payload)
-					case Protocol_phase.COMMIT:
-						await self.handle_commit(payload)
-					case Protocol_phase.COMMIT_VOTE:
-						await self.handle_commit_vote(payload)
-					case Protocol_phase.DECIDE:
-						await self.handle_decide(payload)
-					
-			except asyncio.TimeoutError:
-				continue
+				await self.dispatch(payload)
+			except Exception as e:
+				self.metrics.inc("dropped")
+				self.trace("Dropped %r: %r", payload, e, level=logging.WARNING)
 
 	async def run(self):
+		if self.storage is not None:
+			self.recover(self.storage.open())
+			await self.storage.start()
 		await self.network.start_server()
+		if self.joining:
+			self.spawn(self.bootstrap())
+			await self.message_handler()
+			return
 		await asyncio.sleep(1)
-		await self.start_new_view(1)
+		await self.start_new_view(self.current_view + 1)
 		await self.message_handler()
 
@@ -0,0 +1,105 @@
+import hashlib
+import hmac
+import secrets
+
+try:
+	from cryptography.exceptions import InvalidSignature
+	from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+		Ed25519PrivateKey,
+		Ed25519PublicKey,
+	)
+except ImportError:
+	Ed25519PrivateKey = None
+
+# a scheme signs vote digests with per-replica keys
+# verify_each checks the shares of a QC one by one, none of the schemes
+# here can check them any faster together
+class Signature_scheme:
+	def sign(self, signer_id, digest):
+		raise NotImplementedError
+
+	def verify(self, signer_id, digest, share):
+		raise NotImplementedError
+
+	def verify_each(self, digest, shares):
+		return all(
+			self.verify(signer_id, digest, share)
+			for signer_id, share in shares.items()
+		)
+
+# HMAC-SHA256 with a key per replica derived from a cluster secret
+# stdlib only, but anyone holding the secret can sign for everyone, so it
+# only keeps out parties outside the cluster
+class Hmac_scheme(Signature_scheme):
+	def __init__(self, secret):
+		if not isinstance(secret, bytes) or not secret:
+			raise ValueError("Hmac_scheme needs a secret")
+		self.secret = secret
+		self.keys = {}
+
+	# a fresh secret, for a cluster running in one process
+	@staticmethod
+	def generate():
+		return Hmac_scheme(secrets.token_bytes(32))
+
+	def key(self, signer_id):
+		if signer_id not in self.keys:
+			self.keys[signer_id] = hmac.new(
+				self.secret, str(signer_id).encode(), hashlib.sha256
+			).digest()
+		return self.keys[signer_id]
+
+	def sign(self, signer_id, digest):
+		return hmac.new(self.key(signer_id), digest, hashlib.sha256).digest()
+
+	def verify(self, signer_id, digest, share):
+		if not isinstance(share, bytes):
+			return False
+		return hmac.compare_digest(self.sign(signer_id, digest), share)
+
+# Ed25519 from a local keyring: replica_id -> public key, plus the private
+# keys this process is allowed to sign with
+class Ed25519_scheme(Signature_scheme):
+	def __init__(self, public_keys, private_keys):
+		if Ed25519PrivateKey is None:
+			raise RuntimeError("Ed25519_scheme needs the cryptography package")
+		self.public_keys = {
+			signer_id: Ed25519PublicKey.from_public_bytes(key)
+			for signer_id, key in public_keys.items()
+		}
+		self.private_keys = {
+			signer_id: Ed25519PrivateKey.from_private_bytes(key)
+			for signer_id, key in private_keys.items()
+		}
+
+	# keyring for a whole cluster running in one process
+	@staticmethod
+	def generate(replica_ids):
+		return Ed25519_scheme(*Ed25519_scheme.generate_keys(replica_ids))
+
+	# raw public and private keys, replica_id -> bytes, for a keyring
+	# that is handed out to separate processes
+	@staticmethod
+	def generate_keys(replica_ids):
+		if Ed25519PrivateKey is None:
+			raise RuntimeError("Ed25519_scheme needs the cryptography package")
+		private_keys = {}
+		public_keys = {}
+		for replica_id in replica_ids:
+			key = Ed25519PrivateKey.generate()
+			private_keys[replica_id] = key.private_bytes_raw()
+			public_keys[replica_id] = key.public_key().public_bytes_raw()
+		return public_keys, private_keys
+
+	def sign(self, signer_id, digest):
+		return self.private_keys[signer_id].sign(digest)
+
+	def verify(self, signer_id, digest, share):
+		public_key = self.public_keys.get(signer_id)
+		if public_key is None or not isinstance(share, bytes):
+			return False
+		try:
+			public_key.verify(share, digest)
+			return True
+		except InvalidSignature:
+			return False
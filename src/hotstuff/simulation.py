@@ -0,0 +1,198 @@
+import asyncio
+import random
+import selectors
+from hotstuff.hotstuff_types import *
+from hotstuff.codec import *
+from hotstuff.network import *
+from hotstuff.client import *
+
+# a whole cluster in one process on a virtual clock
+# the loop never sleeps, whenever nothing is ready it jumps straight to the
+# next timer, so pacemaker timeouts, link latency and client timeouts cost
+# no wall-clock time and a run only depends on its seed
+#
+# every packet goes through the codec, replicas never share objects
+
+# hands the loop real IO if there is any, otherwise moves the clock
+class Virtual_selector(selectors.BaseSelector):
+	def __init__(self, loop):
+		self.loop = loop
+		# only the loop's self-pipe ends up in here
+		self.selector = selectors.DefaultSelector()
+
+	def register(self, fileobj, events, data=None):
+		return self.selector.register(fileobj, events, data)
+
+	def unregister(self, fileobj):
+		return self.selector.unregister(fileobj)
+
+	def modify(self, fileobj, events, data=None):
+		return self.selector.modify(fileobj, events, data)
+
+	def get_map(self):
+		return self.selector.get_map()
+
+	def close(self):
+		self.selector.close()
+
+	def select(self, timeout=None):
+		events = self.selector.select(0)
+		if events or timeout == 0:
+			return events
+		if timeout is None:
+			# no timers left, only another thread can wake us up
+			return self.selector.select(None)
+		self.loop.clock += timeout
+		return []
+
+class Simulated_loop(asyncio.SelectorEventLoop):
+	def __init__(self):
+		self.clock = 0.0
+		super().__init__(Virtual_selector(self))
+
+	def time(self):
+		return self.clock
+
+# the wire between simulated replicas and clients
+# latency + uniform(0, jitter) per packet, loss applies to replica to
+# replica traffic, so do partitions (groups of replica ids that can still
+# talk to each other)
+class Simulation:
+	def __init__(self, seed=0, latency=0.001, jitter=0.0, loss=0.0):
+		self.random = random.Random(seed)
+		self.latency = latency
+		self.jitter = jitter
+		self.loss = loss
+		self.partitions = None
+		self.networks = {} # replica_id -> Simulated_network, while serving
+		self.clients = {} # client_id -> Simulated_client
+		self.sent = 0
+		self.bytes_sent = 0
+		self.dropped = 0
+
+	def partition(self, *groups):
+		self.partitions = [set(group) for group in groups]
+
+	def heal(self):
+		self.partitions = None
+
+	def reachable(self, sender_id, recipient_id):
+		if self.partitions is None:
+			return True
+		return any(
+			sender_id in group and recipient_id in group
+			for group in self.partitions
+		)
+
+	def delay(self):
+		if self.jitter:
+			return self.latency + self.random.uniform(0, self.jitter)
+		return self.latency
+
+	def deliver(self, sender_id, recipient_id, packet):
+		self.sent += 1
+		self.bytes_sent += len(packet)
+		network = self.networks.get(recipient_id)
+		if network is None or not self.reachable(sender_id, recipient_id) or \
+			(self.loss and self.random.random() < self.loss):
+			self.dropped += 1
+			return
+		asyncio.get_running_loop().call_later(self.delay(), network.receive, packet)
+
+	def submit(self, recipient_id, packet):
+		network = self.networks.get(recipient_id)
+		if network is not None:
+			asyncio.get_running_loop().call_later(self.delay(), network.receive, packet)
+
+	def reply(self, replica_id, client_id, packet):
+		client = self.clients.get(client_id)
+		if client is not None:
+			asyncio.get_running_loop().call_later(
+				self.delay(), client.receive_packet, replica_id, packet
+			)
+
+	# runs main on a fresh simulated loop, whatever is left running after
+	# it returns is cancelled
+	def run(self, main):
+		loop = Simulated_loop()
+		try:
+			return loop.run_until_complete(main)
+		finally:
+			tasks = asyncio.all_tasks(loop)
+			for task in tasks:
+				task.cancel()
+			if tasks:
+				loop.run_until_complete(
+					asyncio.gather(*tasks, return_exceptions=True)
+				)
+			loop.close()
+
+# same interface as Network, the replica can't tell the difference
+class Simulated_network:
+	def __init__(self, replica_id, simulation, config):
+		self.replica_id = replica_id
+		self.simulation = simulation
+		self.config = config # see Cluster_config.simulated
+		self.inbox = Inbox()
+		self.metrics = Metrics()
+		self.accepting_cmds = asyncio.Event()
+		self.accepting_cmds.set()
+
+	async def start_server(self):
+		self.simulation.networks[self.replica_id] = self
+
+	async def stop_server(self):
+		self.simulation.networks.pop(self.replica_id, None)
+
+	def receive(self, packet):
+		payload = decode(packet)
+		if isinstance(payload, Client_hello):
+			return
+		if isinstance(payload, Command) and not self.accepting_cmds.is_set():
+			asyncio.get_running_loop().create_task(self.admit(payload))
+			return
+		self.inbox.put_nowait(payload)
+
+	async def admit(self, cmd):
+		await self.accepting_cmds.wait()
+		self.inbox.put_nowait(cmd)
+
+	async def send(self, recipient_id, msg):
+		if recipient_id == self.replica_id:
+			await self.inbox.put(msg)
+			return
+		self.deliver(recipient_id, encode(msg))
+
+	def deliver(self, recipient_id, packet):
+		self.metrics.inc("messages_sent")
+		self.metrics.inc("bytes_sent", value=len(packet))
+		self.simulation.deliver(self.replica_id, recipient_id, packet)
+
+	async def broadcast(self, msg):
+		packet = encode(msg)
+		for replica_id in self.config.replica_ids:
+			if replica_id == self.replica_id:
+				self.inbox.put_nowait(msg)
+			else:
+				self.deliver(replica_id, packet)
+
+	async def client_respond(self, reply):
+		self.simulation.reply(self.replica_id, reply.client_id, encode(reply))
+
+	def reconfigure(self, config):
+		self.config = config
+
+class Simulated_client(Client):
+	def __init__(self, client_id, simulation, config, timeout, window=64):
+		super().__init__(client_id, config, timeout, window)
+		self.simulation = simulation
+
+	async def connect(self, replica_id):
+		self.simulation.clients[self.client_id] = self
+		return self.config.is_member(replica_id)
+
+	async def send(self, recipient_id, payload):
+		self.simulation.submit(recipient_id, encode(payload))
+
+	def receive_packet(self, replica_id, packet):
+		self.handle_reply(replica_id, decode(packet))
@@ -0,0 +1,72 @@
+import hashlib
+from hotstuff.hotstuff_types import *
+from hotstuff.codec import *
+
+# what the replicas replicate
+# apply() gets every committed block's commands in order, as one batch
+# digest() is equal on replicas that applied the same commands, query()
+# answers a read-only request from the current state without changing it
+# snapshot()/restore() move the state through the WAL, the snapshot has to
+# be something the codec can write
+# commands and queries come from clients as they are, apply() must treat a
+# malformed command the same way on every replica and query() raises
+# Query_error for one it can't answer
+class State_machine:
+	def apply(self, cmds):
+		raise NotImplementedError
+
+	def query(self, op, args):
+		raise NotImplementedError
+
+	def digest(self):
+		raise NotImplementedError
+
+	def snapshot(self):
+		raise NotImplementedError
+
+	def restore(self, snapshot):
+		raise NotImplementedError
+
+# keys are strings, bytes or integers, values anything the codec can write
+def valid_key(key):
+	return isinstance(key, (str, bytes, int)) and not isinstance(key, bool)
+
+# SET key value, GET key (read-only, a no-op if it gets committed)
+# unknown ops and malformed commands are ignored
+class Key_value_store(State_machine):
+	def __init__(self):
+		self.data = {}
+		self.cached_digest = None
+
+	def apply(self, cmds):
+		for cmd in cmds:
+			if cmd.op == "SET" and isinstance(cmd.args, list) and len(cmd.args) == 2 and \
+				valid_key(cmd.args[0]):
+				self.data[cmd.args[0]] = cmd.args[1]
+		self.cached_digest = None
+
+	def query(self, op, args):
+		if op != "GET":
+			raise Query_error(f"unknown query {op!r}")
+		if not isinstance(args, list) or len(args) != 1 or not valid_key(args[0]):
+			raise Query_error("GET takes one key")
+		return self.data.get(args[0])
+
+	# over the items sorted by key, so insertion order doesn't matter
+	# cached until the next apply, reads ask for it far more often
+	def digest(self):
+		if self.cached_digest is None:
+			w = Writer()
+			write_value(w, [
+				[key, value]
+				for key, value in sorted(self.data.items(), key=lambda item: repr(item[0]))
+			])
+			self.cached_digest = hashlib.sha256(w.getvalue()).hexdigest()
+		return self.cached_digest
+
+	def snapshot(self):
+		return dict(self.data)
+
+	def restore(self, snapshot):
+		self.data = dict(snapshot)
+		self.cached_digest = None
@@ -0,0 +1,296 @@
+import asyncio
+import os
+import struct
+import zlib
+from hotstuff.hotstuff_types import *
+from hotstuff.codec import *
+
+# append-only log of what a replica must not forget across a restart:
+# committed blocks, QC updates and the view it reached
+#
+# record := length(u32) crc32(u32) kind(u8) body
+# appends are buffered and written by one flusher task, every waiter in
+# sync() shares the same fsync (group commit)
+# the log is split into numbered segments, a snapshot starts a new one and
+# records the segment replay starts from, older segments are then deleted
+RECORD_BLOCK = 1
+RECORD_LOCKED_QC = 2
+RECORD_PREPARE_QC = 3
+RECORD_VIEW = 4
+
+RECORD_HEADER = struct.Struct('>II')
+
+LOG_FILE = "wal.%d.log" # % segment
+SNAPSHOT_FILE = "snapshot.bin"
+
+# what open() found on disk
+class Recovered:
+	def __init__(self):
+		self.base_block = GENESIS_BLOCK
+		self.base_height = 0
+		self.state = {}
+		self.blocks = [] # committed after the snapshot, oldest first
+		self.locked_qc = GENESIS_QC
+		self.high_prepare_qc = GENESIS_QC
+		# the uncommitted blocks those QCs are for, if we had them
+		self.locked_block = None
+		self.high_prepare_block = None
+		self.view = 0
+		self.membership = None # Membership.snapshot(), None if it never changed
+		self.segment = 0 # first log segment not covered by the snapshot
+
+class Write_ahead_log:
+	def __init__(self, directory, snapshot_interval=1000, flush_interval=0.002):
+		self.directory = directory
+		self.snapshot_interval = snapshot_interval
+		self.flush_interval = flush_interval
+		self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+		self.segment = 0
+		self.file = None
+		# segments a snapshot moved on from, with the records they still
+		# need, (file, data) oldest first, written before anything newer
+		self.retired = []
+		self.buffer = []
+		self.appended = 0 # records, ever
+		self.synced = 0 # of those, on disk
+		self.waiters = [] # (records, future)
+		self.wakeup = asyncio.Event()
+		# writes and snapshots take turns, so a record is never on disk
+		# before one appended ahead of it
+		self.lock = asyncio.Lock()
+		self.flusher = None
+		self.blocks_since_snapshot = 0
+
+	def segment_path(self, segment):
+		return os.path.join(self.directory, LOG_FILE % segment)
+
+	def segments(self):
+		segments = []
+		for name in os.listdir(self.directory):
+			prefix, _, rest = name.partition(".")
+			number, _, suffix = rest.partition(".")
+			if prefix == "wal" and suffix == "log" and number.isdigit():
+				segments.append(int(number))
+		return sorted(segments)
+
+	# reads the snapshot and replays the segments behind it
+	# a torn record at the end of the log is cut off
+	def open(self):
+		os.makedirs(self.directory, exist_ok=True)
+		recovered = Recovered()
+		if os.path.exists(self.snapshot_path):
+			with open(self.snapshot_path, 'rb') as f:
+				read_snapshot(Reader(f.read()), recovered)
+
+		self.segment = recovered.segment
+		valid_bytes = 0
+		torn = False
+		for segment in self.segments():
+			path = self.segment_path(segment)
+			# covered by the snapshot, or behind a torn record
+			if segment < recovered.segment or torn:
+				os.remove(path)
+				continue
+			with open(path, 'rb') as f:
+				data = f.read()
+			self.segment = segment
+			valid_bytes = replay(data, recovered)
+			torn = valid_bytes < len(data)
+		self.blocks_since_snapshot = len(recovered.blocks)
+
+		self.file = open(self.segment_path(self.segment), 'ab')
+		self.file.truncate(valid_bytes)
+		return recovered
+
+	async def start(self):
+		self.flusher = asyncio.create_task(self.flush_loop())
+
+	async def close(self):
+		await self.sync()
+		if self.flusher is not None:
+			self.flusher.cancel()
+		for retired_file, _ in self.retired:
+			retired_file.close()
+		self.file.close()
+
+	def append(self, kind, body):
+		record = U8.pack(kind) + body
+		self.buffer.append(RECORD_HEADER.pack(len(record), zlib.crc32(record)))
+		self.buffer.append(record)
+		self.appended += 1
+		self.wakeup.set()
+
+	def append_block(self, block):
+		w = Writer()
+		write_block(w, block)
+		self.append(RECORD_BLOCK, w.getvalue())
+		self.blocks_since_snapshot += 1
+
+	# block is the one qc certifies, None if we don't have it
+	def append_qc(self, kind, qc, block=None):
+		w = Writer()
+		write_qc_record(w, qc, block)
+		self.append(kind, w.getvalue())
+
+	def append_view(self, view):
+		self.append(RECORD_VIEW, U64.pack(view))
+
+	def snapshot_due(self):
+		return self.blocks_since_snapshot >= self.snapshot_interval
+
+	# returns once everything appended so far is on disk
+	async def sync(self):
+		if self.synced >= self.appended:
+			return
+		waiter = asyncio.get_running_loop().create_future()
+		self.waiters.append((self.appended, waiter))
+		self.wakeup.set()
+		await waiter
+
+	async def flush_loop(self):
+		while True:
+			await self.wakeup.wait()
+			# let concurrent appends pile up into one write
+			await asyncio.sleep(self.flush_interval)
+			self.wakeup.clear()
+			try:
+				async with self.lock:
+					await self.flush()
+			except Exception:
+				# handed to the waiters
+				continue
+
+	# writes the retired segments' tails, then the buffer, lock held
+	async def flush(self):
+		loop = asyncio.get_running_loop()
+		appended = self.appended
+		data = b''.join(self.buffer)
+		self.buffer = []
+		try:
+			while self.retired:
+				retired_file, retired_data = self.retired[0]
+				await loop.run_in_executor(None, write_file, retired_file, retired_data)
+				retired_file.close()
+				self.retired.pop(0)
+			await loop.run_in_executor(None, write_file, self.file, data)
+		except Exception as e:
+			# still ours to write, ahead of anything appended since
+			self.buffer.insert(0, data)
+			waiters = [waiter for _, waiter in self.waiters]
+			self.waiters = []
+			for waiter in waiters:
+				if not waiter.done():
+					waiter.set_exception(e)
+			raise
+		self.synced = appended
+		waiting = []
+		for records, waiter in self.waiters:
+			if records > self.synced:
+				waiting.append((records, waiter))
+			elif not waiter.done():
+				waiter.set_result(None)
+		self.waiters = waiting
+
+	# writes state as of the committed tip and moves on to a new segment
+	# everything up to the cut below, made before the first await, is in
+	# the snapshot and stays in the old segment, the rest goes to the new
+	# one, sync() doesn't return for a new record before the old segment is
+	# on disk
+	# blocking, but it only happens every snapshot_interval blocks
+	async def snapshot(self, tip, height, state, locked_qc, high_prepare_qc, view,
+	                   membership=None, locked_block=None, high_prepare_block=None):
+		w = Writer()
+		write_block(w, tip)
+		w.u64(height)
+		write_value(w, state)
+		write_qc_record(w, locked_qc, locked_block)
+		write_qc_record(w, high_prepare_qc, high_prepare_block)
+		w.u64(view)
+		write_value(w, membership)
+		segment = self.segment + 1
+		w.u64(segment)
+		data = w.getvalue()
+		self.blocks_since_snapshot = 0
+
+		self.retired.append((self.file, b''.join(self.buffer)))
+		self.buffer = []
+		self.segment = segment
+		self.file = open(self.segment_path(segment), 'ab')
+
+		async with self.lock:
+			await self.flush()
+			await asyncio.get_running_loop().run_in_executor(
+				None, self.write_snapshot, data
+			)
+		for old in self.segments():
+			if old < segment:
+				os.remove(self.segment_path(old))
+
+	def write_snapshot(self, data):
+		tmp_path = self.snapshot_path + ".tmp"
+		with open(tmp_path, 'wb') as f:
+			f.write(RECORD_HEADER.pack(len(data), zlib.crc32(data)))
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, self.snapshot_path)
+
+# a QC and, if there is one, the block it certifies
+def write_qc_record(w, qc, block):
+	write_qc(w, qc)
+	if block is None:
+		w.u8(0)
+	else:
+		w.u8(1)
+		write_block(w, block)
+
+def read_qc_record(r):
+	qc = read_qc(r)
+	block = read_block(r) if r.u8() else None
+	return qc, block
+
+def write_file(file, data):
+	if data:
+		file.write(data)
+		file.flush()
+	os.fsync(file.fileno())
+
+def read_snapshot(r, recovered):
+	length, crc = RECORD_HEADER.unpack(r.take(RECORD_HEADER.size))
+	data = bytes(r.take(length))
+	if zlib.crc32(data) != crc:
+		raise Codec_error("corrupt snapshot")
+	r = Reader(data)
+	recovered.base_block = read_block(r)
+	recovered.base_height = r.u64()
+	recovered.state = read_value(r)
+	recovered.locked_qc, recovered.locked_block = read_qc_record(r)
+	recovered.high_prepare_qc, recovered.high_prepare_block = read_qc_record(r)
+	recovered.view = r.u64()
+	# older snapshots end early
+	if r.pos < len(r.data):
+		recovered.membership = read_value(r)
+	if r.pos < len(r.data):
+		recovered.segment = r.u64()
+
+# applies records in order, returns how many bytes of data were valid
+def replay(data, recovered):
+	pos = 0
+	while pos + RECORD_HEADER.size <= len(data):
+		length, crc = RECORD_HEADER.unpack_from(data, pos)
+		start = pos + RECORD_HEADER.size
+		record = data[start:start + length]
+		if len(record) < length or zlib.crc32(record) != crc:
+			break
+		r = Reader(record)
+		kind = r.u8()
+		if kind == RECORD_BLOCK:
+			recovered.blocks.append(read_block(r))
+		elif kind == RECORD_LOCKED_QC:
+			recovered.locked_qc, recovered.locked_block = read_qc_record(r)
+		elif kind == RECORD_PREPARE_QC:
+			recovered.high_prepare_qc, recovered.high_prepare_block = read_qc_record(r)
+		elif kind == RECORD_VIEW:
+			recovered.view = r.u64()
+		pos = start + length
+	return pos
@@ -0,0 +1,33 @@
+from hotstuff.hotstuff_types import *
+
+# a leader's votes, per (view, phase, block hash)
+# each signer counts once, its share goes straight into the Signature and
+# add() hands that Signature back exactly once, with the vote that makes the
+# quorum; votes that come after it are ignored
+# prune(view) forgets everything older than view
+class Vote_collector:
+	def __init__(self, make_signature):
+		# make_signature(view), the quorum is the Signature's threshold
+		self.make_signature = make_signature
+		self.views = {} # view -> {(phase, block hash): Signature, None once done}
+
+	def __len__(self):
+		return sum(len(tallies) for tallies in self.views.values())
+
+	def add(self, view, phase, block_hash, partial_sig):
+		tallies = self.views.setdefault(view, {})
+		key = (phase, block_hash)
+		if key not in tallies:
+			tallies[key] = self.make_signature(view)
+		sig = tallies[key]
+		if sig is None or partial_sig[0] in sig.combined:
+			return None
+		sig.combine(partial_sig)
+		if len(sig.combined) < sig.threshold:
+			return None
+		tallies[key] = None
+		return sig
+
+	def prune(self, view):
+		for old in [old for old in self.views if old < view]:
+			del self.views[old]
@@ -0,0 +1,177 @@
+import struct
+
+# the byte encoding under the codec, kept apart so hotstuff_types can hash
+# the same canonical bytes the codec sends
+# plain values (command arguments, client ids, signature shares) are tagged,
+# everything else is written field by field by whoever owns it
+HASH_SIZE = 32
+MAX_DEPTH = 16
+
+# value tags for command arguments
+TAG_NONE = 0
+TAG_FALSE = 1
+TAG_TRUE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_BYTES = 6
+TAG_LIST = 7
+TAG_DICT = 8
+
+U8 = struct.Struct('>B')
+U32 = struct.Struct('>I')
+I64 = struct.Struct('>q')
+U64 = struct.Struct('>Q')
+F64 = struct.Struct('>d')
+
+class Codec_error(ValueError):
+	pass
+
+class Writer:
+	def __init__(self):
+		self.parts = []
+
+	def u8(self, value):
+		self.parts.append(U8.pack(value))
+
+	def u32(self, value):
+		self.parts.append(U32.pack(value))
+
+	def u64(self, value):
+		self.parts.append(U64.pack(value))
+
+	def raw(self, data):
+		self.parts.append(data)
+
+	def blob(self, data):
+		self.u32(len(data))
+		self.parts.append(data)
+
+	def text(self, string):
+		self.blob(string.encode())
+
+	def digest(self, hex_hash):
+		self.raw(bytes.fromhex(hex_hash))
+
+	def getvalue(self):
+		return b''.join(self.parts)
+
+class Reader:
+	def __init__(self, data):
+		self.data = memoryview(data)
+		self.pos = 0
+
+	def take(self, count):
+		end = self.pos + count
+		if end > len(self.data):
+			raise Codec_error("truncated packet")
+		chunk = self.data[self.pos:end]
+		self.pos = end
+		return chunk
+
+	# straight out of the buffer, no slice per field
+	def unpack(self, fmt):
+		try:
+			value = fmt.unpack_from(self.data, self.pos)[0]
+		except struct.error:
+			raise Codec_error("truncated packet")
+		self.pos += fmt.size
+		return value
+
+	def u8(self):
+		try:
+			value = self.data[self.pos]
+		except IndexError:
+			raise Codec_error("truncated packet")
+		self.pos += 1
+		return value
+
+	def u32(self):
+		return self.unpack(U32)
+
+	def u64(self):
+		return self.unpack(U64)
+
+	def blob(self):
+		return bytes(self.take(self.u32()))
+
+	def text(self):
+		try:
+			return str(self.take(self.u32()), "utf-8")
+		except UnicodeDecodeError as e:
+			raise Codec_error(f"bad string: {e}")
+
+	def digest(self):
+		return self.take(HASH_SIZE).hex()
+
+	def done(self):
+		if self.pos != len(self.data):
+			raise Codec_error("trailing bytes in packet")
+
+def write_value(w, value, depth=0):
+	if depth > MAX_DEPTH:
+		raise Codec_error("value nested too deep")
+	if value is None:
+		w.u8(TAG_NONE)
+	elif value is False:
+		w.u8(TAG_FALSE)
+	elif value is True:
+		w.u8(TAG_TRUE)
+	elif isinstance(value, int):
+		w.u8(TAG_INT)
+		w.raw(I64.pack(value))
+	elif isinstance(value, float):
+		w.u8(TAG_FLOAT)
+		w.raw(F64.pack(value))
+	elif isinstance(value, str):
+		w.u8(TAG_STR)
+		w.text(value)
+	elif isinstance(value, bytes):
+		w.u8(TAG_BYTES)
+		w.blob(value)
+	elif isinstance(value, (list, tuple)):
+		w.u8(TAG_LIST)
+		w.u32(len(value))
+		for item in value:
+			write_value(w, item, depth + 1)
+	elif isinstance(value, dict):
+		w.u8(TAG_DICT)
+		w.u32(len(value))
+		for key, item in value.items():
+			write_value(w, key, depth + 1)
+			write_value(w, item, depth + 1)
+	else:
+		raise Codec_error(f"can't encode {type(value).__name__}")
+
+def read_value(r, depth=0):
+	if depth > MAX_DEPTH:
+		raise Codec_error("value nested too deep")
+	tag = r.u8()
+	match tag:
+		case 0:
+			return None
+		case 1:
+			return False
+		case 2:
+			return True
+		case 3:
+			return r.unpack(I64)
+		case 4:
+			return r.unpack(F64)
+		case 5:
+			return r.text()
+		case 6:
+			return r.blob()
+		case 7:
+			return [read_value(r, depth + 1) for _ in range(r.u32())]
+		case 8:
+			result = {}
+			for _ in range(r.u32()):
+				key = read_value(r, depth + 1)
+				try:
+					result[key] = read_value(r, depth + 1)
+				except TypeError:
+					raise Codec_error("unhashable dict key")
+			return result
+	raise Codec_error(f"unknown value tag {tag}")
+
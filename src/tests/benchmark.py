@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+from hotstuff.hotstuff_types import *
+from hotstuff.replica import *
+from hotstuff.byzantine import *
+from hotstuff.election import *
+from hotstuff.simulation import *
+
+# sweeps cluster size, batch size, client window, fault type and leader
+# election on the simulated network and prints one JSON object per run
+#
+#   python -m tests.benchmark --n 4 16 --batch 10 100 --window 16 64 \
+#       --faults HONEST CRASH --election round_robin reputation \
+#       --duration 10 > results.jsonl
+#
+# the first F replicas get the fault, the client starts once replicas are
+# up (warmup) and runs for duration
+# rates and latencies are in virtual seconds, CPU is real process time spent
+# handling each replica's messages
+
+class Simulated_delayed_network(Delayed_sends, Simulated_network):
+	pass
+
+class Simulated_malicious_network(Malicious_broadcasts, Simulated_network):
+	pass
+
+def percentile(values, q):
+	if not values:
+		return None
+	values = sorted(values)
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+def make_replica(replica_id, fault, simulation, config, election, options):
+	kwargs = {
+		"election": make_election(election, config.replica_ids, config.chained),
+	}
+	if fault == Fault_types.CRASH:
+		network = Simulated_network(replica_id, simulation, config)
+		return Crash_replica(replica_id, network, options.crash_view, **kwargs)
+	if fault == Fault_types.DELAYED:
+		network = Simulated_delayed_network(replica_id, simulation, config)
+		return Delayed_replica(replica_id, network, **kwargs)
+	if fault == Fault_types.MALICIOUS:
+		network = Simulated_malicious_network(replica_id, simulation, config)
+		return Malicious_replica(replica_id, network, **kwargs)
+	network = Simulated_network(replica_id, simulation, config)
+	return Replica(replica_id, network, **kwargs)
+
+# charges the CPU time of every message a replica handles to that replica
+def time_dispatch(replica, cpu):
+	dispatch = replica.dispatch
+	async def timed(payload):
+		started = time.process_time()
+		try:
+			await dispatch(payload)
+		finally:
+			cpu[replica.replica_id] += time.process_time() - started
+	replica.dispatch = timed
+
+async def scenario(simulation, replicas, client, warmup, duration):
+	tasks = [asyncio.ensure_future(replica.run()) for replica in replicas]
+	await asyncio.sleep(warmup)
+	tasks.append(asyncio.ensure_future(client.run()))
+	await asyncio.sleep(duration)
+	for replica in replicas:
+		replica.running = False
+	for task in tasks:
+		task.cancel()
+
+def run(n, batch, window, fault, election, options):
+	random.seed(options.seed)
+	simulation = Simulation(options.seed, options.latency, options.jitter, options.loss)
+	replica_ids = list(range(n))
+	config = Cluster_config.simulated(replica_ids, max_batch_size=batch, chained=options.chained)
+	faulty = set(replica_ids[:(n - 1) // 3]) if fault != Fault_types.HONEST else set()
+	replicas = [
+		make_replica(
+			replica_id,
+			fault if replica_id in faulty else Fault_types.HONEST,
+			simulation, config, election, options
+		)
+		for replica_id in replica_ids
+	]
+	cpu = {replica_id: 0.0 for replica_id in replica_ids}
+	for replica in replicas:
+		time_dispatch(replica, cpu)
+	client = Simulated_client(0, simulation, config, options.client_timeout, window)
+
+	started = time.perf_counter()
+	cpu_started = time.process_time()
+	simulation.run(scenario(
+		simulation, replicas, client, options.warmup, options.duration
+	))
+	wall = time.perf_counter() - started
+	cpu_total = time.process_time() - cpu_started
+
+	honest = [replica for replica in replicas if replica.replica_id not in faulty]
+	longest = max(honest, key=lambda replica: len(replica.log))
+	blocks = len(longest.log) - 1
+	cmds = sum(len(block.cmds) for block in longest.log)
+	honest_cpu = [cpu[replica.replica_id] for replica in honest]
+	counters = [replica.metrics.counters for replica in honest]
+	return {
+		"n": n,
+		"batch": batch,
+		"window": window,
+		"fault": fault.name,
+		"election": election,
+		"faulty": len(faulty),
+		"chained": options.chained,
+		"seed": options.seed,
+		"duration": options.duration,
+		"committed_blocks": blocks,
+		"committed_cmds": cmds,
+		"cmds_per_sec": cmds / options.duration,
+		"client_completed": client.completed,
+		"views": max(counter.get("views_entered", 0) for counter in counters),
+		"timeouts": max(counter.get("timeouts", 0) for counter in counters),
+		"latency_p50": percentile(client.latencies, 0.50),
+		"latency_p99": percentile(client.latencies, 0.99),
+		"msgs_per_commit": simulation.sent / blocks if blocks else None,
+		"bytes_per_commit": simulation.bytes_sent / blocks if blocks else None,
+		"cpu_per_replica": sum(honest_cpu) / len(honest_cpu),
+		"cpu_per_replica_max": max(honest_cpu),
+		"cpu_total": cpu_total,
+		"wall_seconds": wall,
+	}
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--n", type=int, nargs="+", default=[4, 7, 16])
+	parser.add_argument("--batch", type=int, nargs="+", default=[100])
+	parser.add_argument("--window", type=int, nargs="+", default=[64])
+	parser.add_argument("--faults", nargs="+", default=["HONEST", "CRASH"],
+	                    choices=[fault.name for fault in Fault_types])
+	parser.add_argument("--election", nargs="+", default=["round_robin"],
+	                    choices=list(ELECTIONS))
+	parser.add_argument("--chained", action="store_true")
+	parser.add_argument("--duration", type=float, default=5.0,
+	                    help="virtual seconds per run")
+	parser.add_argument("--warmup", type=float, default=1.0,
+	                    help="virtual seconds before the client starts")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--latency", type=float, default=0.002)
+	parser.add_argument("--jitter", type=float, default=0.002)
+	parser.add_argument("--loss", type=float, default=0.0)
+	parser.add_argument("--crash-view", type=int, default=10)
+	parser.add_argument("--client-timeout", type=float, default=1.0)
+	return parser.parse_args(argv)
+
+def main(argv):
+	options = parse_args(argv)
+	logging.basicConfig(level=logging.ERROR)
+	for n, batch, window, fault, election in itertools.product(
+		options.n, options.batch, options.window, options.faults, options.election
+	):
+		result = run(n, batch, window, Fault_types[fault], election, options)
+		print(json.dumps(result), flush=True)
+
+if __name__ == "__main__":
+	main(sys.argv[1:])
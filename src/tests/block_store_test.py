@@ -0,0 +1,71 @@
+import random
+from hotstuff.hotstuff_types import *
+from hotstuff.block_store import *
+from tests.helpers import *
+
+def make_chain(store, length):
+	chain = [GENESIS_BLOCK] + make_blocks(length)
+	for block in chain[1:]:
+		assert store.add(block) is block
+	return chain
+
+def test_ancestor_matches_chain():
+	store = Block_store()
+	chain = make_chain(store, 300)
+	rng = random.Random(0)
+	for _ in range(2000):
+		high = rng.randrange(len(chain))
+		low = rng.randrange(high + 1)
+		assert store.ancestor(chain[high], low) is chain[low]
+	assert store.extends(chain[250], chain[3])
+	assert not store.extends(chain[3], chain[250])
+
+def test_commit_prunes_forks():
+	store = Block_store()
+	chain = make_chain(store, 200)
+	fork = store.add(Block([], chain[100].hash, 999))
+	assert store.extends(fork, chain[100]) and not store.extends(fork, chain[101])
+
+	committed = store.commit(chain[120])
+	assert committed == chain[1:121]
+	assert store.committed_height == 120 and store.tip is chain[120]
+	assert fork.hash not in store
+	# ancestry below the committed height still resolves
+	assert store.ancestor(chain[199], 7) is chain[7]
+	# nothing new to commit, and no new blocks under the committed tip
+	assert store.commit(chain[110]) == []
+	assert store.add(Block([], chain[50].hash, 1000)) is None
+
+def test_unknown_parent():
+	store = Block_store()
+	orphan = Block([], "ab" * 32, 1)
+	assert store.add(orphan) is None
+	assert not store.extends(orphan, GENESIS_BLOCK)
+
+def test_proven_height():
+	store = Block_store()
+	chain = make_chain(store, 30)
+	for height in (10, 20):
+		qc = QC(Protocol_phase.COMMIT, height, chain[height].hash, GENESIS_SIG)
+		store.commit(chain[height], [qc])
+	assert store.proven_height(5, 15) == 10
+	assert store.proven_height(19, 5) == 10
+	assert store.proven_height(11, 19) is None
+	assert store.proven_height(21, 30) is None
+
+# only the last keep committed blocks and their proofs stay
+def test_trim_keeps_history():
+	store = Block_store(keep=10)
+	chain = make_chain(store, 100)
+	for height in range(1, 90):
+		qc = QC(Protocol_phase.COMMIT, height, chain[height].hash, GENESIS_SIG)
+		store.commit(chain[height], [qc])
+		assert len(store.committed) <= 21
+	assert store.committed_height == 89 and store.tip is chain[89]
+	assert store.base_height > 60 and store.committed_at(store.base_height) is chain[store.base_height]
+	assert chain[5].hash not in store and store.committed_at(5) is None
+	assert min(store.proofs) >= store.base_height
+	assert store.ancestor(chain[99], store.base_height) is chain[store.base_height]
+	assert store.ancestor(chain[99], 5) is None
+	assert store.extends(chain[99], chain[89])
+	assert store.commit(chain[99]) == chain[90:100]
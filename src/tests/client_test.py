@@ -0,0 +1,46 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.client import *
+from hotstuff.cluster_config import *
+
+def make_client():
+	config = Cluster_config({i: ('127.0.0.1', 50000 + i) for i in range(4)}, Hmac_scheme.generate())
+	client = Client(0, config, 1.0, 2)
+	cmd = Command("SET", ["A", 10], 0, 7)
+	future = asyncio.get_running_loop().create_future()
+	client.pending[cmd.request_id] = Pending_request(cmd, future)
+	return client, cmd, future
+
+def test_needs_f_plus_one_matching():
+	async def run():
+		client, cmd, future = make_client()
+		forged = Command("SET", ["A", 99], 0, 7)
+		client.on_reply(0, cmd)
+		client.on_reply(0, cmd)
+		client.on_reply(1, forged)
+		assert not future.done()
+		client.on_reply(2, cmd)
+		assert future.result().hash == cmd.hash
+		assert cmd.request_id not in client.pending and client.completed == 1
+	asyncio.run(run())
+
+def test_ignores_unknown_replies():
+	async def run():
+		client, cmd, future = make_client()
+		for replica_id in range(client.config.f + 1):
+			client.on_reply(replica_id, Command("SET", ["A", 10], 0, 8))
+			client.on_reply(replica_id, Command("SET", ["A", 10], 1, 7))
+		assert not future.done() and client.completed == 0
+	asyncio.run(run())
+
+def test_suspect_moves_on_once():
+	async def run():
+		client, _, _ = make_client()
+		assert client.leader == 0
+		client.suspect(0)
+		client.suspect(0)
+		assert client.leader == 1
+		for replica_id in [1, 2, 3]:
+			client.suspect(replica_id)
+		assert client.leader == 0
+	asyncio.run(run())
@@ -0,0 +1,61 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.cluster_config import *
+from hotstuff.replica import *
+from hotstuff.simulation import *
+from tests.helpers import *
+
+def test_sizes():
+	config = Cluster_config.simulated(range(7))
+	assert (config.n, config.f, config.quorum) == (7, 2, 5)
+	assert config.replica_ids == (0, 1, 2, 3, 4, 5, 6)
+	assert config.is_member(6) and not config.is_member(7)
+	assert config.signature().threshold == config.quorum
+
+# any two quorums overlap in more than f replicas, so in an honest one
+def test_quorums_intersect():
+	for n in range(1, 50):
+		config = Cluster_config.simulated(range(n))
+		assert 3 * config.f < n
+		assert 2 * config.quorum - n > config.f
+		assert config.quorum <= n - config.f
+		assert config.signature().threshold == config.quorum
+
+def test_immutable():
+	addresses = {0: ('127.0.0.1', 50000)}
+	config = Cluster_config(addresses, Hmac_scheme.generate())
+	for change in (
+		lambda: setattr(config, "n", 5),
+		lambda: config.replica_addresses.__setitem__(1, None),
+	):
+		try:
+			change()
+			assert False
+		except (AttributeError, TypeError):
+			pass
+	# the caller's dict isn't shared either
+	addresses[1] = ('127.0.0.1', 50001)
+	assert config.n == 1
+
+def test_replace():
+	config = Cluster_config.simulated(range(4), max_batch_size=10, admins=[0])
+	bigger = config.replace({replica_id: None for replica_id in range(7)})
+	assert bigger.n == 7 and bigger.max_batch_size == 10 and bigger.admins == {0}
+	assert config.n == 4 and config.replace(chained=True).replica_ids == config.replica_ids
+
+# two clusters of different sizes in one process, each with its own quorum
+def test_two_clusters_in_one_process():
+	simulation = Simulation(seed=2, latency=0.002)
+	clusters = [make_cluster(simulation, n, first) for n, first in ((4, 0), (7, 10))]
+	async def main():
+		tasks = []
+		for replicas, client in clusters:
+			tasks += start(replicas, client)
+		await asyncio.sleep(5.0)
+		cancel(tasks)
+	simulation.run(main())
+	for replicas, client in clusters:
+		assert client.completed > 0
+		assert all(len(replica.log) > 1 for replica in replicas)
+	# the smaller cluster's votes never counted towards the bigger one's QCs
+	assert clusters[1][0][0].config.quorum == 5
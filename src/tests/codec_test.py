@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import pickle
+import timeit
+from hotstuff.hotstuff_types import *
+from hotstuff.codec import *
+from hotstuff.signatures import *
+
+SCHEME = Hmac_scheme.generate()
+
+def make_chain(length, cmds_per_block=1):
+	block = GENESIS_BLOCK
+	qc = GENESIS_QC
+	for view in range(1, length + 1):
+		cmds = [Command("SET", [f"K{i}", view], 0) for i in range(cmds_per_block)]
+		block = Block(cmds, block.hash, view)
+		# chained replicas keep the justify on every block they store
+		block.justify = qc
+		sig = Signature(4, 1)
+		digest = vote_digest(view, Protocol_phase.GENERIC_VOTE, block.hash)
+		for signer_id in range(3):
+			sig.combine((signer_id, SCHEME.sign(signer_id, digest)))
+		qc = QC(Protocol_phase.GENERIC, view, block.hash, sig)
+	return block, qc
+
+def make_message(length):
+	block, qc = make_chain(length)
+	return Message(Protocol_phase.GENERIC_VOTE, length, block, qc, [3, b"\xab" * 32], 3)
+
+def same_block(a, b):
+	return a.hash == b.hash and a.view == b.view and \
+		a.parent_hash == b.parent_hash and \
+		[cmd.hash for cmd in a.cmds] == [cmd.hash for cmd in b.cmds]
+
+def test_command_round_trip():
+	cmd = Command("SET", ["A", 10, -3, 1.5, None, True, b"\x00", {"k": [1]}], 7)
+	decoded = decode(encode(cmd))
+	assert isinstance(decoded, Command)
+	assert decoded.op == cmd.op and decoded.args == cmd.args
+	assert decoded.client_id == cmd.client_id and decoded.hash == cmd.hash
+
+def test_message_round_trip():
+	msg = make_message(5)
+	decoded = decode(encode(msg))
+	assert decoded.phase == msg.phase and decoded.view_number == msg.view_number
+	assert decoded.partial_sig == msg.partial_sig and decoded.sender == msg.sender
+	assert same_block(decoded.block, msg.block)
+	assert decoded.justify.block_hash == msg.justify.block_hash
+	assert decoded.justify.phase == msg.justify.phase
+	assert decoded.justify.view_number == msg.justify.view_number
+	assert decoded.justify.signature.combined == msg.justify.signature.combined
+	assert decoded.justify.signature.verify(SCHEME, msg.justify.digest(), 3)
+
+def test_optional_fields():
+	msg = Message(Protocol_phase.NEW_VIEW, 3, None, GENESIS_QC)
+	decoded = decode(encode(msg))
+	assert decoded.block is None and decoded.partial_sig is None
+	assert decoded.sender is None
+	assert decoded.justify.block_hash == GENESIS_BLOCK.hash
+
+def test_size_independent_of_chain():
+	assert len(encode(make_message(2))) == len(encode(make_message(200)))
+
+# votes and QCs name their block by hash, however many commands it has
+def test_votes_and_qcs_by_hash():
+	sizes = set()
+	for cmds_per_block in (1, 100):
+		block, qc = make_chain(3, cmds_per_block)
+		vote = Message(Protocol_phase.GENERIC_VOTE, 3, None, None, [3, b"\xab" * 32], 3)
+		vote.block_hash = block.hash
+		decoded = decode(encode(vote))
+		assert decoded.block is None and decoded.block_hash == block.hash
+		new_view = Message(Protocol_phase.NEW_VIEW, 4, None, qc, sender=3)
+		sizes.add((len(encode(vote)), len(encode(new_view))))
+	assert len(sizes) == 1
+
+def test_rejects_garbage():
+	packet = encode(make_message(3))
+	bad_packets = [
+		b"",
+		bytes([CODEC_VERSION + 1]) + packet[1:],
+		packet[:-1],
+		packet + b"\x00",
+		bytes([CODEC_VERSION, 99]),
+		pickle.dumps(make_message(1)),
+	]
+	for bad in bad_packets:
+		try:
+			decode(bad)
+		except Codec_error:
+			continue
+		assert False, f"decoded {bad[:16]}"
+
+def test_hash_recomputed():
+	msg = make_message(1)
+	msg.block.cached_hash = "00" * 32
+	assert decode(encode(msg)).block.hash != msg.block.hash
+
+def test_canonical_hashes():
+	cmd = Command("SET", ["A", 1], 0, 1)
+	assert cmd.hash != Command("SET", ["A", "1"], 0, 1).hash
+	# taken from the received bytes, same as hashing the canonical encoding
+	assert decode(encode(cmd)).hash == cmd.calculate_hash()
+	block = decode(encode(make_message(3))).block
+	assert block.cached_hash is None
+	assert block.hash == block.compute_hash() and block.cached_hash is not None
+	assert not hasattr(block, "__dict__") and not hasattr(cmd, "__dict__")
+
+def test_merkle_root():
+	digests = [hashlib.sha256(bytes([i])).digest() for i in range(5)]
+	roots = {merkle_root(digests[:count]) for count in range(6)}
+	assert len(roots) == 6
+	assert merkle_root(digests) != merkle_root(digests[1:] + digests[:1])
+
+def test_query_roundtrip():
+	query = decode(encode(Query("GET", ["A"], 3, 9)))
+	assert (query.op, query.args, query.client_id, query.request_id) == ("GET", ["A"], 3, 9)
+	reply = decode(encode(Query_reply(3, 9, 120, {"x": [1, None]})))
+	assert (reply.client_id, reply.request_id, reply.height, reply.result) == \
+		(3, 9, 120, {"x": [1, None]})
+	assert reply.error is None
+	refused = decode(encode(Query_reply(3, 9, 120, None, "GET takes one key")))
+	assert refused.result is None and refused.error == "GET takes one key"
+
+def test_frame_reader():
+	async def run():
+		reader = asyncio.StreamReader()
+		frames = Frame_reader(reader)
+		cmds = [Command("SET", ["A", i], 0, i) for i in range(3)]
+		data = b"".join(frame(encode(cmd)) for cmd in cmds)
+		# two and a half frames in one read, the rest in the next
+		split = len(data) - 5
+		reader.feed_data(data[:split])
+		assert [cmd.hash for cmd in await frames.read()] == [cmd.hash for cmd in cmds[:2]]
+		reader.feed_data(data[split:])
+		assert [cmd.hash for cmd in await frames.read()] == [cmds[2].hash]
+		assert not frames.buffer
+		reader.feed_eof()
+		try:
+			await frames.read()
+			assert False, "read past EOF"
+		except asyncio.IncompleteReadError:
+			pass
+	asyncio.run(run())
+
+def test_frame_reader_rejects_huge_frames():
+	async def run():
+		reader = asyncio.StreamReader()
+		reader.feed_data((MAX_FRAME + 1).to_bytes(4, 'big'))
+		try:
+			await Frame_reader(reader).read()
+			assert False, "took an oversized frame"
+		except Codec_error:
+			pass
+	asyncio.run(run())
+
+def compare_with_pickle():
+	print(f"{'chain':>6} {'pickle B':>10} {'codec B':>10} {'pickle us':>10} {'codec us':>10}")
+	for length in [1, 10, 50, 100]:
+		msg = make_message(length)
+		pickled = pickle.dumps(msg)
+		encoded = encode(msg)
+		runs = 200
+		pickle_time = timeit.timeit(
+			lambda: pickle.loads(pickle.dumps(msg)), number=runs) / runs
+		codec_time = timeit.timeit(
+			lambda: decode(encode(msg)), number=runs) / runs
+		print(f"{length:>6} {len(pickled):>10} {len(encoded):>10} "
+		      f"{pickle_time * 1e6:>10.1f} {codec_time * 1e6:>10.1f}")
+
+if __name__ == "__main__":
+	compare_with_pickle()
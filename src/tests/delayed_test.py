@@ -2,8 +2,10 @@ import asyncio
 from hotstuff.hotstuff_types import *
 from hotstuff.network import *
 from hotstuff.replica import *
+from hotstuff.metrics import *
 from hotstuff.byzantine import *
 from hotstuff.client import *
+from hotstuff.cluster_config import *
 
 N = 4
 
@@ -20,18 +22,18 @@ async def main():
 		2: Fault_types.HONEST,
 		3: Fault_types.HONEST
 	}
+	config = Cluster_config(replica_addresses, Hmac_scheme.generate())
 	replicas = []
 	for i in range(N):
-		address, port = replica_addresses[i]
 		if replica_types[i] == Fault_types.HONEST:
-			network = Network(i, replica_addresses, address, port)
+			network = Network(i, config)
 			replica = Replica(i, network)
 		elif replica_types[i] == Fault_types.DELAYED:
-			network = Delayed_network(i, replica_addresses, address, port)
+			network = Delayed_network(i, config)
 			replica = Delayed_replica(i, network)
 		replicas.append(replica)
 	
-	client = Client(0, replica_addresses, 3.0) 
+	client = Client(0, config, 3.0) 
 	tasks = [replica.run() for replica in replicas]
 	tasks.append(client.run())
 	try:
@@ -50,6 +52,8 @@ async def main():
 			      f"locked view={replica.locked_qc.view_number}")
 			print(f"STATE: {replica.state}")
 			await replica.network.stop_server()
+		print(f"Client: {client.completed} commands completed")
 
 if __name__ == "__main__":
+	setup_logging()
 	asyncio.run(main())
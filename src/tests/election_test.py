@@ -0,0 +1,113 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.replica import *
+from hotstuff.byzantine import *
+from hotstuff.election import *
+from hotstuff.simulation import *
+from tests.helpers import *
+
+IDS = [0, 1, 2, 3]
+
+# views whose leader is crashed fail, every other view commits its block
+# right away, returns the leader of every view and the committed views
+def drive(election, views, crashed=()):
+	leaders = []
+	committed = []
+	for view in range(1, views + 1):
+		leader = election.leader(view)
+		leaders.append(leader)
+		if leader not in crashed:
+			election.committed(Block([], None, view))
+			committed.append(view)
+	return leaders, committed
+
+def test_round_robin():
+	election = Round_robin(IDS)
+	assert [election.leader(view) for view in range(8)] == [0, 1, 2, 3, 0, 1, 2, 3]
+
+def test_sticky_keeps_productive_leader():
+	election = Sticky_leader(IDS, lag=2, window=16)
+	leaders, committed = drive(election, 15)
+	assert len(committed) == 15 and set(leaders) == {0}
+	# handed on at the next window
+	assert election.leader(16) == 1
+
+def test_sticky_moves_past_crashed_leader():
+	election = Sticky_leader(IDS, lag=2, window=16)
+	leaders, committed = drive(election, 15, crashed={0})
+	# views 1..3 fail before the leader is given up on
+	assert committed == list(range(4, 16)) and leaders[3:] == [1] * 12
+
+def test_reputation_skips_failed_leader():
+	election = Reputation_election(IDS, lag=2, window=16)
+	leaders, committed = drive(election, 200, crashed={0})
+	_, round_robin_committed = drive(Round_robin(IDS), 200, crashed={0})
+	assert 200 - len(committed) < (200 - len(round_robin_committed)) / 4
+	# back in once its failures leave the window
+	assert 0 in leaders[100:]
+
+def test_reputation_leaves_out_at_most_f():
+	election = Reputation_election(IDS, lag=2, window=16)
+	leaders, _ = drive(election, 100, crashed={0, 1})
+	assert set(leaders[50:]) == set(IDS)
+
+# a replica that learns about commits late ends up with the same leaders
+def test_same_leaders_from_same_history():
+	for election_type in (Sticky_leader, Reputation_election):
+		ahead = election_type(IDS, lag=2, window=16)
+		leaders, committed = drive(ahead, 150, crashed={2})
+		behind = election_type(IDS, lag=2, window=16)
+		# asks for leaders with nothing committed, guesses are dropped later
+		behind.leader(40)
+		for view in committed:
+			behind.committed(Block([], None, view))
+		assert [behind.leader(view) for view in range(1, 151)] == leaders
+
+def test_reconfigure():
+	for election_type in (Round_robin, Sticky_leader, Reputation_election):
+		election = election_type(IDS, lag=2, window=16)
+		drive(election, 20)
+		election.reconfigure(30, [1, 2, 3, 4])
+		leaders, _ = drive(election, 60)
+		assert 4 not in leaders[:29] and set(leaders[29:]) <= {1, 2, 3, 4}
+		assert 0 not in leaders[29:]
+
+# the first leader of an epoch comes from the membership of that epoch
+def test_sticky_epoch_after_reconfigure():
+	election = Sticky_leader(list(range(7)), lag=2, window=16)
+	drive(election, 20)
+	election.reconfigure(30, [0, 1, 2, 3])
+	leaders, _ = drive(election, 100)
+	assert set(leaders[29:]) <= {0, 1, 2, 3}
+	assert election.leader(96) == 96 // 16 % 4
+	election.reconfigure(110, [1, 2, 3])
+	assert election.leader(112) == [1, 2, 3][112 // 16 % 3]
+	assert election.leader(256) != 0
+
+def test_far_view_not_remembered():
+	election = Reputation_election(IDS)
+	election.leader(10 ** 9)
+	assert not election.guesses and election.settled_upto == 0
+
+def test_crash_cluster_with_reputation():
+	simulation = Simulation(seed=5, latency=0.002, jitter=0.002)
+	config = Cluster_config.simulated(IDS)
+	replicas = []
+	for replica_id in IDS:
+		network = Simulated_network(replica_id, simulation, config)
+		election = Reputation_election(IDS)
+		if replica_id == 0:
+			replicas.append(Crash_replica(replica_id, network, 4, election=election))
+		else:
+			replicas.append(Replica(replica_id, network, election=election))
+	client = Simulated_client(0, simulation, config, 1.0, 16)
+	async def main():
+		tasks = start(replicas, client)
+		await asyncio.sleep(20.0)
+		cancel(tasks)
+	simulation.run(main())
+	honest = replicas[1:]
+	chains = [[block.hash for block in replica.log] for replica in honest]
+	common = min(len(chain) for chain in chains)
+	assert common > 10
+	assert all(chain[:common] == chains[0][:common] for chain in chains)
@@ -0,0 +1,49 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.replica import *
+from hotstuff.simulation import *
+
+# what more than one test file builds
+
+# count blocks of one SET each, chained on parent
+def make_blocks(count, parent=GENESIS_BLOCK):
+	blocks = []
+	for view in range(parent.view + 1, parent.view + count + 1):
+		parent = Block([Command("SET", [f"K{view % 7}", view], 0)], parent.hash, view)
+		blocks.append(parent)
+	return blocks
+
+# replicas first .. first + n - 1 on the simulated network and a client
+# with the first id, options go to the Cluster_config
+def make_cluster(simulation, n, first=0, **options):
+	config = Cluster_config.simulated(range(first, first + n), **options)
+	replicas = [
+		Replica(replica_id, Simulated_network(replica_id, simulation, config))
+		for replica_id in config.replica_ids
+	]
+	client = Simulated_client(first, simulation, config, 1.0, 16)
+	return replicas, client
+
+def start(replicas, client=None):
+	tasks = [asyncio.ensure_future(replica.run()) for replica in replicas]
+	if client is not None:
+		tasks.append(asyncio.ensure_future(client.run()))
+	return tasks
+
+def cancel(tasks):
+	for task in tasks:
+		task.cancel()
+
+async def run_for(replicas, client, duration):
+	tasks = start(replicas, client)
+	await asyncio.sleep(duration)
+	cancel(tasks)
+
+def committed(replica):
+	return [block.hash for block in replica.log]
+
+# replicas at the lowest height among them have the same state
+def same_state(replicas):
+	heights = [replica.blocks.committed_height for replica in replicas]
+	return len({replica.state_machine.digest() for replica in replicas
+	            if replica.blocks.committed_height == min(heights)}) <= 1
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import pytest
+from hotstuff.launcher import *
+
+def test_split_groups():
+	assert split([0, 1, 2, 3], 2) == [[0, 2], [1, 3]]
+	assert split([0, 1], 8) == [[0], [1]]
+
+def test_consistent_prefix():
+	replicas = [
+		{"fault": "HONEST", "committed": ["a", "b", "c"], "height": 2, "state_digest": "1"},
+		{"fault": "HONEST", "committed": ["a", "b"], "height": 1, "state_digest": "2"},
+		{"fault": "HONEST", "committed": ["a", "b"], "height": 1, "state_digest": "2"},
+		{"fault": "CRASH", "committed": ["a", "x"], "height": 1, "state_digest": "3"},
+	]
+	assert consistent(replicas)
+	replicas[2]["state_digest"] = "3"
+	assert not consistent(replicas)
+	replicas[2]["state_digest"] = "2"
+	replicas[1]["committed"] = ["a", "x"]
+	assert not consistent(replicas)
+	# logs that were trimmed at different heights line up by height
+	replicas[1]["committed"] = ["b"]
+	replicas[1]["base_height"] = 1
+	replicas[0]["committed"] = ["c"]
+	replicas[0]["base_height"] = 2
+	assert consistent(replicas)
+	replicas[0]["committed"] = ["x", "c"]
+	replicas[0]["base_height"] = 1
+	assert not consistent(replicas)
+
+def test_merge_logs():
+	with tempfile.TemporaryDirectory() as directory:
+		paths = [os.path.join(directory, f"{i}.log") for i in range(2)]
+		with open(paths[0], "w") as f:
+			f.write("1.0 a\n3.0 c\n")
+		with open(paths[1], "w") as f:
+			f.write("2.0 b\n")
+		target = os.path.join(directory, "cluster.log")
+		merge_logs(paths, target)
+		with open(target) as f:
+			assert [line.split()[1] for line in f] == ["a", "b", "c"]
+
+# each process can sign for its own replicas only
+def test_keyring():
+	pytest.importorskip("cryptography")
+	with tempfile.TemporaryDirectory() as directory:
+		write_keyring(directory, range(4))
+		assert oct(os.stat(os.path.join(directory, "replica-2.key")).st_mode & 0o777) == "0o600"
+		config = {"keyring": directory}
+		mine = load_scheme(config, [0, 1])
+		theirs = load_scheme(config, [2])
+		assert set(mine.private_keys) == {0, 1} and set(mine.public_keys) == {0, 1, 2, 3}
+		digest = b"d" * 32
+		assert theirs.verify(0, digest, mine.sign(0, digest))
+		assert not theirs.verify(1, digest, mine.sign(0, digest))
+		with pytest.raises(KeyError):
+			theirs.sign(0, digest)
+		assert isinstance(load_scheme(dict(config, secret="s"), [0]), Hmac_scheme)
+
+# four replicas in two processes plus a client process, signing with a
+# fresh Ed25519 keyring unless there is a secret
+@pytest.mark.parametrize("secret", [None, "launcher-test"])
+def test_cluster(secret):
+	if secret is None:
+		pytest.importorskip("cryptography")
+	with tempfile.TemporaryDirectory() as directory:
+		config = {
+			"replicas": [
+				{"id": i, "host": "127.0.0.1", "port": 52000 + i}
+				for i in range(4)
+			],
+			"processes": 2,
+			"duration": 4.0,
+			"output": directory,
+			"timeout": 2.0,
+			"max_batch_size": 100,
+			"chained": False,
+			"storage": None,
+			"election": "reputation",
+			"clients": [{"id": 0, "window": 16, "timeout": 3.0}],
+			"secret": secret,
+		}
+		summary = launch(config)
+		assert summary["consistent"]
+		assert len(summary["replicas"]) == 4
+		assert summary["max_height"] > 0
+		assert summary["clients"][0]["completed"] > 0
+		assert os.path.exists(os.path.join(directory, "cluster.log"))
+		assert os.path.exists(os.path.join(directory, "summary.json"))
+		assert os.path.exists(os.path.join(directory, "keyring")) == (secret is None)
@@ -0,0 +1,181 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.codec import *
+from hotstuff.cluster_config import *
+from hotstuff.membership import *
+from hotstuff.replica import *
+from hotstuff.simulation import *
+from tests.helpers import *
+
+def test_reconfigured():
+	config = Cluster_config.simulated(range(4), max_batch_size=10, admins=[0])
+	bigger = reconfigured(config, Command(ADD_REPLICA, [4, None, None], 0))
+	assert bigger.replica_ids == (0, 1, 2, 3, 4) and bigger.max_batch_size == 10
+	smaller = reconfigured(bigger, Command(REMOVE_REPLICA, [0], 0))
+	assert smaller.replica_ids == (1, 2, 3, 4)
+	tcp = reconfigured(Cluster_config({0: ('127.0.0.1', 50000)}, Hmac_scheme.generate(), admins=[0]),
+	                   Command(ADD_REPLICA, [1, '127.0.0.1', 50001], 0))
+	assert tcp.replica_addresses[1] == ('127.0.0.1', 50001)
+
+def test_reconfigured_ignores_nonsense():
+	config = Cluster_config.simulated(range(4), admins=[0])
+	for op, args in (
+		(ADD_REPLICA, [3, None, None]), # already in
+		(ADD_REPLICA, [4]),
+		(ADD_REPLICA, ["4", None, None]),
+		(ADD_REPLICA, [4, "host", None]),
+		(REMOVE_REPLICA, [7]),
+		(REMOVE_REPLICA, [True]),
+		(REMOVE_REPLICA, None),
+		("SET", ["A", 1]),
+	):
+		assert reconfigured(config, Command(op, args, 0)) is None
+	# not from an admin
+	assert reconfigured(config, Command(ADD_REPLICA, [4, None, None], 1)) is None
+	alone = Cluster_config.simulated([0], admins=[0])
+	assert reconfigured(alone, Command(REMOVE_REPLICA, [0], 0)) is None
+
+def test_config_for_view():
+	config = Cluster_config.simulated(range(4))
+	membership = Membership(config)
+	bigger = config.replace({replica_id: None for replica_id in range(5)})
+	membership.schedule(20, bigger)
+	assert membership.config_for(19) is config and membership.config_for(20) is bigger
+	assert membership.latest is bigger
+	# a later change from the same view replaces it
+	smaller = config.replace({replica_id: None for replica_id in range(3)})
+	membership.schedule(20, smaller)
+	assert len(membership.configs) == 2 and membership.config_for(25) is smaller
+
+def test_snapshot_round_trip():
+	config = Cluster_config({0: ('127.0.0.1', 50000)}, Hmac_scheme.generate(), timeout=0.5,
+	                        admins=[0])
+	membership = Membership(config)
+	membership.schedule(12, reconfigured(config, Command(ADD_REPLICA, [1, '127.0.0.1', 50001], 0)))
+	snapshot = membership.snapshot()
+	msg = Message(Protocol_phase.STATE_RESPONSE, 3, GENESIS_BLOCK, None)
+	msg.snapshot = {"height": 0, "state": {"A": 1}, "membership": snapshot}
+	decoded = decode(encode(msg))
+	assert decoded.snapshot == msg.snapshot
+	restored = Membership.restore(decoded.snapshot["membership"], config)
+	assert [first_view for first_view, _ in restored.configs] == [0, 12]
+	assert restored.latest.replica_addresses == membership.latest.replica_addresses
+	assert restored.latest.timeout == 0.5
+
+# replica 4 joins a cluster of 4 from the others' state, then replica 0 is
+# removed and the other four carry on without it
+def test_add_and_remove_replica():
+	simulation = Simulation(seed=3, latency=0.002)
+	config = Cluster_config.simulated(range(4), admins=[0])
+	replicas = [
+		Replica(replica_id, Simulated_network(replica_id, simulation, config))
+		for replica_id in config.replica_ids
+	]
+	joined_config = config.replace({replica_id: None for replica_id in range(5)})
+	joiner = Replica(4, Simulated_network(4, simulation, joined_config), joining=True)
+	client = Simulated_client(0, simulation, config, 1.0, 16)
+	heights = {}
+	async def main():
+		tasks = start(replicas + [joiner], client)
+		await asyncio.sleep(2.0)
+		await client.request(ADD_REPLICA, [4, None, None])
+		await asyncio.sleep(3.0)
+		heights["joined"] = joiner.blocks.committed_height
+		await client.request(REMOVE_REPLICA, [0])
+		await asyncio.sleep(3.0)
+		heights["removed"] = replicas[0].blocks.committed_height
+		heights["others"] = replicas[1].blocks.committed_height
+		await asyncio.sleep(3.0)
+		cancel(tasks)
+	simulation.run(main())
+	assert not joiner.joining and heights["joined"] > 0
+	assert all(replica.config.n == 4 for replica in replicas[1:] + [joiner])
+	assert replicas[1].config.replica_ids == (1, 2, 3, 4)
+	assert not replicas[0].running
+	assert replicas[0].blocks.committed_height == heights["removed"]
+	assert replicas[1].blocks.committed_height > heights["others"]
+	# the joiner is on the same chain as everyone else
+	assert same_state(replicas[1:] + [joiner])
+	tip = joiner.blocks.tip
+	assert replicas[1].blocks.committed_at(tip.height).hash == tip.hash
+
+# replica 4 is cut off while replica 3 is removed, it syncs the blocks from
+# either side of the change, each checked against its own membership
+def test_sync_across_reconfiguration():
+	simulation = Simulation(seed=4, latency=0.002)
+	replicas, client = make_cluster(simulation, 5, admins=[0])
+	async def main():
+		simulation.partition({0, 1, 2, 3}, {4})
+		tasks = start(replicas)
+		await asyncio.sleep(1.5)
+		await client.request(REMOVE_REPLICA, [3])
+		tasks += start([], client)
+		await asyncio.sleep(4.0)
+		ahead = min(len(replica.log) for replica in replicas[:3])
+		simulation.heal()
+		# it finds out at its next timeout
+		await asyncio.sleep(15.0)
+		cancel(tasks)
+		return ahead
+	ahead = simulation.run(main())
+	assert not replicas[3].running and replicas[0].config.replica_ids == (0, 1, 2, 4)
+	assert len(replicas[4].log) >= ahead
+	assert committed(replicas[4])[:ahead] == committed(replicas[0])[:ahead]
+	assert replicas[4].config.replica_ids == (0, 1, 2, 4)
+
+# a replica that hands out a made-up state under the others' ids as well
+# as its own still counts once, the joiner waits for F+1 signers
+def test_state_responses_counted_by_signer():
+	simulation = Simulation(seed=5, latency=0.002)
+	replicas, client = make_cluster(simulation, 4, admins=[0])
+	joined_config = replicas[0].config.replace({replica_id: None for replica_id in range(5)})
+	joiner = Replica(4, Simulated_network(4, simulation, joined_config), joining=True)
+	sent = []
+	async def capture(recipient_id, msg):
+		sent.append(msg)
+	async def main():
+		tasks = start(replicas, client)
+		await asyncio.sleep(1.5)
+		await client.request(ADD_REPLICA, [4, None, None])
+		await asyncio.sleep(3.0)
+		cancel(tasks)
+		liar = replicas[1]
+		liar.send = capture
+		await liar.handle_state_request(Message(Protocol_phase.STATE_REQUEST, 0, None, None, sender=4))
+		forged = sent[0]
+		forged.snapshot["state"] = {"A": 666}
+		w = Writer()
+		write_value(w, forged.snapshot)
+		digest = snapshot_digest(forged.blocks[0].hash, w.getvalue())
+		for sender in range(4):
+			forged.sender = sender
+			await joiner.dispatch(forged)
+			# or under another signer's name
+			forged.partial_sig = (sender, joined_config.scheme.sign(1, digest))
+			await joiner.dispatch(forged)
+	simulation.run(main())
+	assert joiner.joining and "A" not in joiner.state
+
+# only admins add and remove replicas, the others' requests are refused
+# when they come in, and ignored if a leader proposes them anyway
+def test_reconfiguration_needs_admin():
+	simulation = Simulation(seed=6, latency=0.002)
+	replicas, client = make_cluster(simulation, 4, admins=[9])
+	async def main():
+		tasks = start(replicas)
+		await asyncio.sleep(1.5)
+		try:
+			await asyncio.wait_for(client.request(REMOVE_REPLICA, [3]), 3.0)
+			answered = True
+		except asyncio.TimeoutError:
+			answered = False
+		leader = next(replica for replica in replicas if replica.is_leader)
+		await leader.accept_cmds([Command(REMOVE_REPLICA, [3], 0, 99)])
+		await client.request("SET", ["B", 1])
+		await asyncio.sleep(3.0)
+		cancel(tasks)
+		return answered
+	assert not simulation.run(main())
+	assert sum(replica.metrics.counters.get("unauthorized", 0) for replica in replicas) > 0
+	assert any(cmd.op == REMOVE_REPLICA for block in replicas[0].log for cmd in block.cmds)
+	assert all(replica.running and replica.config.n == 4 for replica in replicas)
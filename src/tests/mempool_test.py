@@ -0,0 +1,62 @@
+from hotstuff.hotstuff_types import *
+from hotstuff.mempool import *
+from hotstuff.codec import *
+
+def make_cmds(client_id, count):
+	return [Command("SET", ["A", i], client_id, i) for i in range(count)]
+
+def test_dedup_and_commit_filter():
+	pool = Mempool()
+	cmd = make_cmds(0, 1)[0]
+	assert pool.add(cmd) and not pool.add(cmd)
+	assert cmd.hash in pool and len(pool) == 1
+	pool.mark_committed([cmd])
+	assert len(pool) == 0 and pool.committed(cmd.hash)
+	assert not pool.add(cmd)
+
+def test_recent_filter_is_bounded():
+	pool = Mempool(recent_size=3)
+	cmds = make_cmds(0, 5)
+	pool.mark_committed(cmds)
+	assert len(pool.recent) == 3
+	assert not pool.committed(cmds[0].hash) and pool.committed(cmds[4].hash)
+
+def test_full():
+	pool = Mempool(max_size=2)
+	cmds = make_cmds(0, 3)
+	assert pool.add(cmds[0]) and pool.add(cmds[1])
+	assert pool.full() and not pool.add(cmds[2])
+
+def test_batch_fifo_and_fair():
+	pool = Mempool()
+	busy = make_cmds(0, 10)
+	quiet = make_cmds(1, 2)
+	for cmd in busy + quiet:
+		pool.add(cmd)
+	batch = pool.batch(4, 1 << 20)
+	assert [cmd.hash for cmd in batch] == \
+		[busy[0].hash, quiet[0].hash, busy[1].hash, quiet[1].hash]
+	# nothing leaves until it's committed
+	assert len(pool) == 12
+	# the client served first waits its turn next time
+	batch = pool.batch(2, 1 << 20, exclude={quiet[0].hash})
+	assert [cmd.hash for cmd in batch] == [quiet[1].hash, busy[0].hash]
+
+def test_batch_byte_limit():
+	pool = Mempool()
+	for cmd in make_cmds(0, 10):
+		pool.add(cmd)
+	size = make_cmds(0, 1)[0].size()
+	w = Writer()
+	write_command(w, make_cmds(0, 1)[0])
+	assert size == len(w.getvalue())
+	assert len(pool.batch(10, 3 * size)) == 3
+	assert len(pool.batch(10, 1)) == 1
+
+def test_take_all():
+	pool = Mempool()
+	cmds = make_cmds(0, 3) + make_cmds(1, 2)
+	for cmd in cmds:
+		pool.add(cmd)
+	assert [cmd.hash for cmd in pool.take_all()] == [cmd.hash for cmd in cmds]
+	assert len(pool) == 0 and pool.batch(10, 1 << 20) == []
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import logging
+from hotstuff.hotstuff_types import *
+from hotstuff.metrics import *
+from hotstuff.replica import *
+from hotstuff.simulation import *
+
+def test_snapshot():
+	metrics = Metrics()
+	metrics.inc("views_entered")
+	metrics.inc("views_entered")
+	metrics.inc("qcs_formed", Protocol_phase.PREPARE)
+	metrics.inc("bytes_sent", value=100)
+	metrics.set("inbox_depth", 3)
+	for latency in range(1, 101):
+		metrics.observe("phase_latency", latency / 1000, Protocol_phase.COMMIT)
+	snapshot = json.loads(json.dumps(metrics.snapshot()))
+	assert snapshot["counters"] == {
+		"views_entered": 2, "qcs_formed.PREPARE": 1, "bytes_sent": 100
+	}
+	assert snapshot["gauges"] == {"inbox_depth": 3}
+	latency = snapshot["histograms"]["phase_latency.COMMIT"]
+	assert latency["count"] == 100 and latency["max"] == 0.1
+	assert latency["p50"] == 0.051 and latency["p99"] == 0.1
+
+def test_spans_off_by_default():
+	metrics = Metrics()
+	metrics.start_view(1)
+	metrics.event("propose")
+	assert metrics.export_spans() == []
+
+def test_spans():
+	async def run():
+		metrics = Metrics(spans=True)
+		metrics.start_view(1)
+		await asyncio.sleep(0.5)
+		metrics.event(Protocol_phase.PREPARE)
+		await asyncio.sleep(0.5)
+		metrics.start_view(2)
+		return metrics.export_spans()
+	spans = json.loads(json.dumps(Simulation().run(run())))
+	assert [span["view"] for span in spans] == [1, 2]
+	assert spans[0]["events"] == [["PREPARE", 0.5]]
+	assert spans[0]["end"] == spans[1]["start"] == 1.0
+
+class Unprintable:
+	def __str__(self):
+		raise AssertionError("formatted a disabled trace")
+	__repr__ = __str__
+
+def test_disabled_trace_is_not_formatted():
+	logging.getLogger("hotstuff").setLevel(logging.WARNING)
+	simulation = Simulation()
+	replica = Replica(0, Simulated_network(0, simulation, Cluster_config.simulated([0])))
+	replica.trace("Voting for %s", Unprintable())
+	logging.getLogger("hotstuff").setLevel(logging.NOTSET)
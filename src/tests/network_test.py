@@ -0,0 +1,56 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.network import *
+from hotstuff.cluster_config import *
+
+ADDRESSES = {0: ('127.0.0.1', 52100), 1: ('127.0.0.1', 52101)}
+CONFIG = Cluster_config(ADDRESSES, Hmac_scheme.generate())
+
+def test_full_queue_drops_old_views():
+	async def run():
+		network = Network(0, CONFIG)
+		peer = network.peer(1)
+		Peer.MAX_QUEUE = 3
+		try:
+			for view, packet in [(1, b"a"), (1, b"b"), (2, b"c"), (2, b"d")]:
+				peer.put(view, packet)
+		finally:
+			Peer.MAX_QUEUE = 1024
+		assert [packet for _, packet in peer.queue] == [b"c", b"d"]
+		assert network.metrics.counters["send_dropped"] == 2
+		await peer.close()
+	asyncio.run(run())
+
+def test_reconnects_to_a_peer_that_comes_back():
+	async def run():
+		network = Network(0, CONFIG)
+		peer = network.peer(1)
+		peer.put(1, b"old")
+		await asyncio.sleep(0.1)
+		assert network.health() == {1: "DOWN"}
+		# only the newest view is kept for a peer that is down
+		peer.put(2, b"new")
+		assert [packet for _, packet in peer.queue] == [b"new"]
+
+		received = asyncio.get_running_loop().create_future()
+		async def recv(reader, writer):
+			size = int.from_bytes(await reader.readexactly(4), 'big')
+			received.set_result(await reader.readexactly(size))
+		server = await asyncio.start_server(recv, *ADDRESSES[1])
+		assert await asyncio.wait_for(received, 2 * Peer.MAX_BACKOFF) == b"new"
+		assert network.health() == {1: "UP"}
+		assert network.metrics.counters["reconnects"] == 1
+		await peer.close()
+		server.close()
+	asyncio.run(run())
+
+# a peer that left the cluster is closed by a task the network keeps
+def test_reconfigure_closes_removed_peer():
+	async def run():
+		network = Network(0, CONFIG)
+		network.peer(1)
+		network.reconfigure(CONFIG.replace({0: ADDRESSES[0]}))
+		assert network.peers == {} and len(network.closing) == 1
+		await asyncio.gather(*network.closing)
+		assert not network.closing and network.peer(1) is None
+	asyncio.run(run())
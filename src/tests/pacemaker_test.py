@@ -0,0 +1,60 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.election import *
+from hotstuff.replica import *
+from hotstuff.simulation import *
+
+# a pacemaker whose replica enters every view it times out into, on the
+# virtual clock
+def make_pacemaker(timeout=1.0):
+	entered = []
+	async def timed_out(view):
+		entered.append((view, now()))
+		pacemaker.start_timer(view)
+	pacemaker = Pacemaker(timeout, timed_out, Round_robin([0, 1, 2, 3]))
+	return pacemaker, entered
+
+def run(main):
+	return Simulation(seed=1).run(main())
+
+def test_ewma_follows_view_latency():
+	pacemaker, _ = make_pacemaker()
+	async def main():
+		for view in range(1, 21):
+			pacemaker.start_timer(view)
+			await asyncio.sleep(0.1)
+			pacemaker.progress()
+		pacemaker.stop_timer()
+	run(main)
+	assert abs(pacemaker.view_latency - 0.1) < 1e-9
+	assert abs(pacemaker.current_timeout() - 0.1 * Pacemaker.LATENCY_FACTOR) < 1e-9
+
+def test_backoff_doubles_and_resets():
+	pacemaker, entered = make_pacemaker(timeout=1.0)
+	async def main():
+		pacemaker.start_timer(1)
+		# times out in views 1, 2 and 3 after 1, 2 and 4 seconds
+		await asyncio.sleep(7.5)
+		timeouts = [view_time for _, view_time in entered]
+		assert [view for view, _ in entered] == [2, 3, 4]
+		assert timeouts == [1.0, 3.0, 7.0]
+		assert pacemaker.failures == 3
+		await asyncio.sleep(0.5)
+		pacemaker.progress()
+		pacemaker.stop_timer()
+	run(main)
+	assert pacemaker.failures == 0
+	assert pacemaker.stats()["view_changes"] == 1
+
+# time spent timing out doesn't count towards the next view's latency
+def test_view_started_after_timeout():
+	pacemaker, entered = make_pacemaker(timeout=1.0)
+	async def main():
+		pacemaker.start_timer(1)
+		await asyncio.sleep(1.1)
+		assert entered == [(2, 1.0)] and pacemaker.view_started == 1.0
+		await asyncio.sleep(0.05)
+		pacemaker.progress()
+		pacemaker.stop_timer()
+	run(main)
+	assert abs(pacemaker.view_latency - 0.15) < 1e-9
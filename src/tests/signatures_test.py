@@ -0,0 +1,39 @@
+import pytest
+from hotstuff.hotstuff_types import *
+from hotstuff.signatures import *
+
+def make_qc(scheme, signers, view=5):
+	block = Block([Command("SET", ["A", view], 0)], GENESIS_BLOCK.hash, view)
+	digest = vote_digest(view, Protocol_phase.PREPARE_VOTE, block.hash)
+	sig = Signature(4, 1)
+	for signer_id in signers:
+		sig.combine((signer_id, scheme.sign(signer_id, digest)))
+	return QC(Protocol_phase.PREPARE, view, block.hash, sig)
+
+def check_scheme(scheme):
+	qc = make_qc(scheme, [0, 1, 2])
+	assert qc.signature.verify(scheme, qc.digest(), 3)
+	# not enough signers, whatever threshold the QC claims
+	qc.signature.threshold = 0
+	assert not qc.signature.verify(scheme, qc.digest(), 4)
+	# a share for another block doesn't count
+	other = make_qc(scheme, [0, 1, 2], view=6)
+	qc.signature.combined[2] = other.signature.combined[2]
+	assert not qc.signature.verify(scheme, qc.digest(), 3)
+	# one replica can't sign for another
+	qc = make_qc(scheme, [0, 1, 2])
+	qc.signature.combined[2] = qc.signature.combined[1]
+	assert not qc.signature.verify(scheme, qc.digest(), 3)
+
+def test_hmac_scheme():
+	scheme = Hmac_scheme.generate()
+	check_scheme(scheme)
+	qc = make_qc(scheme, [0, 1, 2])
+	assert not qc.signature.verify(Hmac_scheme.generate(), qc.digest(), 3)
+	for secret in (None, b"", "text"):
+		with pytest.raises(ValueError):
+			Hmac_scheme(secret)
+
+def test_ed25519_scheme():
+	pytest.importorskip("cryptography")
+	check_scheme(Ed25519_scheme.generate(range(4)))
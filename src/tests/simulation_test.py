@@ -0,0 +1,233 @@
+import asyncio
+import time
+from hotstuff.hotstuff_types import *
+from hotstuff.replica import *
+from hotstuff.simulation import *
+from tests.helpers import *
+
+def test_virtual_clock():
+	async def main():
+		loop = asyncio.get_running_loop()
+		await asyncio.sleep(3600)
+		return loop.time()
+	started = time.perf_counter()
+	assert Simulation().run(main()) >= 3600
+	assert time.perf_counter() - started < 1
+
+def test_same_seed_same_run():
+	runs = []
+	for _ in range(2):
+		simulation = Simulation(seed=7, latency=0.002, jitter=0.003, loss=0.01)
+		replicas, client = make_cluster(simulation, 4)
+		simulation.run(run_for(replicas, client, 5.0))
+		runs.append(([committed(replica) for replica in replicas],
+		             client.completed, simulation.sent))
+	assert runs[0] == runs[1]
+	assert runs[0][1] > 0
+
+def test_partition_without_quorum_stalls():
+	simulation = Simulation(seed=1, latency=0.002)
+	replicas, client = make_cluster(simulation, 4, chained=True)
+	async def main():
+		simulation.partition({0, 1}, {2, 3})
+		start(replicas, client)
+		await asyncio.sleep(3.0)
+		stalled = max(len(replica.log) for replica in replicas)
+		simulation.heal()
+		await asyncio.sleep(10.0)
+		return stalled
+	stalled = simulation.run(main())
+	assert stalled == 1 # genesis only
+	assert min(len(replica.log) for replica in replicas) > 1
+
+# reads are answered without a block once F+1 replicas agree
+def test_query_fast_path():
+	simulation = Simulation(seed=3, latency=0.002, jitter=0.002)
+	replicas, client = make_cluster(simulation, 4)
+	async def main():
+		tasks = start(replicas)
+		await asyncio.sleep(1.5)
+		await client.request("SET", ["B", 42])
+		height = max(len(replica.log) for replica in replicas)
+		result = await client.query("GET", ["B"])
+		cancel(tasks)
+		return result, height
+	result, height = simulation.run(main())
+	assert result == 42 and client.queries_completed == 1
+	assert max(len(replica.log) for replica in replicas) == height
+	assert sum(replica.metrics.counters.get("queries", 0) for replica in replicas) >= 2
+
+# one client's malformed command or query doesn't stop the cluster
+def test_malformed_requests():
+	simulation = Simulation(seed=4, latency=0.002, jitter=0.002)
+	replicas, client = make_cluster(simulation, 4)
+	async def main():
+		tasks = start(replicas)
+		await asyncio.sleep(1.5)
+		await client.request("SET", ["only-a-key"])
+		try:
+			await client.query("GET", 5)
+			refused = False
+		except Query_error:
+			refused = True
+		await client.request("SET", ["B", 42])
+		result = await client.query("GET", ["B"])
+		cancel(tasks)
+		return refused, result
+	refused, result = simulation.run(main())
+	assert refused and result == 42
+	assert all(replica.running for replica in replicas)
+
+# a replica cut off for a while catches up through block sync once it can
+# talk to the others again
+def test_lagging_replica_syncs():
+	simulation = Simulation(seed=2, latency=0.002, jitter=0.002)
+	replicas, client = make_cluster(simulation, 4)
+	async def main():
+		simulation.partition({0, 1, 2}, {3})
+		tasks = start(replicas, client)
+		await asyncio.sleep(4.0)
+		behind = len(replicas[3].log)
+		ahead = min(len(replica.log) for replica in replicas[:3])
+		simulation.heal()
+		await asyncio.sleep(4.0)
+		replicas[3].stop()
+		await asyncio.sleep(0.1)
+		left = [task for task in replicas[3].tasks if not task.done()]
+		cancel(tasks)
+		return behind, ahead, left
+	behind, ahead, left = simulation.run(main())
+	assert behind == 1 and ahead > 10
+	assert len(replicas[3].log) >= ahead
+	assert committed(replicas[3])[:ahead] == committed(replicas[0])[:ahead]
+	served = sum(replica.metrics.counters.get(("received", Protocol_phase.BLOCK_REQUEST), 0)
+	             for replica in replicas[:3])
+	assert served > 0 and not left
+
+# the peer a lagging replica asks first is gone, the others serve the
+# chunks it would have
+def test_lagging_replica_syncs_past_crashed_peer():
+	simulation = Simulation(seed=2, latency=0.002, jitter=0.002)
+	replicas, client = make_cluster(simulation, 4)
+	async def main():
+		simulation.partition({0, 1, 2}, {3})
+		tasks = start(replicas, client)
+		await asyncio.sleep(4.0)
+		ahead = min(len(replica.log) for replica in replicas[:3])
+		replicas[0].stop()
+		simulation.heal()
+		await asyncio.sleep(20.0)
+		cancel(tasks)
+		return ahead
+	ahead = simulation.run(main())
+	assert ahead > 10
+	assert len(replicas[3].log) >= ahead
+	assert committed(replicas[3])[:ahead] == committed(replicas[1])[:ahead]
+
+# a replica further behind than the others keep blocks for takes their
+# state instead
+def test_lagging_replica_catches_up_past_history():
+	simulation = Simulation(seed=2, latency=0.002, jitter=0.002)
+	config = Cluster_config.simulated(range(4))
+	replicas = [
+		Replica(replica_id, Simulated_network(replica_id, simulation, config), history=8)
+		for replica_id in config.replica_ids
+	]
+	client = Simulated_client(0, simulation, config, 1.0, 16)
+	async def main():
+		simulation.partition({0, 1, 2}, {3})
+		tasks = start(replicas, client)
+		await asyncio.sleep(4.0)
+		ahead = min(replica.blocks.committed_height for replica in replicas[:3])
+		simulation.heal()
+		await asyncio.sleep(6.0)
+		cancel(tasks)
+		return ahead
+	ahead = simulation.run(main())
+	assert ahead > 3 * 8
+	assert all(len(replica.log) <= 2 * 8 + 1 for replica in replicas)
+	assert replicas[3].metrics.counters.get("catch_ups", 0) > 0
+	assert replicas[3].blocks.committed_height >= ahead and not replicas[3].joining
+	assert same_state(replicas)
+	height = replicas[3].blocks.committed_height
+	assert replicas[0].blocks.committed_at(height).hash == replicas[3].blocks.tip.hash
+
+# a client that missed the replies to a committed command still gets an
+# answer when it resubmits
+def test_resubmitted_committed_command_answered():
+	simulation = Simulation(seed=5, latency=0.002)
+	replicas, client = make_cluster(simulation, 4)
+	reply = simulation.reply
+	lost = []
+	def drop(replica_id, client_id, packet):
+		lost.append(packet)
+	async def main():
+		tasks = start(replicas)
+		await asyncio.sleep(1.5)
+		simulation.reply = drop
+		request = asyncio.ensure_future(client.request("SET", ["C", 7]))
+		await asyncio.sleep(2.0)
+		committed_everywhere = all(replica.state.get("C") == 7 for replica in replicas)
+		simulation.reply = reply
+		await asyncio.wait_for(request, 10.0)
+		cancel(tasks)
+		return committed_everywhere
+	assert simulation.run(main())
+	assert lost and client.completed == 1
+	assert sum(replica.metrics.counters.get("resubmitted", 0) for replica in replicas) > 0
+
+# a malformed message, or one a handler chokes on, is dropped and the
+# replica carries on
+def test_bad_messages_dropped():
+	simulation = Simulation(seed=6, latency=0.002, jitter=0.002)
+	replicas, client = make_cluster(simulation, 4)
+	async def fail(msg):
+		raise RuntimeError("handler bug")
+	replicas[2].handlers[Protocol_phase.FORWARD] = fail
+	async def main():
+		tasks = start(replicas, client)
+		await asyncio.sleep(1.5)
+		for replica in replicas:
+			for phase in REQUIRED_FIELDS:
+				msg = Message(phase, replica.current_view, None, None)
+				msg.sender = 3
+				replica.network.inbox.put_nowait(msg)
+		await asyncio.sleep(2.0)
+		heights = [len(replica.log) for replica in replicas]
+		await asyncio.sleep(2.0)
+		cancel(tasks)
+		return heights
+	heights = simulation.run(main())
+	assert all(replica.running for replica in replicas)
+	assert all(len(replica.log) > height for replica, height in zip(replicas, heights))
+	for replica in replicas:
+		assert replica.metrics.counters[("malformed", Protocol_phase.NEW_VIEW)] == 1
+	assert replicas[2].metrics.counters.get("dropped", 0) > 0
+
+# GENERIC proposals that aren't from the view's leader, or that carry a QC
+# older than ours, don't move anyone to the next view
+def test_forged_generic_ignored():
+	simulation = Simulation(seed=8, latency=0.002, jitter=0.002)
+	replicas, client = make_cluster(simulation, 4, chained=True)
+	async def main():
+		tasks = start(replicas, client)
+		await asyncio.sleep(1.5)
+		views = [replica.current_view for replica in replicas]
+		heights = [len(replica.log) for replica in replicas]
+		for _ in range(100):
+			for replica in replicas:
+				view = replica.current_view
+				leader_id = replica.pacemaker.get_leader(view)
+				for sender in (leader_id, (leader_id + 1) % 4):
+					block = Block([], GENESIS_BLOCK.hash, view)
+					replica.network.inbox.put_nowait(
+						Message(Protocol_phase.GENERIC, view, block, GENESIS_QC, sender=sender)
+					)
+			await asyncio.sleep(0.01)
+		cancel(tasks)
+		return views, heights
+	views, heights = simulation.run(main())
+	for replica, view, height in zip(replicas, views, heights):
+		assert len(replica.log) > height + 10
+		# a view per committed block, give or take the pipeline
+		assert replica.current_view - view <= len(replica.log) - height + 4
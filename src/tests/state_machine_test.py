@@ -0,0 +1,50 @@
+from hotstuff.hotstuff_types import *
+from hotstuff.state_machine import *
+
+def test_apply_and_query():
+	store = Key_value_store()
+	store.apply([Command("SET", ["A", 1], 0, 1), Command("GET", ["A"], 0, 2),
+	             Command("SET", ["B", [1, 2]], 0, 3)])
+	assert store.query("GET", ["A"]) == 1
+	assert store.query("GET", ["B"]) == [1, 2]
+	assert store.query("GET", ["C"]) is None
+	assert store.snapshot() == {"A": 1, "B": [1, 2]}
+
+def test_digest_ignores_insertion_order():
+	a, b = Key_value_store(), Key_value_store()
+	a.apply([Command("SET", ["A", 1], 0, 1), Command("SET", ["B", 2], 0, 2)])
+	b.apply([Command("SET", ["B", 2], 0, 1), Command("SET", ["A", 1], 0, 2)])
+	assert a.digest() == b.digest()
+	b.apply([Command("SET", ["A", 3], 0, 3)])
+	assert a.digest() != b.digest()
+
+# the same no-op on every replica, nothing raises
+def test_malformed_commands_ignored():
+	store = Key_value_store()
+	store.apply([
+		Command("SET", ["only-a-key"], 0, 1),
+		Command("SET", None, 0, 2),
+		Command("SET", [["unhashable"], 1], 0, 3),
+		Command("SET", [True, 1], 0, 4),
+		Command("SET", "AB", 0, 5),
+		Command("DROP", ["A"], 0, 6),
+		Command("SET", ["A", 1], 0, 7),
+	])
+	assert store.snapshot() == {"A": 1}
+
+def test_malformed_queries_refused():
+	store = Key_value_store()
+	for op, args in (("GET", 5), ("GET", []), ("GET", [["A"]]), ("GET", ["A", "B"]),
+	                 ("DROP", ["A"])):
+		try:
+			store.query(op, args)
+			assert False
+		except Query_error:
+			pass
+
+def test_restore():
+	store = Key_value_store()
+	store.apply([Command("SET", ["A", 1], 0, 1)])
+	copy = Key_value_store()
+	copy.restore(store.snapshot())
+	assert copy.digest() == store.digest() and copy.query("GET", ["A"]) == 1
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import tempfile
+import time
+from hotstuff.hotstuff_types import *
+from hotstuff.storage import *
+from tests.helpers import *
+
+def make_qc(block):
+	return QC(Protocol_phase.PRECOMMIT, block.view, block.hash, Signature(4, 1))
+
+async def write_log(directory, blocks, snapshot_interval=1000):
+	wal = Write_ahead_log(directory, snapshot_interval)
+	wal.open()
+	await wal.start()
+	state = {}
+	for block in blocks:
+		for cmd in block.cmds:
+			state[cmd.args[0]] = cmd.args[1]
+		wal.append_view(block.view)
+		wal.append_qc(RECORD_LOCKED_QC, make_qc(block))
+		wal.append_block(block)
+		if wal.snapshot_due():
+			await wal.snapshot(block, block.view, dict(state), make_qc(block),
+			                   make_qc(block), block.view)
+	await wal.close()
+	return state
+
+def test_recover_log():
+	with tempfile.TemporaryDirectory() as directory:
+		blocks = make_blocks(20)
+		asyncio.run(write_log(directory, blocks))
+		recovered = Write_ahead_log(directory).open()
+		assert [b.hash for b in recovered.blocks] == [b.hash for b in blocks]
+		assert recovered.locked_qc.block_hash == blocks[-1].hash
+		assert recovered.view == 20 and recovered.base_height == 0
+
+def test_recover_snapshot_and_tail():
+	with tempfile.TemporaryDirectory() as directory:
+		blocks = make_blocks(25)
+		state = asyncio.run(write_log(directory, blocks, snapshot_interval=10))
+		recovered = Write_ahead_log(directory).open()
+		assert recovered.base_height == 20
+		assert recovered.base_block.hash == blocks[19].hash
+		assert [b.hash for b in recovered.blocks] == [b.hash for b in blocks[20:]]
+		for block in recovered.blocks:
+			for cmd in block.cmds:
+				recovered.state[cmd.args[0]] = cmd.args[1]
+		assert recovered.state == state
+
+def test_snapshot_membership():
+	async def write(directory, membership):
+		wal = Write_ahead_log(directory, 1)
+		wal.open()
+		await wal.start()
+		block = make_blocks(1)[0]
+		wal.append_block(block)
+		await wal.snapshot(block, 1, {}, make_qc(block), make_qc(block), 1,
+		                   membership=membership)
+		await wal.close()
+	membership = [[0, [[0, None, None], [1, None, None]]], [12, [[1, '127.0.0.1', 50001]]]]
+	for written in (None, membership):
+		with tempfile.TemporaryDirectory() as directory:
+			asyncio.run(write(directory, written))
+			assert Write_ahead_log(directory).open().membership == written
+
+# records appended and synced while a snapshot is being written are not
+# covered by it and must survive
+def test_append_during_snapshot():
+	async def write(directory):
+		wal = Write_ahead_log(directory)
+		wal.open()
+		await wal.start()
+		blocks = make_blocks(8)
+		for block in blocks[:4]:
+			wal.append_view(block.view)
+			wal.append_block(block)
+		snapshot = asyncio.ensure_future(wal.snapshot(
+			blocks[3], 4, {}, make_qc(blocks[3]), make_qc(blocks[3]), 4
+		))
+		# the snapshot has made its cut and is waiting on the disk
+		await asyncio.sleep(0)
+		for block in blocks[4:]:
+			wal.append_view(block.view)
+			wal.append_block(block)
+			await wal.sync()
+		await snapshot
+		wal.append_view(9)
+		await wal.sync()
+		# no close, as if the process died here
+		return blocks
+	with tempfile.TemporaryDirectory() as directory:
+		blocks = asyncio.run(write(directory))
+		wal = Write_ahead_log(directory)
+		recovered = wal.open()
+		wal.file.close()
+		assert recovered.base_height == 4 and recovered.view == 9
+		assert [b.hash for b in recovered.blocks] == [b.hash for b in blocks[4:]]
+		assert wal.segments() == [1]
+
+# a crash between the new segment and the new snapshot replays both segments
+def test_crash_before_snapshot_written():
+	async def write(directory):
+		wal = Write_ahead_log(directory)
+		wal.open()
+		await wal.start()
+		blocks = make_blocks(6)
+		for block in blocks[:3]:
+			wal.append_block(block)
+		def crash(data):
+			raise OSError("crashed")
+		wal.write_snapshot = crash
+		try:
+			await wal.snapshot(blocks[2], 3, {}, make_qc(blocks[2]), make_qc(blocks[2]), 3)
+			assert False
+		except OSError:
+			pass
+		for block in blocks[3:]:
+			wal.append_block(block)
+		await wal.sync()
+		return blocks
+	with tempfile.TemporaryDirectory() as directory:
+		blocks = asyncio.run(write(directory))
+		wal = Write_ahead_log(directory)
+		recovered = wal.open()
+		wal.file.close()
+		assert recovered.base_height == 0
+		assert [b.hash for b in recovered.blocks] == [b.hash for b in blocks]
+
+def test_torn_tail():
+	with tempfile.TemporaryDirectory() as directory:
+		blocks = make_blocks(5)
+		asyncio.run(write_log(directory, blocks))
+		path = os.path.join(directory, LOG_FILE % 0)
+		with open(path, 'ab') as f:
+			f.write(b"\x00\x00\x01\x00garbage")
+		size = os.path.getsize(path)
+		wal = Write_ahead_log(directory)
+		recovered = wal.open()
+		wal.file.close()
+		assert len(recovered.blocks) == 5
+		assert os.path.getsize(path) < size
+
+async def append_throughput(directory, records, concurrency):
+	wal = Write_ahead_log(directory)
+	wal.open()
+	await wal.start()
+	block = make_blocks(1)[0]
+	qc = make_qc(block)
+
+	# every writer waits for its record to be durable, like a voting replica
+	async def writer(count):
+		for _ in range(count):
+			wal.append_qc(RECORD_LOCKED_QC, qc)
+			await wal.sync()
+
+	start = time.perf_counter()
+	await asyncio.gather(*[writer(records // concurrency) for _ in range(concurrency)])
+	elapsed = time.perf_counter() - start
+	await wal.close()
+	return records / elapsed
+
+def benchmark():
+	for concurrency in [1, 8, 64]:
+		with tempfile.TemporaryDirectory() as directory:
+			rate = asyncio.run(append_throughput(directory, 2048, concurrency))
+			print(f"durable appends, {concurrency:>2} writers: {rate:>10.0f}/s")
+
+	blocks = make_blocks(10000)
+	for interval in [len(blocks) + 1, 1000]:
+		with tempfile.TemporaryDirectory() as directory:
+			asyncio.run(write_log(directory, blocks, interval))
+			start = time.perf_counter()
+			wal = Write_ahead_log(directory)
+			recovered = wal.open()
+			elapsed = time.perf_counter() - start
+			wal.file.close()
+			print(f"startup, {len(recovered.blocks):>5} blocks to replay: "
+			      f"{elapsed * 1000:>8.1f} ms")
+
+if __name__ == "__main__":
+	benchmark()
@@ -0,0 +1,63 @@
+import asyncio
+from hotstuff.hotstuff_types import *
+from hotstuff.replica import *
+from hotstuff.simulation import *
+
+def message(phase, view):
+	return Message(phase, view, None, GENESIS_QC, sender=1)
+
+def test_buffers_future_views():
+	buffer = View_buffer(max_views=4)
+	assert buffer.add(message(Protocol_phase.PREPARE, 3), 1)
+	assert buffer.add(message(Protocol_phase.NEW_VIEW, 5), 1)
+	assert len(buffer) == 2
+	# too far ahead
+	assert not buffer.add(message(Protocol_phase.PREPARE, 6), 1)
+	assert len(buffer) == 2
+
+def test_drain_in_phase_order():
+	buffer = View_buffer()
+	for phase in (Protocol_phase.DECIDE, Protocol_phase.PREPARE, Protocol_phase.NEW_VIEW):
+		buffer.add(message(phase, 2), 1)
+	buffer.add(message(Protocol_phase.PREPARE, 3), 1)
+	assert [msg.phase for msg in buffer.drain(2)] == \
+		[Protocol_phase.NEW_VIEW, Protocol_phase.PREPARE, Protocol_phase.DECIDE]
+	assert len(buffer) == 1 and buffer.drain(2) == []
+
+def test_drain_evicts_stale_views():
+	buffer = View_buffer()
+	for view in (2, 3, 4):
+		buffer.add(message(Protocol_phase.PREPARE, view), 1)
+	# we skipped straight to view 4
+	assert [msg.view_number for msg in buffer.drain(4)] == [4]
+	assert len(buffer) == 0 and buffer.views == {}
+
+def test_per_view_bound():
+	buffer = View_buffer(max_per_view=3)
+	added = [buffer.add(message(Protocol_phase.PREPARE_VOTE, 2), 1) for _ in range(5)]
+	assert added == [True, True, True, False, False]
+	# other views have their own room
+	assert buffer.add(message(Protocol_phase.PREPARE_VOTE, 3), 1)
+	assert len(buffer) == 4
+
+# a replica holds on to a message from the next view and handles it once
+# it gets there
+def test_replica_replays_on_entering_view():
+	simulation = Simulation(seed=1)
+	config = Cluster_config.simulated(range(4))
+	replica = Replica(0, Simulated_network(0, simulation, config))
+	handled = []
+	async def handle(msg):
+		handled.append(msg.view_number)
+	replica.handlers[Protocol_phase.NEW_VIEW] = handle
+	async def main():
+		replica.current_view = 1
+		await replica.dispatch(message(Protocol_phase.NEW_VIEW, 2))
+		buffered = (len(replica.future_msgs), list(handled))
+		replica.enter_view(2)
+		await replica.dispatch(await replica.network.inbox.get())
+		replica.pacemaker.stop_timer()
+		return buffered
+	buffered = simulation.run(main())
+	assert buffered == (1, []) and handled == [2]
+	assert len(replica.future_msgs) == 0
@@ -0,0 +1,38 @@
+from hotstuff.hotstuff_types import *
+from hotstuff.votes import *
+
+PHASE = Protocol_phase.PREPARE_VOTE
+
+def make_collector():
+	# n = 4, f = 1, quorum of 3
+	return Vote_collector(lambda view: Signature(4, 1))
+
+def test_fires_once_at_quorum():
+	votes = make_collector()
+	assert votes.add(1, PHASE, "a", (0, b"s0")) is None
+	assert votes.add(1, PHASE, "a", (1, b"s1")) is None
+	sig = votes.add(1, PHASE, "a", (2, b"s2"))
+	assert sig is not None and sorted(sig.combined) == [0, 1, 2]
+	assert votes.add(1, PHASE, "a", (3, b"s3")) is None
+
+def test_sender_counted_once():
+	votes = make_collector()
+	for _ in range(3):
+		assert votes.add(1, PHASE, "a", (0, b"s0")) is None
+	assert votes.add(1, PHASE, "a", (1, b"s1")) is None
+	assert votes.add(1, PHASE, "a", (2, b"s2")) is not None
+
+def test_tallies_are_separate():
+	votes = make_collector()
+	votes.add(1, PHASE, "a", (0, b"s0"))
+	votes.add(1, PHASE, "b", (1, b"s1"))
+	votes.add(2, PHASE, "a", (2, b"s2"))
+	votes.add(1, Protocol_phase.COMMIT_VOTE, "a", (3, b"s3"))
+	assert len(votes) == 4
+
+def test_prune_drops_old_views():
+	votes = make_collector()
+	for view in range(1, 6):
+		votes.add(view, PHASE, "a", (0, b"s0"))
+	votes.prune(4)
+	assert sorted(votes.views) == [4, 5]